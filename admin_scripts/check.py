@@ -3,14 +3,13 @@ if len(argv) != 3:
     print("Usage: check.py config.ini mc-version")
 
 import re
-import requests
 from packassembler.schema import *
+from packassembler import outbound
 from pyramid.paster import bootstrap
 
 env = bootstrap(argv[1])
-connect('', host=env['registry'].settings.get('mongodb', 'packassembler'))
 
-d = requests.get('http://bot.notenoughmods.com/{0}.json'.format(argv[2])).json()
+d = outbound.get('http://bot.notenoughmods.com/{0}.json'.format(argv[2])).json()
 
 name_dict = {}
 clean_regex = re.compile("[!@#$-']")
@@ -0,0 +1,54 @@
+from sys import argv, exit
+if len(argv) not in (2, 3) or argv[2:] not in ([], ['merge']):
+    print("Usage: dedupe_versions.py config.ini [merge]")
+    print("Lists mods with a version number added more than once, which keep")
+    print("the unique (mod, version) index from being built. With merge, builds")
+    print("are moved to the oldest of each, the others are deleted and the index")
+    print("is built.")
+    exit(2)
+
+from pyramid.paster import bootstrap
+from packassembler.schema import *
+from packassembler import storage
+
+# The unique index can't be built before the duplicates are gone
+ModVersion._meta['auto_create_index'] = False
+
+env = bootstrap(argv[1])
+
+duplicates = ModVersion.objects.aggregate(
+    {'$group': {'_id': {'mod': '$mod', 'version': '$version'},
+                'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+    {'$match': {'count': {'$gt': 1}}})
+
+found = 0
+for group in duplicates:
+    found += 1
+    kept, others = min(group['ids']), sorted(group['ids'])[1:]
+    print('{0} {1}: keeping {2}, {3} duplicates'.format(
+        group['_id']['mod'], group['_id']['version'], kept, len(others)))
+    if argv[2:] != ['merge']:
+        continue
+
+    # Builds deny deleting their versions, move them to the kept one
+    for build in PackBuild.objects(mod_versions__in=others).only('mod_versions').as_pymongo():
+        ids = []
+        for mv_id in build['mod_versions']:
+            mv_id = kept if mv_id in others else mv_id
+            if mv_id not in ids:
+                ids.append(mv_id)
+        PackBuild.objects(id=build['_id']).update_one(
+            __raw__={'$set': {'mod_versions': ids}})
+
+    with storage.detached_mod_files(ModVersion.objects(id__in=others)):
+        for mv in ModVersion.objects(id__in=others):
+            mv.delete()
+
+if argv[2:] == ['merge']:
+    ModVersion.ensure_indexes()
+    print('{0} duplicated versions merged, index built'.format(found))
+else:
+    print('{0} duplicated versions'.format(found))
+
+env['closer']()
+exit(0 if argv[2:] == ['merge'] or not found else 1)
@@ -0,0 +1,171 @@
+from sys import argv, exit
+if len(argv) not in (2, 3):
+    print("Usage: explain.py config.ini [report.txt]")
+    print("Explains the queries each view makes against the configured database")
+    print("and reports collection scans, in-memory sorts and queries that")
+    print("examine many more documents than they return.")
+    exit(2)
+
+from pyramid.paster import bootstrap
+from packassembler.views.common import ref_id
+from packassembler.schema import *
+from mongoengine import Q
+from datetime import datetime
+
+REPORT = argv[2] if len(argv) > 2 else 'explain-report.txt'
+# Documents examined per document returned above which a query is flagged
+RATIO = 10
+# Case insensitive substring searches can't use an index, so these scan the
+# collection by design and are reported without being flagged
+EXPECTED_SCANS = {
+    ('modlist', 'search'),
+    ('packlist', 'search'),
+    ('serverlist', 'search'),
+    ('userlist', 'search'),
+    ('viewmod', 'by the same author')
+}
+
+env = bootstrap(argv[1])
+
+# Sample documents the queries are about
+user = User.objects.first()
+mod = Mod.objects(versions__0__exists=True).first()
+mv = mod.versions[-1] if mod else None
+pack = Pack.objects(builds__0__exists=True).first()
+now = datetime.now()
+
+
+def queries():
+    """
+    Yields the view or task, a description and the queryset of each query.
+    Each is written out to match the code named above it, so keep them in step.
+    """
+    # views/mods.py ModViews.modlist, with each filter it can add
+    yield 'modlist', 'all mods', Mod.objects
+    yield 'modlist', 'search', Mod.objects(Q(name__icontains='craft') | Q(author__icontains='craft'))
+    yield 'modlist', 'outdated', Mod.objects(outdated=True)
+    yield 'modlist', 'versions for a Minecraft version', ModVersion.objects(mc_version=MCVERSIONS[0])
+    yield 'modlist', 'mods with those versions', Mod.objects(
+        versions__in=ModVersion.objects(mc_version=MCVERSIONS[0]).limit(100))
+    # views/mods.py ModViews.qmlist
+    yield 'qmlist', 'all mods', Mod.objects
+    # views/packs.py PackViews.packlist
+    yield 'packlist', 'search', Pack.objects(name__icontains='pack')
+    # views/servers.py ServerViews.serverlist
+    yield 'serverlist', 'search', Server.objects(name__icontains='server')
+    # views/user.py UserViews.userlist
+    yield 'userlist', 'search', User.objects(username__icontains='user')
+    # security.py check_pass, also form.py and views/user.py sendreset by email
+    yield 'login', 'by email', User.objects(email='nobody@example.com')
+    yield 'login', 'by username', User.objects(username='nobody')
+    # security.py token_user
+    yield 'token', 'by digest', ApiToken.objects(digest='0' * 64)
+    # profiling.py, on every refresh of the profiler settings
+    yield 'maintenance', 'profiler setting', Setting.objects(key='profiler')
+    # jobs.py claim
+    yield 'worker', 'next job', Job.objects(status='queued').order_by('created')
+    # mail.py claim
+    yield 'worker', 'next mail', OutboundMail.objects(status='queued', next_attempt__lte=now).order_by('next_attempt')
+    # notifications.py send_digests
+    yield 'worker', 'due digests', PendingNotification.objects(created__lte=now)
+    if user:
+        # views/user.py UserViews.profile
+        yield 'profile', 'mods', Mod.objects(owner=user)
+        yield 'profile', 'packs', Pack.objects(owner=user)
+        yield 'profile', 'servers', Server.objects(owner=user)
+        # views/user.py UserViews.edituser
+        yield 'edituser', 'tokens', ApiToken.objects(owner=user).order_by('created')
+        # views/admin.py clean_users
+        yield 'clean_users', 'mods of a user', Mod.objects(owner=user)
+        # notifications.py send_digests
+        yield 'worker', 'digest of an owner', PendingNotification.objects(owner=user).order_by('mod_name')
+    if mod:
+        # views/mods.py ModViews.viewmod
+        yield 'viewmod', 'by the same author', Mod.objects(author__icontains=mod.author)
+        yield 'viewmod', 'packs with the mod', Pack.objects(mods=mod)
+        # views/common.py ViewBase.check_depends, then the DENY rule on Pack.mods
+        yield 'deletemod', 'packs depending on the mod', Pack.objects(mods=mod)
+        # schema.py delete rules on ModVersion.mod (CASCADE) and ModVersion.depends (PULL)
+        yield 'deletemod', 'versions of the mod', ModVersion.objects(mod=mod)
+        yield 'deletemod', 'versions depending on the mod', ModVersion.objects(depends=mod)
+        # views/modversions.py version_exists
+        yield 'addversion', 'version exists', ModVersion.objects(mod=mod, version='1.0.0').only('id')
+    if mv:
+        # views/common.py ViewBase.check_depends, then the DENY rule on PackBuild.mod_versions
+        yield 'deleteversion', 'builds with the version', PackBuild.objects(mod_versions=mv)
+        if mv.jar:
+            # jars.py mods_providing and conflicting_mods
+            yield 'versiondetails', 'versions with the same mod ids', ModVersion.objects(
+                jar__mod_ids__in=mv.jar.mod_ids, mod__ne=mv.mod)
+            yield 'versiondetails', 'versions sharing packages', ModVersion.objects(
+                jar__packages__in=mv.jar.packages, mod__ne=mv.mod)
+    if pack:
+        build = pack.builds[-1]
+        # views/packbuilds.py PackBuildViews.buildbyrev
+        yield 'buildbyrev', 'build by revision', PackBuild.objects(pack=pack, revision=build.revision)
+        # views/packbuilds.py build_versions
+        yield 'downloadbuild', 'mods of the build', Mod.objects(
+            id__in=[ref_id(v, 'mod') for v in build.mod_versions]).only('id', 'name', 'rid', 'target')
+        # schema.py NULLIFY rule on Server.build
+        yield 'deletebuild', 'servers using the build', Server.objects(build=build)
+        # schema.py PULL rule on Pack.bases
+        yield 'deletepack', 'packs based on the pack', Pack.objects(bases=pack)
+
+
+def stages(plan):
+    """ Every stage of a query plan, however it is nested. """
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from stages(value)
+
+
+def check(queryset, scan_expected=False):
+    """
+    Returns a summary of how queryset runs, what is wrong with it and what is
+    only to be expected of it.
+    """
+    explain = queryset.explain()
+    planner = explain.get('queryPlanner', {})
+    plan = list(stages(planner.get('winningPlan', {})))
+    execution = explain.get('executionStats', {})
+    examined = execution.get('totalDocsExamined', 0)
+    returned = execution.get('nReturned', 0)
+
+    problems, expected = [], []
+    scans = expected if scan_expected else problems
+    if 'COLLSCAN' in plan:
+        scans.append('collection scan')
+    if 'SORT' in plan:
+        problems.append('in-memory sort')
+    if examined > RATIO * max(returned, 1):
+        scans.append('examined {0} documents for {1}'.format(examined, returned))
+    summary = '{0}, {1} examined, {2} returned, {3} ms'.format(
+        ' > '.join(reversed(plan)), examined, returned, execution.get('executionTimeMillis', '?'))
+    return summary, problems, expected
+
+
+flagged = 0
+lines = ['Query plans, {0:%Y-%m-%d %H:%M}'.format(now), '']
+for view, description, queryset in queries():
+    summary, problems, expected = check(queryset, (view, description) in EXPECTED_SCANS)
+    flagged += bool(problems)
+    lines.append('{0}: {1} ({2})'.format(view, description, queryset._document._get_collection_name()))
+    lines.append('  ' + summary)
+    for problem in problems:
+        lines.append('  ! ' + problem)
+    for note in expected:
+        lines.append('  - expected ' + note)
+lines += ['', '{0} queries flagged'.format(flagged)]
+
+with open(REPORT, 'w') as f:
+    f.write('\n'.join(lines) + '\n')
+print('\n'.join(lines))
+print('Saved to ' + REPORT)
+
+env['closer']()
+exit(1 if flagged else 0)
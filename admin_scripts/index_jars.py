@@ -0,0 +1,28 @@
+from sys import argv, exit
+if len(argv) != 2:
+    print("Usage: index_jars.py config.ini")
+    print("Reads the jar contents of stored mod files that were stored before")
+    print("jars were indexed. Versions that only link to their file are counted.")
+    exit(2)
+
+from pyramid.paster import bootstrap
+from packassembler.jars import read_jar
+from packassembler.schema import *
+
+env = bootstrap(argv[1])
+
+indexed = unreadable = linked = 0
+for mv in ModVersion.objects(jar__exists=False).only('id', 'mod_file', 'mod_file_url'):
+    if not mv.mod_file:
+        linked += bool(mv.mod_file_url)
+        continue
+    grid_out = mv.mod_file.get()
+    jar = read_jar(grid_out, grid_out.length)
+    if jar is None:
+        unreadable += 1
+        continue
+    ModVersion.objects(id=mv.id).update_one(set__jar=jar)
+    indexed += 1
+
+print('{0} versions indexed, {1} not jars, {2} only linked'.format(indexed, unreadable, linked))
+env['closer']()
@@ -0,0 +1,73 @@
+from sys import argv, exit
+if len(argv) not in (2, 3) or argv[2:] not in ([], ['create']):
+    print("Usage: indexes.py config.ini [create]")
+    print("Reports missing, unused and redundant indexes. With create, builds")
+    print("the missing ones in the background first.")
+    exit(2)
+
+from pyramid.paster import bootstrap
+from packassembler.schema import *
+
+DOCUMENTS = (User, ApiToken, Revocation, ModVersion, Mod, PackBuild, Pack,
+             Server, Setting, Job, OutboundMail, PendingNotification)
+
+env = bootstrap(argv[1])
+
+
+def key_of(fields):
+    return tuple((name, int(direction) if isinstance(direction, (int, float)) else direction)
+                 for name, direction in fields)
+
+
+def create_indexes(cls):
+    collection = cls._get_collection()
+    for spec in cls._meta['index_specs']:
+        options = dict(spec)
+        fields = options.pop('fields')
+        options['background'] = True
+        print('  creating {0}'.format(key_of(fields)))
+        collection.create_index(fields, **options)
+
+
+def audit(cls):
+    collection = cls._get_collection()
+    declared = set(key_of(fields) for fields in cls.list_indexes())
+    existing = dict((name, info) for name, info in collection.index_information().items()
+                    if name != '_id_')
+    keys = dict((name, key_of(info['key'])) for name, info in existing.items())
+    uses = dict((s['name'], s['accesses']) for s in collection.aggregate([{'$indexStats': {}}]))
+
+    problems = []
+    for key in sorted(declared - set(keys.values()) - {(('_id', 1),)}):
+        problems.append('missing    {0}'.format(key))
+    for name, key in sorted(keys.items()):
+        info = existing[name]
+        if key not in declared:
+            problems.append('undeclared {0} {1}'.format(name, key))
+        accesses = uses.get(name)
+        if accesses is not None and accesses['ops'] == 0:
+            problems.append('unused     {0} {1}, since {2:%Y-%m-%d %H:%M}'.format(
+                name, key, accesses['since']))
+        # An index is redundant when another starts with the same fields,
+        # unless it enforces something the other doesn't
+        if not (info.get('unique') or info.get('sparse') or 'expireAfterSeconds' in info
+                or 'partialFilterExpression' in info):
+            longer = [other for other, other_key in keys.items()
+                      if other != name and len(other_key) > len(key) and other_key[:len(key)] == key]
+            if longer:
+                problems.append('redundant  {0} {1}, covered by {2}'.format(name, key, ', '.join(sorted(longer))))
+    return problems
+
+
+clean = True
+for cls in DOCUMENTS:
+    print(cls._get_collection_name())
+    if argv[2:] == ['create']:
+        create_indexes(cls)
+    problems = audit(cls)
+    for problem in problems:
+        print('  ' + problem)
+    clean = clean and not problems
+
+env['closer']()
+exit(0 if clean else 1)
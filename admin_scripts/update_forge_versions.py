@@ -1,12 +1,12 @@
-import requests
 from packassembler.schema import *
+from packassembler import outbound
 
 connect('mmltest')
 
 URL = 'http://files.minecraftforge.net/minecraftforge/json'
 KEY = 'forgeversions'
 
-raw_build_data = requests.get(URL).json()['builds']
+raw_build_data = outbound.get(URL).json()['builds']
 build_data = {}
 
 for build in raw_build_data:
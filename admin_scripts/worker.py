@@ -0,0 +1,17 @@
+from sys import argv, exit
+if len(argv) != 2:
+    print("Usage: worker.py config.ini")
+    exit(2)
+
+from pyramid.paster import bootstrap
+from packassembler import jobs, mail, notifications
+from functools import partial
+
+env = bootstrap(argv[1])
+settings = env['registry'].settings
+
+outbox = mail.Outbox(settings)
+digests = partial(notifications.send_digests,
+                  notifications.digest_window(settings))
+# Digests are queued as mail, so send them first
+jobs.work(tasks=[digests, outbox.drain])
@@ -0,0 +1,139 @@
+"""
+Fills a database with a synthetic catalog for the other benchmarks: users,
+mods with many versions, chains of base packs and packs with long build
+histories. The database is emptied first, so unless its name has "bench" in
+it the script refuses to run without --force.
+
+Mods come in blocks of BLOCK. Versions only depend on the first mod of their
+block and packs take whole blocks, so every generated build is complete.
+
+Usage: catalog.py [--force] [mongodb-uri] [users] [mods] [versions-per-mod] [base-depth] [builds-per-pack]
+"""
+from sys import argv, exit
+from random import Random
+from datetime import datetime, timedelta
+from bson import ObjectId
+from mongoengine import connect
+from pymongo.uri_parser import parse_uri
+from packassembler.security import password_hash
+from packassembler.schema import *
+import hashlib
+import time
+
+FORCE = '--force' in argv
+args = [arg for arg in argv if arg != '--force']
+HOST = args[1] if len(args) > 1 else 'mongodb://localhost/packassembler_bench'
+USERS = int(args[2]) if len(args) > 2 else 1000
+MODS = int(args[3]) if len(args) > 3 else 10000
+VERSIONS = int(args[4]) if len(args) > 4 else 10
+DEPTH = int(args[5]) if len(args) > 5 else 6
+BUILDS = int(args[6]) if len(args) > 6 else 200
+
+DATABASE = parse_uri(HOST)['database']
+if not FORCE and 'bench' not in (DATABASE or ''):
+    print('Refusing to empty {0!r}, which does not look like a benchmark database. '
+          'Name it *bench* or pass --force.'.format(DATABASE))
+    exit(2)
+
+# Mods per block, see above
+BLOCK = 20
+# Blocks each pack adds to its bases
+PACK_BLOCKS = 2
+# Chains of base packs, each DEPTH deep with a pack on top
+CHAINS = 10
+# Documents per insert
+BATCH = 1000
+
+random = Random(0)
+
+
+def insert(cls, docs):
+    for i in range(0, len(docs), BATCH):
+        cls.objects.insert(docs[i:i + BATCH], load_bulk=False)
+
+
+def make_users(password):
+    now = datetime.now()
+    return [User(id=ObjectId(), username='benchuser{0}'.format(i), password=password,
+                 email='benchuser{0}@example.com'.format(i),
+                 group='contributor' if i % 50 == 0 else 'user',
+                 # Some have not logged in for long, for clean_users
+                 last_login=now - timedelta(days=random.randint(0, 90)))
+            for i in range(USERS)]
+
+
+def make_mods(users):
+    mods, versions = [], []
+    for i in range(MODS):
+        mod = Mod(id=ObjectId(), name='Bench Mod {0}'.format(i), rid='benchmod{0}'.format(i),
+                  author='Author {0}'.format(i % 500), url='http://example.com/mods/{0}'.format(i),
+                  description='Synthetic mod number {0}.'.format(i),
+                  target=TARGETS[i % len(TARGETS)], outdated=i % 7 == 0,
+                  # Most users own nothing, so clean_users has work to do
+                  owner=random.choice(users[:len(users) // 4 or 1]))
+        first = mods[i - i % BLOCK] if i % BLOCK else None
+        for n in range(VERSIONS):
+            url = 'http://example.com/files/{0}-{1}.jar'.format(i, n)
+            versions.append(ModVersion(
+                id=ObjectId(), mod=mod, version='1.{0}.0'.format(n),
+                mc_version=MCVERSIONS[n % len(MCVERSIONS)], devel=n % 4 == 3,
+                depends=[first] if first is not None else [], mod_file_url=url,
+                mod_file_url_md5=hashlib.md5(url.encode()).hexdigest()))
+            mod.versions.append(versions[-1])
+        mods.append(mod)
+    return mods, versions
+
+
+def make_packs(users, mods):
+    blocks = [mods[i:i + BLOCK] for i in range(0, len(mods), BLOCK)]
+    # clean_users leaves contributors, and their packs, alone
+    owners = [user for user in users if user.group == 'contributor']
+    packs, builds = [], []
+    for chain in range(CHAINS):
+        # No mod appears twice in a chain
+        chain_blocks = random.sample(blocks, PACK_BLOCKS * (DEPTH + 1))
+        bases = []
+        for level in range(DEPTH + 1):
+            top = level == DEPTH
+            n = len(packs)
+            pack = Pack(id=ObjectId(), name='Bench Pack {0}'.format(n), rid='benchpack{0}'.format(n),
+                        owner=random.choice(owners), base=not top, bases=bases[-1:],
+                        mods=[mod for block in chain_blocks[level * PACK_BLOCKS:(level + 1) * PACK_BLOCKS]
+                              for mod in block])
+            packs.append(pack)
+            bases.append(pack)
+        # Every mod of the chain, as get_mods finds them
+        chain_mods = [mod for base in bases for mod in base.mods]
+        # No config, generate_mcu_xml would fetch it to hash it, timing the
+        # network instead of the code
+        for revision in range(1, BUILDS + 1):
+            build = PackBuild(id=ObjectId(), pack=pack, revision=revision,
+                              mc_version='1.7.10', forge_version='10.13.2.1291',
+                              mod_versions=[random.choice(mod.versions) for mod in chain_mods])
+            builds.append(build)
+            pack.builds.append(build)
+        pack.latest = BUILDS
+    return packs, builds
+
+
+def timed(message, function, *args):
+    start = time.monotonic()
+    result = function(*args)
+    print('{0} in {1:.1f}s'.format(message, time.monotonic() - start))
+    return result
+
+
+connect('', host=HOST)
+for cls in (User, Mod, ModVersion, Pack, PackBuild, Server):
+    cls.drop_collection()
+    cls.ensure_indexes()
+
+# One hash for everyone, hashing each would take minutes
+users = make_users(password_hash('benchmark'))
+timed('{0} users'.format(USERS), insert, User, users)
+mods, versions = make_mods(users)
+timed('{0} versions'.format(len(versions)), insert, ModVersion, versions)
+timed('{0} mods'.format(MODS), insert, Mod, mods)
+packs, builds = make_packs(users, mods)
+timed('{0} builds'.format(len(builds)), insert, PackBuild, builds)
+timed('{0} packs'.format(len(packs)), insert, Pack, packs)
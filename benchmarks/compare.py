@@ -0,0 +1,46 @@
+"""
+Compares two results files saved by scenarios.py, flagging scenarios whose
+median time or query count grew by more than the threshold.
+
+Usage: compare.py old.json new.json [threshold-percent]
+"""
+from sys import argv, exit
+import json
+
+if len(argv) < 3:
+    print("Usage: compare.py old.json new.json [threshold-percent]")
+    exit(2)
+
+THRESHOLD = float(argv[3]) / 100 if len(argv) > 3 else 0.1
+
+with open(argv[1]) as f:
+    old = json.load(f)
+with open(argv[2]) as f:
+    new = json.load(f)
+
+
+def change(before, after):
+    return (after - before) / before if before else 0.0
+
+
+print('{0} -> {1}'.format(old.get('commit'), new.get('commit')))
+if old['catalog'] != new['catalog']:
+    print('Warning: the catalogs differ, {0} and {1}'.format(old['catalog'], new['catalog']))
+
+regressed = []
+for name in sorted(set(old['scenarios']) | set(new['scenarios'])):
+    if name not in old['scenarios'] or name not in new['scenarios']:
+        print('{0:>16}: only in {1}'.format(name, argv[1] if name in old['scenarios'] else argv[2]))
+        continue
+    before, after = old['scenarios'][name], new['scenarios'][name]
+    timing = change(before['median'], after['median'])
+    queries = change(before['queries'], after['queries'])
+    flag = ''
+    if timing > THRESHOLD or queries > THRESHOLD:
+        flag = '  REGRESSED'
+        regressed.append(name)
+    print('{0:>16}: {1:9.1f} -> {2:9.1f} ms ({3:+.0%}), {4:.0f} -> {5:.0f} queries{6}'.format(
+        name, before['median'] * 1000, after['median'] * 1000, timing,
+        before['queries'], after['queries'], flag))
+
+exit(1 if regressed else 0)
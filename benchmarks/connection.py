@@ -0,0 +1,38 @@
+"""
+Compares calling connect() before every query, as ViewBase and find_group
+used to, with connecting once per process.
+
+Usage: connection.py [mongodb-uri] [iterations]
+"""
+from sys import argv
+from timeit import timeit
+from mongoengine import connect
+from packassembler.schema import User
+
+HOST = argv[1] if len(argv) > 1 else 'mongodb://localhost/packassembler_bench'
+N = int(argv[2]) if len(argv) > 2 else 5000
+
+
+def query():
+    User.objects(username='nobody').first()
+
+
+def connect_per_request():
+    # Twice, once for the auth callback and once for the view
+    connect('', host=HOST)
+    connect('', host=HOST)
+    query()
+
+
+connect('', host=HOST)
+# Warm up the pool
+query()
+
+results = [
+    ('connect() per request', timeit(connect_per_request, number=N)),
+    ('connect() per process', timeit(query, number=N))
+]
+for name, total in results:
+    print('{0:>24}: {1:8.1f} us/request'.format(name, total / N * 1e6))
+print('{0:>24}: {1:8.1f} us/request'.format(
+    'saved', (results[0][1] - results[1][1]) / N * 1e6))
@@ -0,0 +1,42 @@
+"""
+Measures password checks per second at different bcrypt work factors, with
+many request threads checking at once through the bounded hasher. Checks
+turned away with Overloaded are counted separately.
+
+Usage: login.py [threads] [seconds]
+"""
+from sys import argv
+from threading import Thread
+from packassembler.security import Hasher, Overloaded
+import time
+
+THREADS = int(argv[1]) if len(argv) > 1 else 16
+SECONDS = float(argv[2]) if len(argv) > 2 else 5
+ROUNDS = (10, 11, 12, 13)
+
+
+def run(hasher, hashed, counts, deadline):
+    while time.monotonic() < deadline:
+        try:
+            hasher.check('secret', hashed)
+            counts['ok'] += 1
+        except Overloaded:
+            counts['rejected'] += 1
+            # A client would back off before retrying
+            time.sleep(0.01)
+
+
+for rounds in ROUNDS:
+    hasher = Hasher(rounds)
+    hashed = hasher.hash('secret')
+    counts = {'ok': 0, 'rejected': 0}
+    deadline = time.monotonic() + SECONDS
+    threads = [Thread(target=run, args=(hasher, hashed, counts, deadline))
+               for _ in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    hasher.executor.shutdown()
+    print('rounds {0:>2}: {1:8.1f} logins/s, {2:8.1f} rejected/s'.format(
+        rounds, counts['ok'] / SECONDS, counts['rejected'] / SECONDS))
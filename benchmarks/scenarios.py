@@ -0,0 +1,181 @@
+"""
+Times the views and helpers that slow down as the catalog grows, against a
+catalog made by catalog.py, and saves the results as JSON for compare.py.
+Point the config's mongodb setting at the benchmark database.
+
+Usage: scenarios.py config.ini [results.json] [repeat]
+"""
+from sys import argv, exit
+if len(argv) < 2:
+    print("Usage: scenarios.py config.ini [results.json] [repeat]")
+    exit(2)
+
+from pyramid.request import apply_request_extensions
+from pyramid.renderers import render
+from pyramid.paster import bootstrap
+from pyramid.config import Configurator
+from packassembler import CustomRequest, instrumentation
+from packassembler.views.packbuilds import PackBuildViews, generate_build, generate_mcu_xml
+from packassembler.views.mods import ModViews
+from packassembler.views.admin import clean_users
+from packassembler.schema import *
+from datetime import datetime
+from statistics import median
+import subprocess
+import json
+
+OUTPUT = argv[2] if len(argv) > 2 else 'benchmark-{0:%Y%m%d-%H%M%S}.json'.format(datetime.now())
+REPEAT = int(argv[3]) if len(argv) > 3 else 5
+
+env = bootstrap(argv[1])
+registry = env['registry']
+
+
+def make_request(path='/', matchdict=None, post=None):
+    request = CustomRequest.blank(path, POST=post)
+    request.registry = registry
+    request.matchdict = matchdict or {}
+    apply_request_extensions(request)
+    return request
+
+
+def log_in(user):
+    config = Configurator(registry=registry)
+    config.testing_securitypolicy(userid=user.username, permissive=True)
+    config.commit()
+
+
+# Subjects
+## The latest build of the pack with the most mods, bases included
+build = max(PackBuild.objects(revision=1), key=lambda pb: len(pb.mod_versions))
+build = PackBuild.objects.get(pack=build.pack, revision=build.pack.latest)
+pack = build.pack
+## The mod with the most versions
+mod = max(Mod.objects.only('id', 'versions'), key=lambda m: len(m.versions))
+
+
+def run_generate_build():
+    generate_build(PackBuild.objects.get(id=build.id))
+
+
+def run_generate_mcu_xml():
+    generate_mcu_xml(make_request(), PackBuild.objects.get(id=build.id))
+
+
+def run_modlist(params=None):
+    request = make_request('/mods?' + (params or ''))
+    render('modlist.mak', ModViews(request).modlist(), request=request)
+
+
+def run_quickmod():
+    ModViews(make_request(matchdict={'id': str(mod.id)})).quickmod()
+
+
+def run_qmlist():
+    ModViews(make_request()).qmlist()
+
+
+def run_addbuild():
+    latest = Pack.objects.get(id=pack.id).builds[-1]
+    post = {'submit': '', 'mc_version': latest.mc_version,
+            'forge_version': latest.forge_version, 'config': latest.config}
+    post.update((str(mv.mod.id), str(mv.id)) for mv in latest.mod_versions)
+    PackBuildViews(make_request(matchdict={'id': str(pack.id)}, post=post)).addbuild()
+
+
+def undo_addbuild():
+    current = Pack.objects.get(id=pack.id)
+    for pb in PackBuild.objects(pack=pack, revision__gt=pack.latest):
+        current.builds.remove(pb)
+        pb.delete()
+    current.latest = pack.latest
+    current.save()
+
+
+users = User._get_collection()
+user_snapshot = []
+
+
+def snapshot_users():
+    user_snapshot[:] = users.find()
+
+
+def run_clean_users():
+    clean_users()
+
+
+def undo_clean_users():
+    existing = set(users.distinct('_id'))
+    missing = [u for u in user_snapshot if u['_id'] not in existing]
+    if missing:
+        users.insert_many(missing)
+
+
+# Name, function, what it needs done first and, if it changes data, what puts it back
+SCENARIOS = [
+    ('generate_build', run_generate_build, None, None),
+    ('generate_mcu_xml', run_generate_mcu_xml, None, None),
+    ('modlist', run_modlist, None, None),
+    ('modlist_search', lambda: run_modlist('q=Mod+12&mc_version=1.7.10'), None, None),
+    ('quickmod', run_quickmod, None, None),
+    ('qmlist', run_qmlist, None, None),
+    ('addbuild', run_addbuild, None, undo_addbuild),
+    ('clean_users', run_clean_users, snapshot_users, undo_clean_users)
+]
+
+
+def measure(function, undo):
+    times, queries = [], []
+    for i in range(REPEAT):
+        with instrumentation.recording() as stats:
+            function()
+        times.append(stats.seconds)
+        queries.append(stats.queries)
+        if undo is not None:
+            undo()
+    return {
+        'min': min(times),
+        'median': median(times),
+        'max': max(times),
+        'queries': median(queries)
+    }
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+log_in(pack.owner)
+results = {
+    'commit': commit(),
+    'created': datetime.now().isoformat(),
+    'repeat': REPEAT,
+    'catalog': dict((cls.__name__, cls.objects.count())
+                    for cls in (User, Mod, ModVersion, Pack, PackBuild)),
+    'build_mods': len(build.mod_versions),
+    'pack_depth': 1,
+    'scenarios': {}
+}
+p = pack
+while p.bases:
+    results['pack_depth'] += 1
+    p = p.bases[0]
+
+for name, function, setup, undo in SCENARIOS:
+    if setup is not None:
+        setup()
+    # Warm up caches and connections
+    function()
+    if undo is not None:
+        undo()
+    result = results['scenarios'][name] = measure(function, undo)
+    print('{0:>16}: {1:9.1f} ms median, {2:9.1f} ms min, {3:6.0f} queries'.format(
+        name, result['median'] * 1000, result['min'] * 1000, result['queries']))
+
+with open(OUTPUT, 'w') as f:
+    json.dump(results, f, indent=2, sort_keys=True)
+print('Saved to ' + OUTPUT)
+env['closer']()
@@ -1,5 +1,6 @@
 from pyramid.request import Request
 from pyramid.config import Configurator
+from .database import connect_from_settings
 
 
 class CustomRequest(Request):
@@ -11,6 +12,7 @@ class CustomRequest(Request):
 
 
 def main(global_config, **settings):
+    connect_from_settings(settings)
     config = Configurator(settings=settings, request_factory=CustomRequest)
     config.include(__name__)
     return config.make_wsgi_app()
@@ -18,7 +20,15 @@ def main(global_config, **settings):
 
 def includeme(config):
     config.include('.security')
+    config.include('.outbound')
+    config.include('.invalidation')
     config.include('.tweens')
+    config.include('.ratelimit')
+    # Last, so its tween sees everything the others do
+    config.include('.instrumentation')
+    config.include('.metrics')
+    # Outside of instrumentation, so profiled requests are timed with it
+    config.include('.profiling')
     config.include('.routes')
     config.include('.views')
     config.include('.sessions')
@@ -0,0 +1,212 @@
+from zipfile import ZipFile, ZipInfo, ZIP_STORED
+from .storage import open_url, iter_file, max_size, Digest
+from hashlib import md5, sha1
+import tempfile
+import os
+
+# Default size of the external file cache, override with bundle.url_cache_size
+URL_CACHE_SIZE = 1024 * 1024 * 1024
+# Default size of the finished bundle cache, override with bundle.build_cache_size
+BUILD_CACHE_SIZE = 4 * 1024 * 1024 * 1024
+
+
+class ZipStream(object):
+
+    """ Unseekable file that collects what ZipFile writes until drained. """
+
+    def __init__(self):
+        self.pos = 0
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def iter_zip(entries):
+    """
+    Yields a zip archive of entries, (name, date_time, size, chunks) tuples,
+    as it is written. Entries are stored uncompressed, jars already are.
+    """
+    out = ZipStream()
+    with ZipFile(out, 'w', ZIP_STORED) as zf:
+        for name, date_time, size, chunks in entries:
+            info = ZipInfo(name, date_time)
+            info.compress_type = ZIP_STORED
+            if size is not None:
+                info.file_size = size
+            with zf.open(info, 'w') as dest:
+                for chunk in chunks:
+                    dest.write(chunk)
+                    yield out.drain()
+    # Data descriptor of the last entry and the central directory
+    yield out.drain()
+
+
+class UrlCache(object):
+
+    """ Disk cache of external files, evicting the least recently used. """
+
+    def __init__(self, directory, max_size=URL_CACHE_SIZE, limit=None):
+        self.directory = directory
+        self.max_size = max_size
+        # Largest file fetched, see storage.max_size
+        self.limit = limit
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, url):
+        return os.path.join(self.directory, md5(url.encode()).hexdigest())
+
+    def open(self, url):
+        path = self.path(url)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            self.fetch(url, path)
+            f = open(path, 'rb')
+        else:
+            # Mark as recently used
+            os.utime(path)
+        return f
+
+    def fetch(self, url, path):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f, open_url(url) as (chunks, length, _):
+                for chunk in Digest(self.limit).wrap(chunks):
+                    f.write(chunk)
+            os.replace(tmp, path)
+        except:
+            os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        evict(self.directory, self.max_size)
+
+
+def evict(directory, max_size):
+    """ Removes the least recently used files in directory beyond max_size bytes. """
+    files = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and not entry.name.endswith('.part'):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def url_chunks(url, cache, limit=None):
+    """ Streams the file at url, raising FileTooLarge past limit bytes. """
+    if cache is None:
+        with open_url(url) as (chunks, length, _):
+            yield from Digest(limit).wrap(chunks)
+    else:
+        with cache.open(url) as f:
+            yield from iter_file(f)
+
+
+def build_entries(versions, cache=None, limit=None):
+    """ Entries of a bundle of versions, (mod version, mod) pairs. """
+    for mv, mod in versions:
+        name = '{0}-{1}.jar'.format(mod.rid, mv.version)
+        date_time = mv.id.generation_time.timetuple()[:6]
+        if mv.mod_file:
+            grid_out = mv.mod_file.get()
+            yield name, date_time, grid_out.length, iter_file(grid_out)
+        else:
+            yield name, date_time, None, url_chunks(mv.mod_file_url, cache, limit)
+
+
+def build_key(pb):
+    """ Identifies the contents of a build, as versions can change files. """
+    h = sha1()
+    for mv in pb.mod_versions:
+        h.update('{0}:{1}\n'.format(mv.id, mv.md5).encode())
+    return '{0}-{1}'.format(pb.id, h.hexdigest())
+
+
+def tee(chunks, path, done=None):
+    """
+    Passes chunks through, saving them to path once all were read. done is
+    called after that.
+    """
+    directory = os.path.dirname(path)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    if done is not None:
+        done()
+
+
+class Bundler(object):
+
+    """ Creates build bundles, caching them when bundle.cache_dir is set. """
+
+    def __init__(self, settings):
+        self.limit = max_size(settings)
+        self.cache_dir = settings.get('bundle.cache_dir')
+        if self.cache_dir:
+            self.builds_dir = os.path.join(self.cache_dir, 'builds')
+            os.makedirs(self.builds_dir, exist_ok=True)
+            self.build_cache_size = int(settings.get('bundle.build_cache_size', BUILD_CACHE_SIZE))
+            self.url_cache = UrlCache(
+                os.path.join(self.cache_dir, 'urls'),
+                int(settings.get('bundle.url_cache_size', URL_CACHE_SIZE)),
+                self.limit)
+        else:
+            self.url_cache = None
+
+    def cached(self, key):
+        """ Returns the path of a finished bundle for key, if there is one. """
+        if self.cache_dir:
+            path = os.path.join(self.builds_dir, key + '.zip')
+            try:
+                # Mark as recently used
+                os.utime(path)
+            except FileNotFoundError:
+                return None
+            return path
+
+    def stream(self, versions, key):
+        """ Streams a bundle of versions, caching it as key. """
+        chunks = iter_zip(build_entries(versions, self.url_cache, self.limit))
+        if self.cache_dir:
+            path = os.path.join(self.builds_dir, key + '.zip')
+            chunks = tee(chunks, path, lambda: evict(self.builds_dir, self.build_cache_size))
+        return chunks
+
+
+def get_bundler(registry):
+    """ The Bundler of registry, made on first use. """
+    bundler = getattr(registry, 'bundler', None)
+    if bundler is None:
+        bundler = registry.bundler = Bundler(registry.settings)
+    return bundler
@@ -0,0 +1,99 @@
+from collections import OrderedDict, namedtuple
+import threading
+import time
+
+# Defaults, override with cache.max_entries and cache.ttl (seconds)
+MAX_ENTRIES = 1000
+TTL = 60
+# Not kept with cached responses
+PRIVATE_HEADERS = ('set-cookie',)
+# Invalidation tags each cached route depends on, see invalidation. Pages
+# of other routes are dropped on any change.
+ROUTE_TAGS = {
+    'home': (),
+    'faq': (),
+    'modlist': ('mods',),
+    # Also lists the author's other mods
+    'viewmod': ('mod:{id}', 'mods', 'packs'),
+    'packlist': ('packs',),
+    'viewpack': ('pack:{id}', 'packs', 'mods'),
+    'serverlist': ('servers',),
+    'viewserver': ('server:{id}', 'packs')
+}
+
+Entry = namedtuple('Entry', 'status headerlist body expires tags')
+
+
+def page_tags(route_name, matchdict):
+    """ Tags a page depends on, None if they are not known. """
+    try:
+        return frozenset(t.format(**matchdict) for t in ROUTE_TAGS[route_name])
+    except KeyError:
+        return None
+
+
+class ResponseCache(object):
+
+    """
+    LRU cache of rendered responses, each kept for up to ttl seconds or until
+    something it depends on changes.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Counts invalidations, so pages rendered during one aren't kept
+        self.generation = 0
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires < time.monotonic():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            return entry
+
+    def set(self, key, response, tags=None, generation=None):
+        """
+        Keeps response for key. If generation, from before the response was
+        rendered, is given and something changed since, it is not kept.
+        """
+        headerlist = [(name, value) for name, value in response.headerlist
+                      if name.lower() not in PRIVATE_HEADERS]
+        entry = Entry(response.status, headerlist, response.body,
+                      time.monotonic() + self.ttl, tags)
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, tags):
+        """ Drops pages that depend on any of tags. """
+        with self.lock:
+            self.generation += 1
+            stale = [key for key, entry in self.entries.items()
+                     if entry.tags is None or entry.tags & tags]
+            for key in stale:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
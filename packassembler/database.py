@@ -0,0 +1,54 @@
+from mongoengine import connect, disconnect
+from pymongo import ReadPreference
+from .instrumentation import query_listener
+import os
+
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primary_preferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondary_preferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST
+}
+# Setting name, MongoClient option
+OPTIONS = (
+    ('mongodb.max_pool_size', 'maxPoolSize'),
+    ('mongodb.connect_timeout', 'connectTimeoutMS'),
+    ('mongodb.socket_timeout', 'socketTimeoutMS'),
+    ('mongodb.server_selection_timeout', 'serverSelectionTimeoutMS')
+)
+
+_connection = None
+
+
+def connection_settings(settings):
+    kwargs = {
+        'host': settings.get('mongodb', 'packassembler'),
+        # Don't open sockets until the first query, so that workers forked
+        # after the app is loaded each get their own
+        'connect': False,
+        # Counts queries per request
+        'event_listeners': [query_listener]
+    }
+    for key, option in OPTIONS:
+        if settings.get(key):
+            kwargs[option] = int(settings[key])
+    if settings.get('mongodb.read_preference'):
+        kwargs['read_preference'] = READ_PREFERENCES[settings['mongodb.read_preference']]
+    return kwargs
+
+
+def connect_from_settings(settings):
+    """ Connects once for the whole process, see main(). """
+    global _connection
+    if _connection is None:
+        _connection = connection_settings(settings)
+        connect('', **_connection)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=reconnect)
+
+
+def reconnect():
+    # A client used before a fork must not be shared with the child
+    disconnect()
+    connect('', **_connection)
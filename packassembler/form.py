@@ -255,5 +255,16 @@ class EditUserAvatarForm(SForm):
         'Avatar', choices=[('0', 'Gravatar'), ('1', 'Minotar')], validators=[validators.required()])
 
 
+class ApiTokenForm(SForm):
+    name = TextField('Name', validators=[validators.required(), validators.Length(max=64)])
+
+
+class ProfilerForm(SForm):
+    enabled = BooleanField('Enabled')
+    rate = FloatField('Percent of requests', default=1,
+                      validators=[validators.NumberRange(min=0, max=100)])
+    routes = TextField('Routes')
+
+
 class EmailUserForm(SForm):
     message = SafeTextAreaField('Message')
@@ -0,0 +1,161 @@
+from pyramid.events import BeforeRender
+from pyramid.settings import asbool
+from contextlib import contextmanager
+from pymongo import monitoring
+import threading
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# Requests making more queries than this are logged, override with
+# instrumentation.query_budget
+QUERY_BUDGET = 50
+
+_local = threading.local()
+
+
+def includeme(config):
+    init_observers(config.registry)
+    config.add_tween('packassembler.instrumentation.instrumentation_tween_factory')
+    config.add_subscriber(render_started, BeforeRender)
+
+
+class RequestStats(object):
+
+    def __init__(self):
+        self.route = None
+        self.status = None
+        self.seconds = 0.0
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.http_requests = 0
+        self.http_seconds = 0.0
+        self.render_seconds = 0.0
+        self.render_started = None
+
+
+def current():
+    """ Stats of the request being handled by this thread, if any. """
+    return getattr(_local, 'stats', None)
+
+
+@contextmanager
+def recording():
+    """ Records the queries and HTTP requests made within, outside requests. """
+    previous = current()
+    stats = _local.stats = RequestStats()
+    start = time.monotonic()
+    try:
+        yield stats
+    finally:
+        stats.seconds = time.monotonic() - start
+        _local.stats = previous
+
+
+def init_observers(registry):
+    """ Gives registry the lists observe adds to, unless it has them. """
+    if not hasattr(registry, 'request_observers'):
+        registry.request_observers = []
+    if not hasattr(registry, 'request_starters'):
+        registry.request_starters = []
+
+
+def observe(registry, callback, started=None):
+    """
+    Calls callback with the RequestStats of every request the app of
+    registry finishes, and started as each starts. Each is added once.
+    """
+    init_observers(registry)
+    if callback not in registry.request_observers:
+        registry.request_observers.append(callback)
+    if started is not None and started not in registry.request_starters:
+        registry.request_starters.append(started)
+
+
+class QueryListener(monitoring.CommandListener):
+
+    """ Counts the commands each request sends to MongoDB. """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.record(event)
+
+    def failed(self, event):
+        self.record(event)
+
+    def record(self, event):
+        stats = current()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += event.duration_micros / 1e6
+
+
+# Passed to the MongoDB client, see database.connection_settings
+query_listener = QueryListener()
+
+
+def record_http(seconds):
+    """ Adds an outbound HTTP request to the current request's stats. """
+    stats = current()
+    if stats is not None:
+        stats.http_requests += 1
+        stats.http_seconds += seconds
+
+
+def render_started(event):
+    stats = current()
+    if stats is not None and stats.render_started is None:
+        stats.render_started = time.monotonic()
+
+
+def render_finished(stats):
+    # Rendering is done once the view returns. NewResponse can't be used,
+    # it only fires after every tween has returned.
+    if stats.render_started is not None:
+        stats.render_seconds += time.monotonic() - stats.render_started
+        stats.render_started = None
+
+
+def instrumentation_tween_factory(handler, registry):
+    """
+    Records queries, database, outbound HTTP and render time for each request.
+    With instrumentation.headers on, they are sent back as X- headers.
+    """
+    settings = registry.settings
+    budget = int(settings.get('instrumentation.query_budget', QUERY_BUDGET))
+    headers = asbool(settings.get('instrumentation.headers'))
+    init_observers(registry)
+
+    def instrumentation_tween(request):
+        for callback in registry.request_starters:
+            callback()
+        stats = _local.stats = RequestStats()
+        start = time.monotonic()
+        try:
+            response = handler(request)
+            stats.status = response.status_int
+        finally:
+            render_finished(stats)
+            _local.stats = None
+            stats.seconds = time.monotonic() - start
+            route = request.matched_route
+            stats.route = route.name if route is not None else None
+            for callback in registry.request_observers:
+                callback(stats)
+
+        if stats.queries > budget:
+            log.warning('%s made %d queries, over the budget of %d (%s)',
+                        stats.route, stats.queries, budget, request.path_qs)
+        if headers:
+            response.headers.update({
+                'X-Queries': str(stats.queries),
+                'X-DB-Time': '{0:.1f}ms'.format(stats.db_seconds * 1000),
+                'X-HTTP-Time': '{0:.1f}ms'.format(stats.http_seconds * 1000),
+                'X-Render-Time': '{0:.1f}ms'.format(stats.render_seconds * 1000),
+                'X-Response-Time': '{0:.1f}ms'.format(stats.seconds * 1000)
+            })
+        return response
+    return instrumentation_tween
@@ -0,0 +1,199 @@
+from pymongo.errors import CollectionInvalid, PyMongoError
+from mongoengine.connection import get_db
+from mongoengine import signals
+from pymongo import CursorType
+from pyramid.events import NewRequest
+from .views.common import ref_id
+from datetime import datetime, timedelta
+from uuid import uuid4
+import threading
+import weakref
+import logging
+import time
+import os
+
+log = logging.getLogger(__name__)
+
+# Capped collection tags are shared between processes through
+COLLECTION = 'invalidations'
+CHANNEL_SIZE = 1024 * 1024
+# Largest difference between the clocks of processes sharing the channel
+CLOCK_SKEW = timedelta(minutes=1)
+
+_subscribers = []
+_channel = None
+_connected = False
+
+
+def includeme(config):
+    global _connected, _channel
+    if not _connected:
+        signals.post_save.connect(document_changed)
+        signals.post_delete.connect(document_changed)
+        _connected = True
+
+    if config.get_settings().get('invalidation.channel') == 'mongodb':
+        if _channel is None:
+            _channel = MongoChannel()
+        # Servers may fork workers after loading the app, so each process
+        # starts listening with its first request
+        config.add_subscriber(start_channel, NewRequest)
+
+
+def start_channel(event):
+    _channel.ensure_started()
+
+
+def subscribe(callback, weak=False):
+    """
+    Calls callback with the set of tags of every change. With weak, callback
+    is a bound method, dropped with its object.
+    """
+    _subscribers.append(weakref.WeakMethod(callback) if weak else callback)
+
+
+def unsubscribe(callback):
+    _subscribers[:] = [s for s in _subscribers if s != callback and
+                       not (isinstance(s, weakref.WeakMethod) and s() == callback)]
+
+
+def publish(*tags):
+    """ Tells subscribers, here and in other processes, what changed. """
+    tags = set(tags)
+    dispatch(tags)
+    if _channel is not None:
+        _channel.send(tags)
+
+
+def dispatch(tags):
+    for subscriber in list(_subscribers):
+        if isinstance(subscriber, weakref.WeakMethod):
+            callback = subscriber()
+            if callback is None:
+                # Its object is gone
+                try:
+                    _subscribers.remove(subscriber)
+                except ValueError:
+                    pass
+                continue
+        else:
+            callback = subscriber
+        try:
+            callback(tags)
+        except Exception:
+            log.exception('Invalidation of %s failed', tags)
+
+
+def document_tags(doc):
+    """ Tags of what a change to doc affects. """
+    name = doc.__class__.__name__
+    if name == 'Mod':
+        return ['mod:{0}'.format(doc.id), 'mods']
+    elif name == 'ModVersion':
+        # Mod lists show the latest version
+        return ['version:{0}'.format(doc.id), 'mod:{0}'.format(ref_id(doc, 'mod')), 'mods']
+    elif name == 'Pack':
+        return ['pack:{0}'.format(doc.id), 'packs']
+    elif name == 'PackBuild':
+        pack = ref_id(doc, 'pack')
+        return ['build:{0}'.format(doc.id), 'pack:{0}'.format(pack),
+                'pack:{0}:builds'.format(pack)]
+    elif name == 'Server':
+        return ['server:{0}'.format(doc.id), 'servers']
+    return []
+
+
+def document_changed(sender, document, **kwargs):
+    tags = document_tags(document)
+    if tags:
+        publish(*tags)
+
+
+class MongoChannel(object):
+
+    """
+    Shares published tags with other processes, admin scripts included,
+    through a capped collection each process tails.
+    """
+
+    def __init__(self, size=CHANNEL_SIZE):
+        self.size = size
+        self.origin = uuid4().hex
+        self.pid = None
+        self._collection = None
+        self._lock = threading.Lock()
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            db = get_db()
+            try:
+                db.create_collection(COLLECTION, capped=True, size=self.size)
+            except CollectionInvalid:
+                # Already exists
+                pass
+            self._collection = db[COLLECTION]
+        return self._collection
+
+    def send(self, tags):
+        self.ensure_started()
+        try:
+            self.collection.insert_one({'origin': self.origin, 'tags': sorted(tags),
+                                        'created': datetime.utcnow()})
+        except PyMongoError:
+            log.exception('Could not share invalidation of %s', tags)
+
+    def ensure_started(self):
+        """
+        Listens in this process, unless it already does. Threads don't
+        survive a fork, so forked processes start their own, with their own
+        origin so that their siblings don't take their messages as their own.
+        """
+        pid = os.getpid()
+        if self.pid == pid:
+            return
+        with self._lock:
+            if self.pid != pid:
+                self.origin = uuid4().hex
+                self._collection = None
+                self.start()
+                self.pid = pid
+
+    def start(self):
+        thread = threading.Thread(target=self.listen, name='invalidations')
+        thread.daemon = True
+        thread.start()
+
+    def listen(self, poll=1):
+        collection = self.collection
+        # Only changes from now on matter
+        newest = list(collection.find({}, {'_id': True, 'created': True}).sort('$natural', -1).limit(1))
+        last = newest[0] if newest else None
+        while True:
+            try:
+                query = {}
+                if last is not None:
+                    if collection.find_one({'_id': last['_id']}, {'_id': True}) is None:
+                        log.warning('Invalidations were dropped from the channel before being read')
+                        last = None
+                    else:
+                        # Ids made by different processes aren't ordered, so
+                        # messages are skipped in insertion order up to the
+                        # last one read, starting from around when it was sent
+                        query = {'created': {'$gte': last['created'] - CLOCK_SKEW}}
+                skipping = last is not None
+                cursor = collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                # Iterating stops when nothing came for a while, the cursor
+                # stays usable until the collection moves past it
+                while cursor.alive:
+                    for message in cursor:
+                        if skipping:
+                            skipping = message['_id'] != last['_id']
+                            continue
+                        last = message
+                        if message['origin'] != self.origin:
+                            dispatch(set(message['tags']))
+            except PyMongoError:
+                log.exception('Lost the invalidation channel')
+            # Tailable cursors die when the collection is empty
+            time.sleep(poll)
@@ -0,0 +1,91 @@
+from zipfile import ZipFile, BadZipFile
+from .schema import JarInfo, ModVersion
+import posixpath
+import json
+import zlib
+
+MCMOD_INFO = 'mcmod.info'
+# mcmod.info files larger than this are ignored
+MCMOD_INFO_MAX = 64 * 1024
+
+
+def read_jar(f, size):
+    """
+    Reads the metadata of the jar in f from its central directory and
+    mcmod.info, without extracting anything else. Returns None if f is not a
+    zip file, a corrupt mcmod.info is ignored.
+    """
+    start = f.tell()
+    try:
+        with ZipFile(f) as jar:
+            infos = jar.infolist()
+            packages = set()
+            for info in infos:
+                package = posixpath.dirname(info.filename)
+                if package and info.filename.endswith('.class'):
+                    packages.add(package.replace('/', '.'))
+
+            mods = []
+            try:
+                info = jar.getinfo(MCMOD_INFO)
+            except KeyError:
+                pass
+            else:
+                if info.file_size <= MCMOD_INFO_MAX:
+                    try:
+                        mods = parse_mcmod_info(jar.read(info))
+                    except (BadZipFile, EOFError, RuntimeError, NotImplementedError, zlib.error):
+                        # Corrupt, encrypted or unsupported compression
+                        pass
+    except (BadZipFile, EOFError, ValueError):
+        # Not a zip file, or its central directory is corrupt
+        return None
+    finally:
+        f.seek(start)
+
+    return JarInfo(
+        mod_ids=unique(m.get('modid') for m in mods),
+        versions=unique(m.get('version') for m in mods),
+        mc_versions=unique(m.get('mcversion') for m in mods),
+        packages=sorted(packages),
+        file_count=len(infos),
+        size=size
+    )
+
+
+def parse_mcmod_info(data):
+    """ Returns the mods declared in mcmod.info, in either format. """
+    try:
+        info = json.loads(data.decode('utf-8', 'replace'))
+    except (ValueError, RecursionError):
+        return []
+
+    if isinstance(info, dict):
+        info = info.get('modList') or info.get('modlist') or []
+    if not isinstance(info, list):
+        return []
+    return [m for m in info if isinstance(m, dict)]
+
+
+def unique(values):
+    seen = []
+    for value in values:
+        if isinstance(value, str) and value and value not in seen:
+            seen.append(value)
+    return seen
+
+
+# Queries, for the version details page
+
+def mods_providing(mv):
+    """ Other mods with versions that declare the same mod ids as mv. """
+    if not mv.jar or not mv.jar.mod_ids:
+        return []
+    return sorted(ModVersion.objects(jar__mod_ids__in=mv.jar.mod_ids, mod__ne=mv.mod).distinct('mod'))
+
+
+def conflicting_mods(mv):
+    """ Other mods with versions that contain classes in the same packages. """
+    if not mv.jar or not mv.jar.packages:
+        return []
+    return sorted(ModVersion.objects(jar__packages__in=mv.jar.packages, mod__ne=mv.mod).distinct('mod'))
@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta
+from .schema import Job, ModVersion
+from . import storage, invalidation
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# Jobs running for longer than this are assumed to belong to a dead worker
+STALE_AFTER = timedelta(minutes=30)
+
+HANDLERS = {}
+
+
+def handler(kind):
+    def dec(f):
+        HANDLERS[kind] = f
+        return f
+    return dec
+
+
+def enqueue(kind, owner=None, **params):
+    return Job(kind=kind, owner=owner, params=params).save()
+
+
+def claim():
+    """ Atomically marks the oldest queued job as running and returns it. """
+    return Job.objects(status='queued').order_by('created').modify(
+        new=True, set__status='running', set__started=datetime.now())
+
+
+def requeue_stale():
+    too_old = datetime.now() - STALE_AFTER
+    Job.objects(status='running', started__lt=too_old).update(
+        set__status='queued', unset__started=True)
+
+
+def run(job):
+    try:
+        HANDLERS[job.kind](**job.params)
+    except Exception as e:
+        log.exception('Job %s (%s) failed', job.id, job.kind)
+        job.status = 'failed'
+        job.error = error_message(e)
+    else:
+        job.status = 'done'
+    job.finished = datetime.now()
+    job.save()
+
+
+def error_message(e):
+    return str(e) or e.__class__.__name__
+
+
+def run_pending():
+    """ Runs queued jobs until there are none left. """
+    job = claim()
+    while job is not None:
+        run(job)
+        job = claim()
+
+
+def work(poll=1, tasks=()):
+    """ Runs jobs as they are queued, and each of tasks between polls. """
+    requeue_stale()
+    while True:
+        run_pending()
+        for task in tasks:
+            try:
+                task()
+            except Exception:
+                log.exception('Task %r failed', task)
+        time.sleep(poll)
+
+
+# Handlers
+
+# Fields a fetched file is kept in, and those it replaces
+FILE_FIELDS = ('mod_file', 'mod_file_md5', 'mod_file_sha1', 'mod_file_size', 'jar')
+FETCH_FIELDS = ('mod_file_url', 'mod_file_url_md5', 'fetch_error')
+
+def version_changed(mv):
+    """ Publishes a change to mv made without saving it, which sends no signal. """
+    if mv is not None:
+        invalidation.publish(*invalidation.document_tags(mv))
+
+
+def record_fetch_error(version, url, e):
+    """ Keeps why a file could not be fetched on its version, for the owner. """
+    version_changed(ModVersion.objects(id=version, mod_file_url=url).only('mod').modify(
+        set__fetch_error=error_message(e), new=True))
+
+
+@handler('fetch_mod_file')
+def fetch_mod_file(version, url, max_size=storage.MAX_SIZE):
+    mv = ModVersion.objects.get(id=version)
+    with storage.ModFileChange(mv) as change:
+        try:
+            with storage.open_url(url) as (chunks, length, _):
+                change.store(chunks, length, max_size)
+        except Exception as e:
+            record_fetch_error(version, url, e)
+            raise
+        # Not mv.save(), which would bring back a version deleted meanwhile,
+        # nor a version whose link was changed since
+        doc = mv.to_mongo()
+        stored = dict((name, doc[name]) for name in FILE_FIELDS if name in doc)
+        cleared = dict((name, True) for name in FILE_FIELDS + FETCH_FIELDS
+                       if name not in stored)
+        if not ModVersion.objects(id=mv.id, mod_file_url=url).update_one(
+                __raw__={'$set': stored, '$unset': cleared}):
+            # Releases the stored file
+            raise ModVersion.DoesNotExist('The version was deleted or its link changed.')
+    version_changed(mv)
+
+
+@handler('hash_mod_file_url')
+def hash_mod_file_url(version, url):
+    """ Records the MD5 of a file the version links to directly. """
+    try:
+        with storage.open_url(url) as (chunks, length, end_url):
+            md5 = storage.hash_stream(chunks).md5
+    except Exception as e:
+        record_fetch_error(version, url, e)
+        raise
+    # Unless the link was changed meanwhile; keep the end url, in case of redirect
+    version_changed(ModVersion.objects(id=version, mod_file_url=url).only('mod').modify(
+        set__mod_file_url=end_url, set__mod_file_url_md5=md5, unset__fetch_error=True,
+        new=True))
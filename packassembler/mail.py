@@ -0,0 +1,163 @@
+from datetime import datetime, timedelta
+from pyramid_mailer.message import Message
+from pyramid.settings import asbool
+from .schema import OutboundMail
+import smtplib
+import logging
+
+log = logging.getLogger(__name__)
+
+# Messages sent over one SMTP connection
+BATCH_SIZE = 50
+# Attempts before a message is given up on
+MAX_ATTEMPTS = 6
+# Wait before the first retry, doubled after each failed attempt
+RETRY_DELAY = timedelta(minutes=1)
+# Messages being sent for longer than this belong to a dead worker
+STALE_AFTER = timedelta(minutes=10)
+# Seconds to wait on the SMTP server
+SMTP_TIMEOUT = 30
+
+
+def enqueue(message):
+    """ Queues a pyramid_mailer Message to be sent by the worker. """
+    return OutboundMail(
+        sender=message.sender,
+        recipients=list(message.recipients),
+        subject=message.subject,
+        body=message.body,
+        html=message.html,
+        headers=dict(message.extra_headers or {})
+    ).save()
+
+
+def to_message(mail, default_sender):
+    return Message(
+        subject=mail.subject,
+        sender=mail.sender or default_sender,
+        recipients=mail.recipients,
+        body=mail.body,
+        html=mail.html,
+        extra_headers=mail.headers
+    )
+
+
+def claim():
+    now = datetime.now()
+    return OutboundMail.objects(status='queued', next_attempt__lte=now).order_by(
+        'next_attempt').modify(new=True, set__status='sending', set__claimed=now)
+
+
+def claim_batch(size=BATCH_SIZE):
+    batch = []
+    while len(batch) < size:
+        mail = claim()
+        if mail is None:
+            break
+        batch.append(mail)
+    return batch
+
+
+def requeue_stale():
+    too_old = datetime.now() - STALE_AFTER
+    OutboundMail.objects(status='sending', claimed__lt=too_old).update(
+        set__status='queued')
+
+
+def sent(mail):
+    mail.update(set__status='sent', set__sent=datetime.now(),
+                inc__attempts=1, unset__error=True)
+
+
+def retry(mail, error, permanent=False):
+    """ Schedules another attempt at mail, with exponential backoff. """
+    attempts = mail.attempts + 1
+    if permanent or attempts >= MAX_ATTEMPTS:
+        log.error('Giving up on mail %s: %s', mail.id, error)
+        mail.update(set__status='failed', set__attempts=attempts,
+                    set__error=str(error))
+    else:
+        mail.update(set__status='queued', set__attempts=attempts,
+                    set__error=str(error),
+                    set__next_attempt=datetime.now() + RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def is_permanent(error):
+    """ Whether the server refused the message for good (5xx). """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return getattr(error, 'smtp_code', 0) >= 500
+
+
+class Outbox(object):
+
+    """
+    Sends queued mail, reusing an SMTP connection for each batch. Uses the
+    same mail.* settings as pyramid_mailer.
+    """
+
+    def __init__(self, settings, smtp_class=smtplib.SMTP):
+        self.smtp_class = smtp_class
+        self.host = settings.get('mail.host', 'localhost')
+        self.port = int(settings.get('mail.port', 25))
+        self.username = settings.get('mail.username')
+        self.password = settings.get('mail.password')
+        self.tls = asbool(settings.get('mail.tls'))
+        self.default_sender = settings.get('mail.default_sender')
+
+    def connect(self):
+        smtp = self.smtp_class(self.host, self.port, timeout=SMTP_TIMEOUT)
+        if self.tls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        return smtp
+
+    def drain(self):
+        """ Sends everything due, a batch at a time. """
+        requeue_stale()
+        batch = claim_batch()
+        while batch:
+            self.send_batch(batch)
+            batch = claim_batch()
+
+    def send_batch(self, batch):
+        smtp = None
+        try:
+            for i, mail in enumerate(batch):
+                try:
+                    message = to_message(mail, self.default_sender)
+                    text = message.to_message().as_string()
+                except Exception as e:
+                    # No sender or recipients, say, it will never be sent
+                    retry(mail, e, permanent=True)
+                    continue
+
+                if smtp is None:
+                    try:
+                        smtp = self.connect()
+                    except (smtplib.SMTPException, OSError) as e:
+                        log.warning('Could not connect to %s: %s', self.host, e)
+                        for unsent in batch[i:]:
+                            retry(unsent, e)
+                        return
+
+                try:
+                    smtp.sendmail(message.sender, mail.recipients, text)
+                except smtplib.SMTPServerDisconnected as e:
+                    # Reconnect for the next message
+                    smtp = None
+                    retry(mail, e)
+                except smtplib.SMTPException as e:
+                    retry(mail, e, is_permanent(e))
+                except OSError as e:
+                    smtp = None
+                    retry(mail, e)
+                else:
+                    sent(mail)
+        finally:
+            if smtp is not None:
+                try:
+                    smtp.quit()
+                except (smtplib.SMTPException, OSError):
+                    smtp.close()
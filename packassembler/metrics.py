@@ -0,0 +1,190 @@
+from collections import defaultdict
+from bisect import bisect_left
+from . import instrumentation, outbound
+from .schema import Job, OutboundMail
+import threading
+
+# Upper bounds of the request latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Name, type and help of every metric
+METRICS = {
+    'packassembler_requests_total': ('counter', 'Requests handled.'),
+    'packassembler_requests_in_flight': ('gauge', 'Requests being handled.'),
+    'packassembler_request_seconds': ('histogram', 'Request latency.'),
+    'packassembler_db_queries_total': ('counter', 'MongoDB commands sent.'),
+    'packassembler_db_seconds_total': ('counter', 'Time spent in MongoDB commands.'),
+    'packassembler_render_seconds_total': ('counter', 'Time spent rendering templates.'),
+    'packassembler_gridfs_bytes_served_total': ('counter', 'Bytes of mod files sent from GridFS.'),
+    'packassembler_bundle_cache_total': ('counter', 'Build bundle cache lookups.'),
+    'packassembler_http_requests_total': ('counter', 'Outbound HTTP requests, by host.'),
+    'packassembler_http_failures_total': ('counter', 'Outbound HTTP requests that failed, by host.'),
+    'packassembler_http_seconds_total': ('counter', 'Time spent in outbound HTTP requests, by host.'),
+    'packassembler_http_max_seconds': ('gauge', 'Slowest outbound HTTP request, by host.'),
+    'packassembler_mail_queued': ('gauge', 'Outbound mail waiting to be sent.'),
+    'packassembler_jobs_queued': ('gauge', 'Background jobs waiting to run.'),
+    'packassembler_cache_hit_ratio': ('gauge', 'Hit ratio of each cache.')
+}
+
+
+def includeme(config):
+    instrumentation.observe(config.registry, request_finished, started=request_started)
+
+
+# Accumulators
+# Each thread only ever writes to its own, so updates need no lock. They are
+# summed when metrics are read.
+
+class Accumulator(object):
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        # Bucket counts followed by the sum
+        self.histograms = {}
+
+
+_local = threading.local()
+_accumulators = []
+_accumulators_lock = threading.Lock()
+
+
+def accumulator():
+    acc = getattr(_local, 'accumulator', None)
+    if acc is None:
+        acc = _local.accumulator = Accumulator()
+        with _accumulators_lock:
+            _accumulators.append(acc)
+    return acc
+
+
+def inc(name, value=1, **labels):
+    accumulator().counters[name, tuple(sorted(labels.items()))] += value
+
+
+def observe(name, value, **labels):
+    histograms = accumulator().histograms
+    key = name, tuple(sorted(labels.items()))
+    counts = histograms.get(key)
+    if counts is None:
+        counts = histograms[key] = [0] * (len(BUCKETS) + 2)
+    counts[bisect_left(BUCKETS, value)] += 1
+    counts[-1] += value
+
+
+def count_bytes(chunks, name, **labels):
+    """ Passes chunks through, counting their bytes in name. """
+    try:
+        for chunk in chunks:
+            inc(name, len(chunk), **labels)
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def totals():
+    """ Counters and histograms summed over every thread. """
+    counters = defaultdict(float)
+    histograms = {}
+    with _accumulators_lock:
+        accumulators = list(_accumulators)
+    for acc in accumulators:
+        for key, value in list(acc.counters.items()):
+            counters[key] += value
+        for key, counts in list(acc.histograms.items()):
+            total = histograms.setdefault(key, [0] * len(counts))
+            for i, count in enumerate(counts):
+                total[i] += count
+    return counters, histograms
+
+
+# Requests
+
+def request_started():
+    inc('packassembler_requests_started_total')
+
+
+def request_finished(stats):
+    inc('packassembler_requests_finished_total')
+    route = stats.route or 'none'
+    inc('packassembler_requests_total', route=route, status=str(stats.status or 500))
+    observe('packassembler_request_seconds', stats.seconds, route=route)
+    inc('packassembler_db_queries_total', stats.queries, route=route)
+    inc('packassembler_db_seconds_total', stats.db_seconds, route=route)
+    inc('packassembler_render_seconds_total', stats.render_seconds, route=route)
+
+
+# Exposition
+
+def snapshot(registry):
+    """ Accumulated metrics, along with those read at collection. """
+    counters, histograms = totals()
+    values = {}
+
+    def sample(name, value, **labels):
+        values[name, tuple(sorted(labels.items()))] = value
+
+    started = counters.pop(('packassembler_requests_started_total', ()), 0)
+    finished = counters.pop(('packassembler_requests_finished_total', ()), 0)
+    sample('packassembler_requests_in_flight', int(started - finished))
+
+    for host, stats in outbound.client.stats().items():
+        host = host or 'none'
+        sample('packassembler_http_requests_total', stats['requests'], host=host)
+        sample('packassembler_http_failures_total', stats['failures'], host=host)
+        sample('packassembler_http_seconds_total', stats['seconds'], host=host)
+        sample('packassembler_http_max_seconds', stats['max_seconds'], host=host)
+
+    sample('packassembler_mail_queued', OutboundMail.objects(status='queued').count())
+    sample('packassembler_jobs_queued', Job.objects(status='queued').count())
+
+    cache = getattr(registry, 'response_cache', None)
+    if cache is not None:
+        sample('packassembler_cache_hit_ratio', cache.hit_ratio, cache='pages')
+    hits = counters.get(('packassembler_bundle_cache_total', (('result', 'hit'),)), 0)
+    misses = counters.get(('packassembler_bundle_cache_total', (('result', 'miss'),)), 0)
+    if hits + misses:
+        sample('packassembler_cache_hit_ratio', hits / (hits + misses), cache='bundles')
+    return counters, histograms, values
+
+
+def collect(registry):
+    """ Every metric, in the Prometheus text format. """
+    return render(*snapshot(registry))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in labels) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(counters, histograms, values):
+    """
+    Formats metrics in the Prometheus text format. values maps (name,
+    labels) to values read at collection, like counters.
+    """
+    samples = defaultdict(list)
+    for (name, labels), value in list(counters.items()) + list(values.items()):
+        samples[name].append(name + format_labels(labels) + ' ' + format_value(value))
+    for (name, labels), counts in histograms.items():
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), counts):
+            cumulative += count
+            samples[name].append('{0}_bucket{1} {2}'.format(
+                name, format_labels(labels + (('le', str(bound)),)), cumulative))
+        samples[name].append('{0}_sum{1} {2}'.format(name, format_labels(labels), format_value(counts[-1])))
+        samples[name].append('{0}_count{1} {2}'.format(name, format_labels(labels), cumulative))
+
+    lines = []
+    for name in sorted(samples):
+        kind, help_text = METRICS.get(name, ('untyped', ''))
+        lines.append('# HELP {0} {1}'.format(name, help_text))
+        lines.append('# TYPE {0} {1}'.format(name, kind))
+        lines.extend(sorted(samples[name]))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+from .schema import Mod, PendingNotification
+from .views.common import ref_id
+from .views import email
+
+# Default time to collect notifications before sending, override with
+# mail.digest_window in seconds
+DIGEST_WINDOW = 3600
+
+
+def digest_window(settings):
+    return timedelta(seconds=int(settings.get('mail.digest_window', DIGEST_WINDOW)))
+
+
+def mod_outdated(mod, url):
+    """ Adds mod to its owner's next digest, once however often it is flagged. """
+    if mod.owner is None:
+        return
+    PendingNotification.objects(owner=mod.owner, mod=mod).update_one(
+        set__mod_name=mod.name, set__mod_url=url,
+        set_on_insert__created=datetime.now(), upsert=True)
+
+
+def mod_updated(mod):
+    """ Drops a pending notification, the mod is no longer outdated. """
+    PendingNotification.objects(mod=mod).delete()
+
+
+def take(notification):
+    """ Deletes a notification, returns whether this worker got it. """
+    collection = PendingNotification._get_collection()
+    return collection.delete_one({'_id': notification.id}).deleted_count == 1
+
+
+def send_digests(window=timedelta(seconds=DIGEST_WINDOW)):
+    """
+    Sends one digest to each owner whose oldest notification has waited for
+    window, covering everything pending for them.
+    """
+    cutoff = datetime.now() - window
+    for owner in PendingNotification.objects(created__lte=cutoff).distinct('owner'):
+        pending = list(PendingNotification.objects(owner=owner).order_by('mod_name'))
+        # Mods updated since, without going through mod_updated, are left out
+        outdated = set(Mod.objects(id__in=[ref_id(n, 'mod') for n in pending],
+                                   outdated=True).distinct('id'))
+        # Another worker may be sending the same digest
+        mods = [(n.mod_name, n.mod_url) for n in pending
+                if take(n) and ref_id(n, 'mod') in outdated]
+        if mods:
+            email.mods_outdated(None, owner, mods)
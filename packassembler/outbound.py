@@ -0,0 +1,170 @@
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from .instrumentation import record_http
+import threading
+import requests
+import time
+
+# Defaults, override with http.connect_timeout, http.read_timeout,
+# http.pool_size and http.max_concurrency
+## Seconds to wait for a connection, and for each read of a response
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+## Connections kept alive per host
+POOL_SIZE = 10
+## Requests in flight at once from this process
+MAX_CONCURRENCY = 20
+# Seconds to wait for a free slot before giving up
+ACQUIRE_TIMEOUT = 10
+
+
+def includeme(config):
+    configure(config.get_settings())
+
+
+class Busy(requests.RequestException):
+    pass
+
+
+class HostStats(object):
+
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'seconds': self.seconds,
+            'max_seconds': self.max_seconds
+        }
+
+
+class Client(object):
+
+    """
+    Shared HTTP client for calls to other services. Keeps connections alive
+    per host, applies timeouts, limits how many requests are in flight and
+    records latency and failures per host.
+    """
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 pool_size=POOL_SIZE, max_concurrency=MAX_CONCURRENCY):
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def record(self, host, seconds, failed):
+        record_http(seconds)
+        with self.lock:
+            stats = self.hosts.get(host)
+            if stats is None:
+                stats = self.hosts[host] = HostStats()
+            stats.requests += 1
+            stats.failures += failed
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+
+    def stats(self):
+        """ Latency and failures so far, by host. """
+        with self.lock:
+            return dict((host, s.as_dict()) for host, s in self.hosts.items())
+
+    def request(self, method, url, stream=False, **kwargs):
+        """
+        Makes a request, as requests.request does. Raises Busy if too many
+        requests are in flight. Streamed requests return a Stream, which holds
+        its slot until closed.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        if not self.slots.acquire(timeout=ACQUIRE_TIMEOUT):
+            raise Busy('Too many outbound requests in flight.')
+
+        host = urlsplit(url).hostname
+        start = time.monotonic()
+        try:
+            response = self.session.request(method, url, stream=stream, **kwargs)
+        except:
+            self.slots.release()
+            self.record(host, time.monotonic() - start, True)
+            raise
+
+        if stream:
+            return Stream(self, response, host, start)
+        self.slots.release()
+        self.record(host, time.monotonic() - start, response.status_code >= 500)
+        return response
+
+
+class Stream(object):
+
+    """
+    A streamed response, holding a slot of its client until closed. Use it
+    in a with block, so the slot is freed however much of the body is read.
+    """
+
+    def __init__(self, client, response, host, started):
+        self.client = client
+        self.response = response
+        self.host = host
+        self.started = started
+        # Until the whole body was read
+        self.failed = True
+        self.closed = False
+
+    @property
+    def headers(self):
+        return self.response.headers
+
+    @property
+    def url(self):
+        return self.response.url
+
+    def iter_content(self, chunk_size):
+        yield from self.response.iter_content(chunk_size)
+        self.failed = self.response.status_code >= 500
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.response.close()
+            self.client.slots.release()
+            self.client.record(self.host, time.monotonic() - self.started, self.failed)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+client = Client()
+
+
+def configure(settings):
+    global client
+    client = Client(float(settings.get('http.connect_timeout', CONNECT_TIMEOUT)),
+                    float(settings.get('http.read_timeout', READ_TIMEOUT)),
+                    int(settings.get('http.pool_size', POOL_SIZE)),
+                    int(settings.get('http.max_concurrency', MAX_CONCURRENCY)))
+
+
+def get(url, **kwargs):
+    return client.request('GET', url, **kwargs)
+
+
+def post(url, data=None, **kwargs):
+    return client.request('POST', url, data=data, **kwargs)
+
+
+def stream(url):
+    """ Returns a Stream of a GET response, to use in a with block. """
+    return client.request('GET', url, stream=True)
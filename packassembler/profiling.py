@@ -0,0 +1,192 @@
+from pyramid.interfaces import IRoutesMapper
+from pymongo.errors import CollectionInvalid, PyMongoError
+from mongoengine.connection import get_db
+from collections import defaultdict
+from datetime import datetime
+from .schema import Setting
+import threading
+import cProfile
+import logging
+import pstats
+import random
+import time
+
+log = logging.getLogger(__name__)
+
+# Capped collection profiles are kept in
+COLLECTION = 'profiles'
+COLLECTION_SIZE = 16 * 1024 * 1024
+# Setting the maintenance page turns the profiler on with
+SETTING_KEY = 'profiler'
+# Seconds between checks of the setting
+REFRESH = 10
+# Functions kept from each profile
+TOP_FUNCTIONS = 40
+
+
+def includeme(config):
+    config.add_tween('packassembler.profiling.profiling_tween_factory')
+
+
+class Profiler(object):
+
+    """
+    Profiles a fraction of requests to some routes, as set on the maintenance
+    page. Only one request is profiled at a time per process.
+    """
+
+    def __init__(self, interval=REFRESH):
+        self.interval = interval
+        self.enabled = False
+        self.rate = 0.0
+        self.routes = frozenset()
+        self.checked = None
+        self.lock = threading.Lock()
+        self.running = threading.Lock()
+        self._collection = None
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            db = get_db()
+            try:
+                db.create_collection(COLLECTION, capped=True, size=COLLECTION_SIZE)
+            except CollectionInvalid:
+                # Already exists
+                pass
+            self._collection = db[COLLECTION]
+        return self._collection
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.checked is not None and now - self.checked < self.interval:
+            return
+        # Another thread is refreshing, use what is there meanwhile
+        if not self.lock.acquire(False):
+            return
+        try:
+            setting = Setting.objects(key=SETTING_KEY).first()
+            self.configure(**(settings_of(setting) if setting else {}))
+            self.checked = now
+        finally:
+            self.lock.release()
+
+    def configure(self, enabled=False, rate=0.0, routes=()):
+        self.rate = rate
+        self.routes = frozenset(routes)
+        self.enabled = enabled and rate > 0
+
+    def wants(self, route_name):
+        """ Whether to profile a request to route_name. """
+        return ((not self.routes or route_name in self.routes)
+                and random.random() < self.rate)
+
+    def profile(self, route_name, handler, request):
+        # Profiling another request already, cProfile can't nest
+        if not self.running.acquire(False):
+            return handler(request)
+        profile = cProfile.Profile()
+        start = time.monotonic()
+        try:
+            profile.enable()
+            try:
+                return handler(request)
+            finally:
+                profile.disable()
+        finally:
+            self.running.release()
+            self.save(route_name, profile, time.monotonic() - start)
+
+    def save(self, route_name, profile, seconds):
+        try:
+            self.collection.insert_one({
+                'route': route_name,
+                'created': datetime.utcnow(),
+                'seconds': seconds,
+                'functions': top_functions(profile)
+            })
+        except PyMongoError:
+            log.exception('Could not save a profile of %s', route_name)
+
+    def recent(self, limit=500):
+        """ Most recent profiles, newest first. """
+        return self.collection.find().sort('$natural', -1).limit(limit)
+
+
+def settings_of(setting):
+    return {
+        'enabled': bool(getattr(setting, 'enabled', False)),
+        'rate': float(getattr(setting, 'rate', 0.0)),
+        'routes': list(getattr(setting, 'routes', ()))
+    }
+
+
+def top_functions(profile, limit=TOP_FUNCTIONS):
+    """ Functions that took longest in profile, including what they called. """
+    functions = []
+    for (filename, line, name), (cc, calls, tottime, cumtime, callers) in pstats.Stats(profile).stats.items():
+        functions.append({
+            'function': '{0}:{1}({2})'.format(filename, line, name),
+            'calls': calls,
+            'tottime': tottime,
+            'cumtime': cumtime
+        })
+    functions.sort(key=lambda f: f['cumtime'], reverse=True)
+    return functions[:limit]
+
+
+def summarize(profiles, limit=15):
+    """
+    Aggregates profiles by route. Returns route names mapped to the number of
+    requests profiled, their average time and their slowest functions, with
+    calls and times per request.
+    """
+    routes = defaultdict(lambda: {'requests': 0, 'seconds': 0.0, 'functions': {}})
+    for profile in profiles:
+        route = routes[profile['route']]
+        route['requests'] += 1
+        route['seconds'] += profile['seconds']
+        for f in profile['functions']:
+            total = route['functions'].setdefault(
+                f['function'], {'function': f['function'], 'calls': 0, 'tottime': 0.0, 'cumtime': 0.0})
+            total['calls'] += f['calls']
+            total['tottime'] += f['tottime']
+            total['cumtime'] += f['cumtime']
+
+    summary = {}
+    for name, route in routes.items():
+        requests = route['requests']
+        functions = sorted(route['functions'].values(), key=lambda f: f['cumtime'], reverse=True)
+        summary[name] = {
+            'requests': requests,
+            'seconds': route['seconds'] / requests,
+            'functions': [dict(f, calls=f['calls'] / requests, tottime=f['tottime'] / requests,
+                               cumtime=f['cumtime'] / requests) for f in functions[:limit]]
+        }
+    return summary
+
+
+profiler = Profiler()
+
+
+def set_profiler(enabled, rate, routes):
+    """ Turns the profiler on or off in every process. """
+    setting = Setting.objects(key=SETTING_KEY).first() or Setting(key=SETTING_KEY)
+    setting.enabled = enabled
+    setting.rate = rate
+    setting.routes = list(routes)
+    setting.save()
+    profiler.configure(enabled, rate, routes)
+
+
+def profiling_tween_factory(handler, registry):
+    """ Profiles sampled requests, see Profiler. """
+    def profiling_tween(request):
+        profiler.refresh()
+        if profiler.enabled:
+            # Tweens run before routing, so match the route here
+            route = registry.getUtility(IRoutesMapper)(request)['route']
+            if route is not None and profiler.wants(route.name):
+                return profiler.profile(route.name, handler, request)
+        return handler(request)
+    return profiling_tween
@@ -1,4 +1,6 @@
-from packassembler.schema import connect
+import packassembler.schema as schema
+
 
 def setup(env):
-    connect('', host=env['registry'].settings.get('mongodb', 'packassembler'))
+    # main() has already connected to the database
+    env['schema'] = schema
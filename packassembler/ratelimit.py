@@ -0,0 +1,193 @@
+from pyramid.httpexceptions import HTTPTooManyRequests
+from pyramid.interfaces import IRoutesMapper
+from mongoengine.connection import get_db
+from pymongo.errors import DuplicateKeyError
+from pymongo import ReturnDocument
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from .security import request_token, token_digest
+import threading
+import math
+import time
+
+# Collection buckets are shared through with ratelimit.store = mongodb
+COLLECTION = 'ratelimit'
+# Buckets kept by the in-process store before the least recently used go
+MAX_KEYS = 100000
+# Set in the environ of requests whose credentials were wrong
+FAILED_KEY = 'packassembler.ratelimit.failed'
+
+
+def includeme(config):
+    config.add_tween('packassembler.ratelimit.ratelimit_tween_factory')
+
+
+def parse_limits(value):
+    """
+    Parses ratelimit.routes, one "route_name requests/seconds" per line.
+    Returns route names mapped to (rate per second, burst).
+    """
+    limits = {}
+    for line in (value or '').splitlines():
+        if line.strip():
+            name, limit = line.split()
+            count, seconds = limit.split('/')
+            limits[name] = (int(count) / float(seconds), int(count))
+    return limits
+
+
+class MemoryStore(object):
+
+    """ Token buckets kept in this process. """
+
+    def __init__(self, max_keys=MAX_KEYS):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        """
+        Takes cost tokens from key's bucket if it has one left, returns
+        (allowed, retry after). A cost of 0 only checks the bucket.
+        """
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= cost
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+class MongoStore(object):
+
+    """
+    Token buckets shared by every process through MongoDB, each updated
+    atomically in a single round trip.
+    """
+
+    def __init__(self):
+        self._indexed = False
+
+    @property
+    def collection(self):
+        collection = get_db()[COLLECTION]
+        if not self._indexed:
+            collection.create_index('expires', expireAfterSeconds=0)
+            self._indexed = True
+        return collection
+
+    def take(self, key, rate, burst, cost=1):
+        try:
+            doc = self.update(key, rate, burst, cost)
+        except DuplicateKeyError:
+            # Another request created the bucket first, it is updated now
+            doc = self.update(key, rate, burst, cost)
+        if doc['allowed']:
+            return True, 0
+        return False, (1 - doc['tokens']) / rate
+
+    def update(self, key, rate, burst, cost):
+        now = datetime.utcnow()
+        elapsed = {'$divide': [{'$subtract': [now, {'$ifNull': ['$updated', now]}]}, 1000]}
+        refilled = {'$min': [burst, {'$add': [{'$ifNull': ['$tokens', burst]},
+                                              {'$multiply': [elapsed, rate]}]}]}
+        return self.collection.find_one_and_update(
+            {'_id': key},
+            [
+                {'$set': {'tokens': refilled, 'updated': now}},
+                {'$set': {'allowed': {'$gte': ['$tokens', 1]}}},
+                {'$set': {'tokens': {'$cond': ['$allowed', {'$subtract': ['$tokens', cost]}, '$tokens']},
+                          # A full bucket needs no document
+                          'expires': now + timedelta(seconds=burst / rate)}}
+            ],
+            upsert=True, return_document=ReturnDocument.AFTER)
+
+
+STORES = {
+    'memory': MemoryStore,
+    'mongodb': MongoStore
+}
+
+
+def request_keys(request):
+    """ The buckets a request takes from, its address and its logged in account. """
+    keys = ['ip:' + (request.client_addr or '')]
+    userid = request.unauthenticated_userid
+    if userid:
+        keys.append('user:' + userid.strip().lower())
+    return keys
+
+
+def account_key(request):
+    """
+    The account a request tries to authenticate as, by its API token or the
+    username in its form, or None.
+    """
+    token = request_token(request)
+    if token is not None:
+        return 'token:' + token_digest(token)
+    if request.method == 'POST':
+        username = request.POST.get('username', '').strip().lower()
+        if username:
+            return 'account:' + username
+
+
+def failed_attempt(request):
+    """
+    Called by views when the credentials in a request are wrong, which counts
+    against the account they were for.
+    """
+    request.environ[FAILED_KEY] = True
+
+
+def ratelimit_tween_factory(handler, registry):
+    """
+    Limits POST requests to the routes in ratelimit.routes, per address and
+    per logged in account, and failed attempts per account tried. Requests
+    over the limit get 429 with Retry-After.
+    """
+    settings = registry.settings
+    limits = parse_limits(settings.get('ratelimit.routes'))
+    if not limits:
+        return handler
+    store = STORES[settings.get('ratelimit.store', 'memory')]()
+
+    def too_many(retry_after):
+        return HTTPTooManyRequests(headers={
+            'Retry-After': str(int(math.ceil(retry_after)))})
+
+    def ratelimit_tween(request):
+        # Views of limited routes only act on POSTs
+        if request.method != 'POST':
+            return handler(request)
+        # Tweens run before routing, so match the route here
+        info = registry.getUtility(IRoutesMapper)(request)
+        route = info['route']
+        if route is None or route.name not in limits:
+            return handler(request)
+
+        rate, burst = limits[route.name]
+        for key in request_keys(request):
+            allowed, retry_after = store.take(
+                '{0}:{1}'.format(route.name, key), rate, burst)
+            if not allowed:
+                return too_many(retry_after)
+
+        # Only failures count against the account tried, so that others
+        # can't use up its owner's attempts by succeeding
+        account = account_key(request)
+        if account is not None:
+            account = '{0}:{1}'.format(route.name, account)
+            allowed, retry_after = store.take(account, rate, burst, cost=0)
+            if not allowed:
+                return too_many(retry_after)
+        response = handler(request)
+        if account is not None and request.environ.get(FAILED_KEY):
+            store.take(account, rate, burst)
+        return response
+    return ratelimit_tween
@@ -23,6 +23,9 @@ def includeme(config):
     config.add_route('profile', '/users/{id}')
     ## Email
     config.add_route('emailuser', '/users/{id}/email')
+    ## API Tokens
+    config.add_route('addtoken', '/users/{id}/tokens/add')
+    config.add_route('deletetoken', '/users/tokens/{id}/delete')
 
     # Mods
     ## Listing
@@ -77,6 +80,7 @@ def includeme(config):
     ## Builds
     config.add_route('addbuild', '/packs/{id}/builds/add')
     config.add_route('deletebuild', '/packs/builds/{id}/delete')
+    config.add_route('downloadbundle', '/packs/builds/{id}/bundle.zip')
     config.add_route('downloadbuild', '/packs/builds/{id}')
     config.add_route('buildbyrev', '/packs/{id}/builds/{rev}')
     config.add_route('mcuxml', '/packs/builds/{id}/mcuxml')
@@ -94,7 +98,14 @@ def includeme(config):
     config.add_route('deleteserver', '/servers/{id}/delete')
     config.add_route('viewserver', '/servers/{id}')
 
+    # Jobs
+    config.add_route('jobstatus', '/jobs/{id}')
+
+    # API
+    config.add_route('apiversions', '/api/versions')
+
     # Admin
     config.add_route('maintenance', '/admin/maintenance')
+    config.add_route('metrics', '/metrics')
 
     config.add_static_view('static', 'packassembler:static/dist', cache_max_age=3600)
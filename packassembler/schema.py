@@ -1,4 +1,5 @@
 from functools import total_ordering
+from datetime import datetime
 from mongoengine import *
 
 # Mod targets
@@ -7,6 +8,19 @@ TARGETS = ('server', 'client', 'both')
 MCVERSIONS = ('1.7.10', '1.7.2', '1.6.4')
 # Forge version length
 FV = 16
+# Background job states
+JOB_STATES = ('queued', 'running', 'done', 'failed')
+# Outbound mail states
+MAIL_STATES = ('queued', 'sending', 'sent', 'failed')
+# Seconds revocations are kept, longer than tickets with claims are valid
+# for, see security.CLAIMS_LIFETIME
+REVOCATION_LIFETIME = 35 * 24 * 3600
+
+
+# Indexes
+# Every query the app makes should use one of the indexes declared in meta,
+# next to those made for unique fields. admin_scripts/indexes.py creates them
+# and reports missing, unused and redundant ones.
 
 
 class User(Document):
@@ -23,6 +37,8 @@ class User(Document):
     email_hash = StringField(default='')
     # Last login
     last_login = DateTimeField()
+    # Incremented when the group changes, invalidating auth ticket claims
+    auth_version = IntField(default=0)
 
     # Codes
     ## Activation code
@@ -31,11 +47,51 @@ class User(Document):
     reset = IntField()
 
     meta = {
-        'indexes': ['username'],
+        # username and email are unique, so already indexed
+        'indexes': [],
         'ordering': ['username']
     }
 
 
+class ApiToken(Document):
+    owner = ReferenceField(User, required=True, reverse_delete_rule=CASCADE)
+    # Label chosen by the owner
+    name = StringField(required=True, max_length=64)
+    # Keyed hash of the token, the token itself is only shown once
+    digest = StringField(required=True, unique=True)
+    created = DateTimeField(default=datetime.now)
+    last_used = DateTimeField()
+
+    meta = {
+        'indexes': ['owner']
+    }
+
+
+class Revocation(Document):
+    # User whose auth ticket claims changed
+    username = StringField(required=True)
+    # Claims of older versions are stale, -1 if the user was deleted
+    version = IntField(required=True)
+    created = DateTimeField(default=datetime.now)
+
+    meta = {
+        # Dropped once every ticket they make stale has expired
+        'indexes': [{'fields': ['created'], 'expireAfterSeconds': REVOCATION_LIFETIME}]
+    }
+
+
+class JarInfo(EmbeddedDocument):
+    # Declared in mcmod.info
+    mod_ids = ListField(StringField())
+    versions = ListField(StringField())
+    mc_versions = ListField(StringField())
+    # Packages containing classes
+    packages = ListField(StringField())
+    # Number of entries in the jar
+    file_count = IntField()
+    size = IntField()
+
+
 class ModVersion(Document):
     # Minecraft version
     mc_version = StringField(required=True, choices=MCVERSIONS)
@@ -44,22 +100,42 @@ class ModVersion(Document):
     forge_min = StringField(max_length=FV)
     # Dependencies
     depends = ListField(ReferenceField('Mod'))
-    # Actual version number
-    version = StringField(required=True)
+    # Actual version number, unique per mod
+    version = StringField(required=True, unique_with='mod')
     # A link to a changelog
     changelog = URLField()
     # The file itself
     mod_file = FileField(collection_name='modfs')
+    mod_file_md5 = StringField(max_length=32)
+    mod_file_sha1 = StringField(max_length=40)
+    mod_file_size = IntField()
     mod_file_url = URLField()
     mod_file_url_md5 = StringField(max_length=32)
+    # Why the worker could not fetch or hash mod_file_url, shown to the owner
+    fetch_error = StringField()
     # Reference Mod ModVersion belongs to
     mod = ReferenceField('Mod') # Required
     # Is a development version
     devel = BooleanField(default=False)
+    # Contents of the file, read when it is stored
+    jar = EmbeddedDocumentField(JarInfo)
+
+    meta = {
+        'indexes': [
+            # The unique index on version and mod can't find a mod's versions
+            'mod',
+            'mc_version',
+            'depends',
+            'jar.mod_ids',
+            'jar.packages'
+        ]
+    }
 
     @property
     def md5(self):
-        return self.mod_file.md5 if self.mod_file else self.mod_file_url_md5
+        if self.mod_file:
+            return self.mod_file_md5 or self.mod_file.md5
+        return self.mod_file_url_md5
 
 
 class Banner(EmbeddedDocument):
@@ -107,6 +183,7 @@ class Mod(Document):
     banner = EmbeddedDocumentField(Banner)
 
     meta = {
+        'indexes': ['owner', 'outdated', 'versions'],
         'ordering': ['name']
     }
 
@@ -127,6 +204,10 @@ class PackBuild(Document):
     # Reference Pack PackBuild belongs to
     pack = ReferenceField('Pack', required=True)
 
+    meta = {
+        'indexes': [('pack', 'revision'), 'mod_versions']
+    }
+
 
 class Pack(Document):
     # Information
@@ -148,6 +229,7 @@ class Pack(Document):
     base = BooleanField(default=False)
 
     meta = {
+        'indexes': ['mods', 'bases', 'builds', 'owner'],
         'ordering': ['name'],
     }
 
@@ -172,6 +254,7 @@ class Server(Document):
     banner = EmbeddedDocumentField(Banner)
 
     meta = {
+        'indexes': ['owner', 'build'],
         'ordering': ['name']
     }
 
@@ -179,3 +262,62 @@ class Server(Document):
 class Setting(DynamicDocument):
     # Key
     key = StringField(required=True, max_length=16, unique=True)
+
+
+class Job(Document):
+    # Name of the handler that runs the job
+    kind = StringField(required=True)
+    # Arguments given to the handler
+    params = DictField()
+    # User who queued the job, only they and moderators can see it
+    owner = ReferenceField(User, reverse_delete_rule=CASCADE)
+    # Progress
+    status = StringField(choices=JOB_STATES, default='queued')
+    error = StringField()
+    # Times
+    created = DateTimeField(default=datetime.now)
+    started = DateTimeField()
+    finished = DateTimeField()
+
+    meta = {
+        'indexes': [('status', 'created')]
+    }
+
+
+class OutboundMail(Document):
+    # Message, the default sender is used if there is none
+    sender = StringField()
+    recipients = ListField(StringField(), required=True)
+    subject = StringField()
+    body = StringField()
+    html = StringField()
+    headers = DictField()
+    # Delivery
+    status = StringField(choices=MAIL_STATES, default='queued')
+    attempts = IntField(default=0)
+    next_attempt = DateTimeField(default=datetime.now)
+    error = StringField()
+    # Times
+    created = DateTimeField(default=datetime.now)
+    claimed = DateTimeField()
+    sent = DateTimeField()
+
+    meta = {
+        'indexes': [('status', 'next_attempt')]
+    }
+
+
+class PendingNotification(Document):
+    # Recipient, notifications are sent to each owner as one digest
+    owner = ReferenceField(User, required=True, reverse_delete_rule=CASCADE)
+    # Mod marked as outdated
+    mod = ReferenceField(Mod, required=True, unique_with='owner',
+                         reverse_delete_rule=CASCADE)
+    mod_name = StringField()
+    mod_url = StringField()
+    created = DateTimeField(default=datetime.now)
+
+    meta = {
+        # Digests list an owner's mods by name
+        'indexes': ['created', ('owner', 'mod_name')]
+    }
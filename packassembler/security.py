@@ -1,32 +1,226 @@
 from pyramid.authentication import AuthTktAuthenticationPolicy
 from pyramid.authorization import ACLAuthorizationPolicy
 from pyramid.security import Allow, Everyone
-from mongoengine import connect
-from .schema import User
+from .schema import User, Revocation, ApiToken, REVOCATION_LIFETIME
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from pyramid.settings import asbool
+import threading
+import hashlib
+import secrets
 import bcrypt
 import hmac
+import time
 
 
 hpass = lambda password: hmac.new(password.encode()).digest()
 
+# Fields of the logged in user needed by auth, views and templates
+USER_FIELDS = ('username', 'group', 'email', 'email_hash', 'avatar_type')
+# Seconds between refreshes of the revocation map, override with
+# auth.claims_refresh
+CLAIMS_REFRESH = 30
+# Seconds a ticket with claims is valid for, override with
+# auth.claims_lifetime. Must be shorter than schema.REVOCATION_LIFETIME, so
+# that revocations outlive the tickets they make stale.
+CLAIMS_LIFETIME = 30 * 24 * 3600
+# Password hashing defaults, override with auth.bcrypt_rounds,
+# auth.bcrypt_threads and auth.bcrypt_queue
+BCRYPT_ROUNDS = 12
+BCRYPT_THREADS = 2
+# Checks allowed to wait for a thread before new ones are turned away
+BCRYPT_QUEUE = 16
+# Key API tokens are hashed with, override with auth.token_key
+TOKEN_KEY = 'apitokensek'
+# How often a token's last use is recorded, in seconds
+TOKEN_USE_INTERVAL = 3600
+
 
 def includeme(config):
+    settings = config.get_settings()
+    configure_hasher(settings)
+    configure_tokens(settings)
     config.set_root_factory('packassembler.security.Root')
-    authn_policy = AuthTktAuthenticationPolicy('authtktpolicysek',
-                                               callback=find_group,
-                                               hashalg='sha512')
+    config.add_request_method(get_user, 'user', reify=True)
+    if asbool(settings.get('auth.claims')):
+        revocations.interval = int(settings.get('auth.claims_refresh', CLAIMS_REFRESH))
+        lifetime = int(settings.get('auth.claims_lifetime', CLAIMS_LIFETIME))
+        if lifetime + revocations.interval >= REVOCATION_LIFETIME:
+            raise ValueError('auth.claims_lifetime must be under {0} seconds'.format(
+                REVOCATION_LIFETIME - revocations.interval))
+        # Not reissued, a reissued ticket would keep its claims
+        authn_policy = ClaimsAuthenticationPolicy('authtktpolicysek',
+                                                  hashalg='sha512', timeout=lifetime)
+    else:
+        authn_policy = AuthTktAuthenticationPolicy('authtktpolicysek',
+                                                   callback=find_group,
+                                                   hashalg='sha512')
     authz_policy = ACLAuthorizationPolicy()
     config.set_authorization_policy(authz_policy)
     config.set_authentication_policy(authn_policy)
 
 
+def get_user(request):
+    """ The logged in user, loaded once per request as request.user. """
+    userid = request.unauthenticated_userid
+    if userid is not None:
+        return User.objects(username=userid).only(*USER_FIELDS).first()
+
+
 def find_group(userid, request):
-    connect('', host=request.registry.settings.get('mongodb', 'packassembler'))
-    user = User.objects(username=userid).first()
+    user = request.user
     if user is not None:
         return ['group:' + user.group]
 
 
+# Ticket claims
+# With auth.claims on, the ticket carries the user's group and auth version,
+# so requests are authorized without loading the user. Claims are trusted
+# unless the auth version changed since the ticket was issued.
+
+def claim_tokens(user):
+    """ Tokens to remember user with. """
+    return ('group-' + user.group, 'version-{0}'.format(user.auth_version))
+
+
+def parse_claims(tokens):
+    """ Returns the group and auth version in tokens, or None. """
+    claims = dict(t.split('-', 1) for t in tokens if '-' in t)
+    try:
+        return claims['group'], int(claims['version'])
+    except (KeyError, ValueError):
+        return None
+
+
+class Revocations(object):
+
+    """
+    Auth versions of users whose claims changed, kept in memory and refreshed
+    from the revocation collection every interval seconds.
+    """
+
+    def __init__(self, interval=CLAIMS_REFRESH):
+        self.interval = interval
+        self.versions = {}
+        self.since = None
+        self.checked = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.checked is not None and now - self.checked < self.interval:
+            return
+        # Another thread is refreshing, use what is there meanwhile
+        if not self.lock.acquire(False):
+            return
+        try:
+            # Overlap with the last refresh to allow for clock differences
+            # between processes
+            since = datetime.now() - timedelta(seconds=self.interval)
+            query = Revocation.objects
+            if self.since is not None:
+                query = query(created__gte=self.since)
+            for revocation in query.order_by('created'):
+                self.versions[revocation.username] = revocation.version
+            self.since = since
+            self.checked = now
+        finally:
+            self.lock.release()
+
+    def is_current(self, username, version):
+        self.refresh()
+        return self.versions.get(username, 0) == version
+
+    def revoke(self, username, version):
+        Revocation(username=username, version=version).save()
+        self.versions[username] = version
+
+
+revocations = Revocations()
+
+
+def revoke(user, deleted=False):
+    """ Makes claims issued to user before now stale. """
+    revocations.revoke(user.username, -1 if deleted else user.auth_version)
+
+
+class ClaimsAuthenticationPolicy(AuthTktAuthenticationPolicy):
+
+    """ Takes the group from ticket claims instead of the database. """
+
+    def __init__(self, secret, **kwargs):
+        super().__init__(secret, callback=self.find_claims, **kwargs)
+
+    def find_claims(self, userid, request):
+        identity = self.cookie.identify(request)
+        claims = parse_claims(identity['tokens']) if identity else None
+        if claims is not None:
+            group, version = claims
+            if revocations.is_current(userid, version):
+                return ['group:' + group]
+        # Stale, or issued before claims were turned on
+        return find_group(userid, request)
+
+
+# Passwords
+# bcrypt runs on a small pool of threads, so that a burst of logins can't
+# occupy every request thread. Callers still wait for the result, but once
+# the pool and its queue are full further checks fail fast with Overloaded.
+
+class Overloaded(Exception):
+    pass
+
+
+class Hasher(object):
+
+    """ Runs bcrypt on a bounded pool of threads. """
+
+    def __init__(self, rounds=BCRYPT_ROUNDS, threads=BCRYPT_THREADS,
+                 queue=BCRYPT_QUEUE):
+        self.rounds = rounds
+        self.executor = ThreadPoolExecutor(threads)
+        self.slots = threading.BoundedSemaphore(threads + queue)
+
+    def run(self, func, *args):
+        if not self.slots.acquire(False):
+            raise Overloaded
+        try:
+            future = self.executor.submit(func, *args)
+        except:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda f: self.slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self.run(bcrypt.hashpw, hpass(password), bcrypt.gensalt(self.rounds))
+
+    def check(self, password, hashed):
+        return self.run(bcrypt.hashpw, hpass(password), hashed) == hashed
+
+    def needs_rehash(self, hashed):
+        return hash_rounds(hashed) != self.rounds
+
+
+hasher = Hasher()
+
+
+def configure_hasher(settings):
+    global hasher
+    hasher.executor.shutdown(wait=False)
+    hasher = Hasher(int(settings.get('auth.bcrypt_rounds', BCRYPT_ROUNDS)),
+                    int(settings.get('auth.bcrypt_threads', BCRYPT_THREADS)),
+                    int(settings.get('auth.bcrypt_queue', BCRYPT_QUEUE)))
+
+
+def hash_rounds(hashed):
+    """ The cost a bcrypt hash was made with, from $2b$<rounds>$... """
+    try:
+        return int(hashed.split(b'$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
 def check_pass(username, password):
     if '@' in username:
         user = User.objects(email=username).first()
@@ -34,13 +228,20 @@ def check_pass(username, password):
         user = User.objects(username=username).first()
 
     try:
-        password_correct = bcrypt.hashpw(hpass(password), user.password) == user.password
+        password_correct = hasher.check(password, user.password)
     except AttributeError:
         return False
 
     if password_correct and user.activate is None:
+        changed = False
         if user.reset:
             user.reset = None
+            changed = True
+        # The work factor was changed since the password was set
+        if hasher.needs_rehash(user.password):
+            user.password = hasher.hash(password)
+            changed = True
+        if changed:
             user.save()
         return user
     else:
@@ -48,7 +249,61 @@ def check_pass(username, password):
 
 
 def password_hash(password):
-    return bcrypt.hashpw(hpass(password), bcrypt.gensalt())
+    return hasher.hash(password)
+
+
+# API tokens
+# Tokens let automation authenticate without a password. Only an HMAC of each
+# token is stored, which unlike a bcrypt hash is cheap to check per request.
+
+_token_key = TOKEN_KEY.encode()
+
+
+def configure_tokens(settings):
+    global _token_key
+    _token_key = settings.get('auth.token_key', TOKEN_KEY).encode()
+
+
+def token_digest(token):
+    return hmac.new(_token_key, token.encode(), hashlib.sha256).hexdigest()
+
+
+def new_token(user, name):
+    """ Creates an API token for user, returns it and its document. """
+    token = secrets.token_urlsafe(32)
+    api_token = ApiToken(owner=user, name=name, digest=token_digest(token))
+    api_token.save()
+    return token, api_token
+
+
+def request_token(request):
+    """
+    The API token sent as "Authorization: Token <token>", or as the token
+    field of a POST body. Never taken from the query string, which ends up in
+    logs and Referer headers.
+    """
+    auth = request.headers.get('Authorization', '')
+    if auth.startswith('Token '):
+        return auth[len('Token '):].strip() or None
+    if request.method == 'POST':
+        return request.POST.get('token') or None
+
+
+def token_user(request):
+    """ The user the request's API token belongs to. """
+    token = request_token(request)
+    if token is None:
+        return None
+
+    api_token = ApiToken.objects(digest=token_digest(token)).first()
+    if api_token is None:
+        return None
+
+    now = datetime.now()
+    if (api_token.last_used is None or
+            now - api_token.last_used > timedelta(seconds=TOKEN_USE_INTERVAL)):
+        api_token.update(set__last_used=now)
+    return api_token.owner
 
 
 class Root(object):
@@ -0,0 +1,309 @@
+from pymongo.errors import DuplicateKeyError
+from tempfile import SpooledTemporaryFile
+from contextlib import contextmanager
+from mongoengine.fields import GridFSProxy
+from mongoengine.connection import get_db
+from gridfs.errors import FileExists
+from pymongo import ReturnDocument
+from .jars import read_jar
+from . import outbound
+from gridfs import GridFS
+from io import BytesIO
+import hashlib
+
+# GridFS collection mod files are kept in
+COLLECTION = 'modfs'
+# Size of the chunks read from uploads and remote files
+CHUNK_SIZE = 256 * 1024
+# Spooled files stay in memory up to this size, then move to disk
+SPOOL_SIZE = 1024 * 1024
+# Times a blob is written while others store and release the same file
+STORE_ATTEMPTS = 5
+# Default limit on the size of a mod file, override with storage.max_size
+MAX_SIZE = 64 * 1024 * 1024
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+class Digest(object):
+
+    """ MD5, SHA-1, SHA-256 and size of a stream, computed as it is read. """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.size = 0
+        self._md5 = hashlib.md5()
+        self._sha1 = hashlib.sha1()
+        self._sha256 = hashlib.sha256()
+
+    @property
+    def md5(self):
+        return self._md5.hexdigest()
+
+    @property
+    def sha1(self):
+        return self._sha1.hexdigest()
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+    def update(self, chunk):
+        self.size += len(chunk)
+        if self.max_size and self.size > self.max_size:
+            raise FileTooLarge
+        self._md5.update(chunk)
+        self._sha1.update(chunk)
+        self._sha256.update(chunk)
+
+    def wrap(self, chunks):
+        for chunk in chunks:
+            self.update(chunk)
+            yield chunk
+
+
+def max_size(settings):
+    return int(settings.get('storage.max_size', MAX_SIZE))
+
+
+def iter_file(f, chunk_size=CHUNK_SIZE):
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def open_upload(upload):
+    """ Returns the file and length of an upload. """
+    f = upload.file
+    if isinstance(f, bytes):
+        f = BytesIO(f)
+
+    try:
+        f.seek(0, 2)
+        length = f.tell()
+        f.seek(0)
+    except (AttributeError, IOError):
+        length = None
+
+    return f, length
+
+
+@contextmanager
+def open_url(url):
+    """
+    Opens a remote file for the with block, giving its chunks, length and
+    final url. The connection is given back when the block ends.
+    """
+    with outbound.stream(url) as response:
+        length = response.headers.get('Content-Length')
+        yield response.iter_content(CHUNK_SIZE), int(length) if length else None, response.url
+
+
+def spool(chunks):
+    """ Copies chunks into a temporary file, kept in memory while small. """
+    tmp = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    for chunk in chunks:
+        tmp.write(chunk)
+    tmp.seek(0)
+    return tmp
+
+
+def seekable(source):
+    try:
+        return source.seekable()
+    except AttributeError:
+        return hasattr(source, 'seek')
+
+
+def hash_stream(chunks, limit=None):
+    digest = Digest(limit)
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest
+
+
+def stage(source, digest):
+    """
+    Hashes source, a file or an iterable of chunks, and returns a file to read
+    it back from. Only sources that can't be rewound are spooled.
+    """
+    if seekable(source):
+        start = source.tell()
+        for chunk in iter_file(source):
+            digest.update(chunk)
+        source.seek(start)
+        return source
+    else:
+        if hasattr(source, 'read'):
+            source = iter_file(source)
+        return spool(digest.wrap(source))
+
+
+# Blobs
+# Each distinct file is stored once in GridFS, addressed by its SHA-256. The
+# file document counts the ModVersions referencing it in refs.
+
+_indexed = False
+
+
+def files_collection():
+    return get_db()[COLLECTION + '.files']
+
+
+def ensure_indexes():
+    global _indexed
+    if not _indexed:
+        files_collection().create_index('sha256', unique=True, sparse=True,
+                                        background=True)
+        _indexed = True
+
+
+def acquire(sha256):
+    """ Adds a reference to the blob with the given hash, if it exists. """
+    doc = files_collection().find_one_and_update(
+        {'sha256': sha256}, {'$inc': {'refs': 1}}, projection={'_id': True})
+    return doc['_id'] if doc else None
+
+
+def release(grid_id):
+    """ Drops a reference to a blob, deleting it once nothing uses it. """
+    files = files_collection()
+    doc = files.find_one_and_update(
+        {'_id': grid_id}, {'$inc': {'refs': -1}},
+        projection={'refs': True}, return_document=ReturnDocument.AFTER)
+    # Files stored before reference counting have no refs and one owner, so
+    # they end up at -1. Only delete if nothing acquired the blob meanwhile.
+    if doc and files.delete_one({'_id': grid_id, 'refs': {'$lte': 0}}).deleted_count:
+        get_db()[COLLECTION + '.chunks'].delete_many({'files_id': grid_id})
+
+
+def write_grid(fs, chunks, **kwargs):
+    """ Writes chunks to GridFS, removing what was written on failure. """
+    grid_in = fs.new_file(**kwargs)
+    try:
+        for chunk in chunks:
+            grid_in.write(chunk)
+        grid_in.close()
+    except BaseException:
+        fs.delete(grid_in._id)
+        raise
+    return grid_in._id
+
+
+def store_blob(f, digest):
+    """ Stores f as a blob, or references the stored one with its hash. """
+    ensure_indexes()
+    fs = GridFS(get_db(), COLLECTION)
+    start = f.tell()
+    for attempt in range(1, STORE_ATTEMPTS + 1):
+        grid_id = acquire(digest.sha256)
+        if grid_id is not None:
+            return grid_id
+        try:
+            return write_grid(fs, iter_file(f), sha256=digest.sha256, refs=1)
+        except (DuplicateKeyError, FileExists):
+            # Someone else stored the same file first. Acquire theirs, or
+            # write it again if it was released meanwhile.
+            if attempt == STORE_ATTEMPTS:
+                raise
+            f.seek(start)
+
+
+# Mod files
+
+def store_mod_file(mv, source, length=None, limit=MAX_SIZE):
+    """
+    Stores a mod file for mv, given as a file or an iterable of chunks.
+    Raises FileTooLarge if the file is larger than limit. The file mv had
+    is not released, use ModFileChange to replace one.
+    """
+    if limit and length is not None and length > limit:
+        raise FileTooLarge
+
+    digest = Digest(limit)
+    f = stage(source, digest)
+    try:
+        jar = read_jar(f, digest.size)
+        grid_id = store_blob(f, digest)
+    finally:
+        if f is not source:
+            f.close()
+
+    mv.mod_file = GridFSProxy(grid_id, key='mod_file', instance=mv,
+                              collection_name=COLLECTION)
+    mv.mod_file_md5 = digest.md5
+    mv.mod_file_sha1 = digest.sha1
+    mv.mod_file_size = digest.size
+    mv.jar = jar
+
+
+def clear_mod_file(mv):
+    mv.mod_file = None
+    mv.mod_file_md5 = None
+    mv.mod_file_sha1 = None
+    mv.mod_file_size = None
+    mv.jar = None
+
+
+def release_mod_file(mv):
+    """ Releases the file of mv, once it was deleted. """
+    if mv.mod_file:
+        release(mv.mod_file.grid_id)
+    clear_mod_file(mv)
+
+
+class ModFileChange(object):
+
+    """
+    Stores or clears the file of a ModVersion saved in the with block. The
+    file it had is released once the block succeeds, the stored one if it
+    fails, so the saved version never points at a released file.
+    """
+
+    def __init__(self, mv):
+        self.mv = mv
+        self.stored = []
+        self.replaced = []
+
+    def store(self, source, length=None, limit=MAX_SIZE):
+        self.clear()
+        store_mod_file(self.mv, source, length, limit)
+        self.stored.append(self.mv.mod_file.grid_id)
+
+    def clear(self):
+        if self.mv.mod_file:
+            self.replaced.append(self.mv.mod_file.grid_id)
+        clear_mod_file(self.mv)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        for grid_id in (self.replaced if exc_type is None else self.stored):
+            release(grid_id)
+
+
+@contextmanager
+def detached_mod_files(versions):
+    """
+    Unsets the files of versions, a ModVersion queryset, for the versions to
+    be deleted in the with block, and releases the files once it succeeds.
+    Deleting a document deletes its file too, though other versions may
+    share the blob.
+    """
+    files = dict((doc['_id'], doc['mod_file'])
+                 for doc in versions.only('mod_file').as_pymongo() if doc.get('mod_file'))
+    if files:
+        versions.filter(id__in=list(files)).update(__raw__={'$unset': {'mod_file': True}})
+    try:
+        yield
+    except BaseException:
+        for version, grid_id in files.items():
+            versions.filter(id=version).update_one(__raw__={'$set': {'mod_file': grid_id}})
+        raise
+    for grid_id in files.values():
+        release(grid_id)
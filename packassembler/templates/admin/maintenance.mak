@@ -1,5 +1,6 @@
 <%inherit file="../base.mak"/>
 <%namespace name="extras" file="../extras.mak" />
+<%namespace name="form" file="../form.mak" />
 
 ${extras.flash()}
 <h2>${title}</h2>
@@ -11,3 +12,36 @@ ${extras.flash()}
         <input type="submit" class="btn btn-default" name="remove_old_versions" value="Remove Old Versions" />
     </form>
 </div>
+<div>
+    <h3>Response Cache</h3>
+    % if cache:
+    <p>${len(cache.entries)} pages cached, ${cache.hits} hits, ${cache.misses} misses (${'{0:.1%}'.format(cache.hit_ratio)} hit ratio).</p>
+    % else:
+    <p>Disabled, set cache.routes to enable.</p>
+    % endif
+</div>
+<div>
+    <h3>Profiler</h3>
+    <p>Profiles the given percent of requests to the routes listed, separated by spaces, or to every route if none are.</p>
+    <form action="" method="post" role="form" class="form-horizontal">
+        ${form.showfield(pf.enabled)}
+        ${form.showfield(pf.rate)}
+        ${form.showfield(pf.routes)}
+        ${form.showsubmit(None, name='profiler_submit')}
+    </form>
+    % for route, summary in sorted(profiles.items()):
+    <h4>${route}</h4>
+    <p>${summary['requests']} requests profiled, ${'{0:.1f}'.format(summary['seconds'] * 1000)}ms on average. Calls and times are per request.</p>
+    <table class="table table-condensed">
+        <tr><th>Function</th><th>Calls</th><th>Own Time</th><th>Total Time</th></tr>
+        % for f in summary['functions']:
+        <tr>
+            <td>${f['function']}</td>
+            <td>${'{0:g}'.format(f['calls'])}</td>
+            <td>${'{0:.1f}'.format(f['tottime'] * 1000)}ms</td>
+            <td>${'{0:.1f}'.format(f['cumtime'] * 1000)}ms</td>
+        </tr>
+        % endfor
+    </table>
+    % endfor
+</div>
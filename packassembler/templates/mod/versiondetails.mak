@@ -6,8 +6,16 @@
         <td>Uploaded</td><td>${version.id.generation_time.strftime('%e %b %Y %I:%m:%S %p')}</td>
     </tr>
     <tr>
-        <td>MD5</td><td>${version.mod_file.md5 if version.mod_file else version.mod_file_url_md5}</td>
+        <td>MD5</td><td>${version.md5}</td>
     </tr>
+% if version.jar:
+    <tr>
+        <td>Size</td><td>${'{0:.1f}'.format(version.jar.size / 1024.0)} KiB, ${version.jar.file_count} files</td>
+    </tr>
+    % if version.jar.mod_ids:
+    <tr><td>Mod IDs</td><td>${', '.join(version.jar.mod_ids)}</td></tr>
+    % endif
+% endif
 % if version.forge_min:
     <tr><td>Forge Min</td><td>${version.forge_min}</td></tr>
 % endif
@@ -21,4 +29,24 @@
         </td>
     </tr>
 % endif
+% if providers:
+    <tr>
+        <td>Same Mod IDs As</td>
+        <td>
+        % for mod in providers:
+            <a href="${request.route_url('viewmod', id=mod.id)}">${mod.name}</a><br>
+        % endfor
+        </td>
+    </tr>
+% endif
+% if conflicts:
+    <tr>
+        <td>Shares Packages With</td>
+        <td>
+        % for mod in conflicts:
+            <a href="${request.route_url('viewmod', id=mod.id)}">${mod.name}</a><br>
+        % endfor
+        </td>
+    </tr>
+% endif
 </table>
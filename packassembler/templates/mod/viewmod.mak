@@ -145,6 +145,9 @@
                 <td>
                 % if version.mod_file_url != None:
                     <span class="text-danger">True</span>
+                    % if perm and version.fetch_error:
+                        <span class="text-danger" title="${version.fetch_error}"><i class="fa fa-exclamation-triangle"></i> Fetch failed</span>
+                    % endif
                 % else:
                     False
                 % endif
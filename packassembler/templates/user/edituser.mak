@@ -43,5 +43,30 @@
                 </form>
             </div>
         </div>
+        <div class="panel panel-default">
+            <div class="panel-heading">
+                <h4>API Tokens</h4>
+            </div>
+            <div class="panel-body">
+                <p>Tokens let scripts add mod versions without your password.</p>
+                % if tokens:
+                <table class="table">
+                    <tr><th>Name</th><th>Created</th><th>Last Used</th><th></th></tr>
+                    % for token in tokens:
+                    <tr>
+                        <td>${token.name}</td>
+                        <td>${token.created.strftime('%e %b %Y %I:%M:%S %p')}</td>
+                        <td>${token.last_used.strftime('%e %b %Y %I:%M:%S %p') if token.last_used else 'Never'}</td>
+                        <td><a href="${request.route_url('deletetoken', id=token.id)}"><i class="fa fa-trash-o fa-fw"></i> Delete</a></td>
+                    </tr>
+                    % endfor
+                </table>
+                % endif
+                <form method="POST" role="form" class="form-horizontal" action="${request.route_url('addtoken', id=owner.id)}">
+                    ${form.showfield(tf.name)}
+                    ${form.showsubmit(None, name='token_submit')}
+                </form>
+            </div>
+        </div>
     </div>
 </div>
\ No newline at end of file
@@ -7,7 +7,7 @@
     <div class="col-lg-12">
         ${extras.flash()}
         ${form.formerror(error)}
-        <form method="POST" role="form" class="form-horizontal">
+        <form method="POST" role="form" class="form-horizontal" action="${request.route_url('login')}">
             ${form.showfield(f.username)}
             ${f.came_from()}
             ${form.showfield(f.password)}
@@ -0,0 +1,11 @@
+<%inherit file="base.mak"/>
+<h2>${title}</h2>
+<hr>
+<div class="row">
+    <div class="col-lg-12">
+        <p>Copy the token for <strong>${api_token.name}</strong> now, it won't be shown again.</p>
+        <pre>${token}</pre>
+        <p>Send it as an <code>Authorization: Token ...</code> header.</p>
+        <a href="${back}" class="btn btn-default">Back</a>
+    </div>
+</div>
@@ -1,3 +1,5 @@
+from pyramid.request import apply_request_extensions
+from packassembler.instrumentation import recording
 from pyramid import testing
 from copy import copy
 
@@ -5,6 +7,11 @@ from copy import copy
 class DummyRequest(testing.DummyRequest):
     session = {}
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Provides request.user
+        apply_request_extensions(self)
+
     def flash(self, msg):
         self.session['flash'] = [msg]
 
@@ -32,6 +39,31 @@ class BaseTest:
     def authenticate(self, user):
         self.config.testing_securitypolicy(userid=user.username)
 
+    def call_view(self, request, name):
+        """
+        Calls the view method name, returning its result and the number of
+        queries it made. Querysets the view returns unevaluated aren't counted.
+        """
+        with recording() as stats:
+            result = getattr(self.make_one(request), name)()
+        return result, stats.queries
+
+    def assert_queries(self, budget, request, name):
+        """ Calls a view, failing if it makes more than budget queries. """
+        result, queries = self.call_view(request, name)
+        assert queries <= budget, '{0} made {1} queries, over the budget of {2}'.format(
+            name, queries, budget)
+        return result
+
+    def assert_constant_queries(self, make_request, name, small, large):
+        """
+        Fails if a view makes more queries for a large fixture than a small
+        one. make_request is called with each size and returns the request.
+        """
+        counts = [self.call_view(make_request(size), name)[1] for size in (small, large)]
+        assert counts[0] == counts[1], '{0} made {1} queries for {2} and {3} for {4}'.format(
+            name, counts[0], small, counts[1], large)
+
 
 def match_request(params=None, **kwargs):
     return DummyRequest(matchdict=kwargs, params=params)
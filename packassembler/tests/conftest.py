@@ -1,6 +1,14 @@
 import uuid
+import time
 import pytest
 import packassembler.schema as db
+from packassembler import instrumentation
+from packassembler.instrumentation import query_listener
+from pyramid.renderers import render_to_response
+from pyramid.events import BeforeRender
+from pyramid import testing
+from unittest import mock
+from base import DummyRequest
 
 # Settings
 DB_NAME = str(uuid.uuid1())
@@ -10,8 +18,35 @@ DB_PORT = 27017
 
 @pytest.fixture(scope="session", autouse=True)
 def mongoengine_setup(request):
-    d = db.connect(DB_NAME, host=DB_HOST, port=DB_PORT)
+    # Counts queries for BaseTest.call_view
+    d = db.connect(DB_NAME, host=DB_HOST, port=DB_PORT, event_listeners=[query_listener])
 
     def fin():
         d.drop_database(DB_NAME)
     request.addfinalizer(fin)
+
+
+@pytest.fixture
+def templated_request(request):
+    """
+    Runs a request that renders a template through the instrumentation tween,
+    returning the response.
+    """
+    config = testing.setUp(settings={'instrumentation.headers': 'true'})
+    config.add_subscriber(instrumentation.render_started, BeforeRender)
+    # Takes a measurable time to render
+    config.add_renderer('.slow', lambda info: lambda value, system: time.sleep(0.01) or 'rendered')
+    request.addfinalizer(testing.tearDown)
+
+    def handler(request):
+        return render_to_response('page.slow', {}, request=request)
+
+    tween = instrumentation.instrumentation_tween_factory(handler, config.registry)
+
+    def run():
+        req = DummyRequest()
+        req.matched_route = mock.Mock()
+        req.matched_route.name = 'templated'
+        return tween(req)
+    run.registry = config.registry
+    return run
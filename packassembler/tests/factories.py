@@ -51,3 +51,12 @@ class ModVersionFactory(MongoEngineFactory):
         if create and extracted:
             self.mod = extracted
             self.save()
+
+
+class PackBuildFactory(MongoEngineFactory):
+    FACTORY_FOR = schema.PackBuild
+
+    revision = factory.Sequence(lambda n: n + 1)
+    mc_version = "1.6.4"
+    forge_version = "9.11.1.965"
+    pack = factory.SubFactory(PackFactory)
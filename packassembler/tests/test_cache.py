@@ -0,0 +1,128 @@
+import pytest
+
+from packassembler.cache import ResponseCache
+from packassembler.tweens import cache_tween_factory
+from packassembler import invalidation
+from pyramid.session import SignedCookieSessionFactory
+from pyramid.response import Response
+from pyramid.request import Request
+from pyramid import testing
+from unittest import mock
+
+
+def make_response(body):
+    response = Response(body)
+    response.set_cookie('session', 'private')
+    return response
+
+
+def test_hit_ratio_and_private_headers():
+    cache = ResponseCache()
+    assert cache.get('a') is None
+    cache.set('a', make_response(b'page'))
+    entry = cache.get('a')
+    assert entry.body == b'page'
+    assert not [h for h in entry.headerlist if h[0].lower() == 'set-cookie']
+    assert cache.hit_ratio == 0.5
+
+
+def test_lru_and_ttl():
+    cache = ResponseCache(max_entries=2, ttl=60)
+    for key in ('a', 'b'):
+        cache.set(key, make_response(b''))
+    cache.get('a')
+    cache.set('c', make_response(b''))
+    assert list(cache.entries) == ['a', 'c']
+
+    with mock.patch('time.monotonic', return_value=float('inf')):
+        assert cache.get('a') is None
+
+
+def test_invalidate_by_tag():
+    cache = ResponseCache()
+    cache.set('mod', make_response(b''), frozenset(['mod:1', 'packs']))
+    cache.set('pack', make_response(b''), frozenset(['pack:2']))
+    cache.set('other', make_response(b''))
+    cache.invalidate({'mod:1'})
+    assert list(cache.entries) == ['pack']
+
+
+def test_pages_rendered_during_a_change_are_not_kept():
+    cache = ResponseCache()
+    generation = cache.generation
+    cache.invalidate({'mods'})
+    cache.set('a', make_response(b''), frozenset(['mods']), generation)
+    assert cache.get('a') is None
+
+
+@pytest.fixture
+def get(request):
+    """
+    Gets pages through the cache tween, as a server would. The pages the
+    handler rendered are in get.rendered.
+    """
+    config = testing.setUp(settings={'cache.routes': 'modlist'})
+    config.add_route('modlist', '/mods')
+    config.set_session_factory(SignedCookieSessionFactory('secret'))
+    config.commit()
+    request.addfinalizer(testing.tearDown)
+
+    def handler(req):
+        get.rendered.append(req.path_qs)
+        return Response('page')
+
+    def get(path='/mods', **headers):
+        req = Request.blank(path, headers=headers)
+        req.registry = config.registry
+        # Applies conditional responses, as the server does
+        return req.get_response(tween(req))
+
+    tween = cache_tween_factory(handler, config.registry)
+    get.config = config
+    get.handler = handler
+    get.rendered = []
+    return get
+
+
+def test_tween_serves_anonymous_visitors_from_cache(get):
+    assert get().body == b'page'
+    response = get()
+    assert response.body == b'page'
+    assert response.headers['X-Cache'] == 'hit'
+    assert get.rendered == ['/mods']
+
+
+def test_tween_answers_not_modified(get):
+    etag = get().headers['ETag']
+    response = get(**{'If-None-Match': etag})
+    assert response.status_int == 304
+    assert not response.body
+
+
+def test_tween_cache_key(get):
+    get('/mods?a=1&b=2')
+    # Parameters in another order are the same page
+    get('/mods?b=2&a=1')
+    get('/mods?a=2')
+    get('/mods?a=2', **{'X-Requested-With': 'XMLHttpRequest'})
+    get('/mods?a=2', **{'X-Requested-With': 'XMLHttpRequest', 'Accept': 'application/json'})
+    assert get.rendered == ['/mods?a=1&b=2', '/mods?a=2', '/mods?a=2', '/mods?a=2']
+
+
+def test_tween_varies_on_accept(get):
+    assert get().vary == ('Accept', 'X-Requested-With')
+    assert get().vary == ('Accept', 'X-Requested-With')
+
+
+def test_tween_skips_cache_for_logged_in_users(get):
+    get.config.testing_securitypolicy(userid='someone')
+    get()
+    response = get()
+    assert 'X-Cache' not in response.headers
+    assert len(get.rendered) == 2
+
+
+def test_tween_subscribes_once_per_registry(get):
+    subscribers = len(invalidation._subscribers)
+    cache_tween_factory(get.handler, get.config.registry)
+    assert len(invalidation._subscribers) == subscribers
@@ -0,0 +1,35 @@
+from packassembler import instrumentation
+from pyramid.response import Response
+from pyramid import testing
+from base import DummyRequest
+from unittest import mock
+
+
+def test_tween_counts_queries(request):
+    event = mock.Mock(duration_micros=2000)
+
+    def handler(request):
+        for i in range(3):
+            instrumentation.query_listener.succeeded(event)
+        return Response('')
+
+    config = testing.setUp(settings={'instrumentation.headers': 'true',
+                                     'instrumentation.query_budget': '2'})
+    request.addfinalizer(testing.tearDown)
+    tween = instrumentation.instrumentation_tween_factory(handler, config.registry)
+    req = DummyRequest()
+    req.matched_route = None
+    with mock.patch.object(instrumentation.log, 'warning') as warning:
+        response = tween(req)
+
+    assert response.headers['X-Queries'] == '3'
+    assert response.headers['X-DB-Time'] == '6.0ms'
+    assert warning.called
+    # Queries outside of requests aren't counted
+    instrumentation.query_listener.succeeded(event)
+    assert instrumentation.current() is None
+
+
+def test_render_time(templated_request):
+    response = templated_request()
+    assert float(response.headers['X-Render-Time'][:-2]) >= 10
@@ -0,0 +1,138 @@
+import pytest
+
+from base import BaseTest, match_request
+from packassembler import invalidation
+from factories import ModFactory, PackFactory
+from webob.multidict import MultiDict
+from unittest import mock
+from datetime import datetime
+
+
+@pytest.fixture
+def published(request):
+    published = []
+    invalidation.subscribe(published.append)
+
+    def fin():
+        invalidation.unsubscribe(published.append)
+
+    request.addfinalizer(fin)
+    return published
+
+
+class TestInvalidation(BaseTest):
+    def _get_test_class(self):
+        from packassembler.views.packs import PackViews
+        return PackViews
+
+    def test_save_and_delete_publish_tags(self, published):
+        mod = ModFactory()
+        assert {'mod:{0}'.format(mod.id), 'mods'} in published
+        del published[:]
+        mod.owner.delete()
+        assert any('mod:{0}'.format(mod.id) in tags for tags in published)
+
+    def test_atomic_pack_updates_publish_tags(self, published):
+        pack = PackFactory()
+        mod = ModFactory()
+        del published[:]
+
+        self.authenticate(pack.owner)
+        request = match_request(id=str(pack.id), params=MultiDict(mods=str(mod.id)))
+        self.make_one(request).addpackmod()
+        assert published == [{'pack:{0}'.format(pack.id), 'packs', 'mod:{0}'.format(mod.id)}]
+        pack.owner.delete()
+        mod.owner.delete()
+
+    def test_worker_updates_publish_tags(self, published):
+        """ Ensure versions the worker changes without saving them are published. """
+        from packassembler.schema import ModVersion
+        from packassembler import jobs
+        url = 'http://example.com/mod.jar'
+        mod = ModFactory()
+        mv = ModVersion(mod=mod, version='1.0.0', mc_version='1.6.4', mod_file_url=url).save()
+        del published[:]
+
+        with mock.patch('packassembler.storage.open_url') as open_url:
+            open_url.return_value.__enter__.return_value = ([b'jar'], None, url)
+            jobs.hash_mod_file_url(str(mv.id), url)
+        assert {'version:{0}'.format(mv.id), 'mod:{0}'.format(mod.id), 'mods'} in published
+        mod.owner.delete()
+
+
+def test_channel_starts_once_per_process():
+    channel = invalidation.MongoChannel()
+    with mock.patch.object(channel, 'start') as start:
+        channel.ensure_started()
+        origin = channel.origin
+        channel.ensure_started()
+        assert start.call_count == 1
+        # A forked worker
+        with mock.patch.object(invalidation.os, 'getpid', return_value=-1):
+            channel.ensure_started()
+        assert start.call_count == 2
+        assert channel.origin != origin
+
+
+def test_weak_subscribers_go_with_their_object(published):
+    class Page(object):
+        def invalidate(self, tags):
+            published.append(tags)
+
+    page = Page()
+    invalidation.subscribe(page.invalidate, weak=True)
+    subscribers = len(invalidation._subscribers)
+    invalidation.publish('mods')
+    del page
+    invalidation.publish('packs')
+    # Once for each subscriber, then once for the fixture alone
+    assert published == [{'mods'}, {'mods'}, {'packs'}]
+    assert len(invalidation._subscribers) == subscribers - 1
+
+
+class Stop(Exception):
+    pass
+
+
+class FakeCursor(object):
+
+    """ Tailable cursor that returns each batch in turn, then dies. """
+
+    def __init__(self, *batches):
+        self.batches = list(batches)
+
+    @property
+    def alive(self):
+        return bool(self.batches)
+
+    def __iter__(self):
+        return iter(self.batches.pop(0))
+
+
+def test_channel_resumes_in_insertion_order(published):
+    """ Ensure messages with lower ids than the last one read aren't skipped. """
+    channel = invalidation.MongoChannel()
+    sent = datetime(2020, 1, 1)
+    newest = mock.Mock()
+    newest.sort.return_value.limit.return_value = [{'_id': 5, 'created': sent}]
+    cursor = FakeCursor([
+        {'_id': 3, 'origin': 'other', 'tags': ['old'], 'created': sent},
+        {'_id': 5, 'origin': 'other', 'tags': ['read'], 'created': sent},
+        # From a process whose ids are behind
+        {'_id': 4, 'origin': 'other', 'tags': ['new'], 'created': sent}
+    ], [
+        # Nothing came for a while, the cursor is still read
+        {'_id': 6, 'origin': channel.origin, 'tags': ['own'], 'created': sent},
+        {'_id': 2, 'origin': 'other', 'tags': ['later'], 'created': sent}
+    ])
+    channel._collection = mock.Mock()
+    channel._collection.find.side_effect = [newest, cursor]
+    channel._collection.find_one.return_value = {'_id': 5}
+
+    with mock.patch.object(invalidation.time, 'sleep', side_effect=Stop):
+        with pytest.raises(Stop):
+            channel.listen()
+    assert published == [{'new'}, {'later'}]
+    # The cursor starts around the last message read, not at the beginning
+    query = channel._collection.find.call_args[0][0]
+    assert query == {'created': {'$gte': sent - invalidation.CLOCK_SKEW}}
@@ -0,0 +1,70 @@
+import pytest
+
+from base import BaseTest, match_request
+from factories import UserFactory
+from packassembler.schema import Job
+from packassembler.views.common import NoPermission
+from packassembler import jobs, security
+
+
+@pytest.fixture
+def job(request):
+    job = jobs.enqueue('sample_job', owner=UserFactory(), value=1)
+
+    def fin():
+        job.delete()
+        job.owner.delete()
+
+    request.addfinalizer(fin)
+    return job
+
+
+@jobs.handler('sample_job')
+def sample_job(value):
+    if not value:
+        raise ValueError('no value')
+
+
+class TestJobViews(BaseTest):
+    def _get_test_class(self):
+        from packassembler.views.jobs import JobViews
+        return JobViews
+
+    def test_job_status_queued(self, job):
+        """ Ensure a new job is reported as queued. """
+        self.authenticate(job.owner)
+        response = self.make_one(match_request(id=job.id)).jobstatus()
+        assert response['status'] == 'queued'
+
+    def test_job_status_done(self, job):
+        """ Ensure the job is done once the worker has run it. """
+        jobs.run_pending()
+        self.authenticate(job.owner)
+        response = self.make_one(match_request(id=job.id)).jobstatus()
+        assert response['status'] == 'done'
+        assert response['finished']
+
+    def test_job_status_owner_only(self, job):
+        """ Ensure other users can't see a job. """
+        other = UserFactory()
+        self.authenticate(other)
+        with pytest.raises(NoPermission):
+            self.make_one(match_request(id=job.id)).jobstatus()
+        other.delete()
+
+    def test_job_status_token_not_in_query(self, job):
+        """ Ensure tokens in the query string aren't accepted. """
+        token, api_token = security.new_token(job.owner, 'release script')
+        self.config.testing_securitypolicy(userid=None)
+        with pytest.raises(NoPermission):
+            self.make_one(match_request(params={'token': token}, id=job.id)).jobstatus()
+        api_token.delete()
+
+    def test_failed_job(self):
+        """ Ensure a failing handler marks the job as failed. """
+        job = jobs.enqueue('sample_job', value=0)
+        jobs.run_pending()
+        job.reload()
+        assert job.status == 'failed'
+        assert job.error == 'no value'
+        job.delete()
@@ -0,0 +1,88 @@
+import pytest
+import smtplib
+
+from packassembler.schema import OutboundMail
+from packassembler.views import email
+from packassembler import mail
+from factories import UserFactory
+
+SETTINGS = {'mail.default_sender': 'Pack Assembler <noreply@example.com>'}
+
+
+class FakeSMTP(object):
+
+    """ Records what would have been sent, refusing recipients in refuse. """
+
+    connections = 0
+    sent = []
+    refuse = ()
+
+    def __init__(self, host, port, timeout=None):
+        FakeSMTP.connections += 1
+
+    def sendmail(self, sender, recipients, message):
+        if any(r in self.refuse for r in recipients):
+            raise smtplib.SMTPRecipientsRefused(dict((r, (550, b'No')) for r in recipients))
+        FakeSMTP.sent.append((sender, recipients, message))
+
+    def quit(self):
+        pass
+
+
+@pytest.fixture
+def user(request):
+    user = UserFactory()
+    FakeSMTP.connections = 0
+    FakeSMTP.sent = []
+
+    def fin():
+        user.delete()
+        OutboundMail.drop_collection()
+
+    request.addfinalizer(fin)
+    return user
+
+
+def test_emails_are_queued(user):
+    email.password_reset(None, user, 'http://example.com/reset')
+    queued = OutboundMail.objects.get()
+    assert queued.status == 'queued'
+    assert queued.subject == 'Reset Your Password'
+    assert FakeSMTP.sent == []
+
+
+def test_outbox_batches_over_one_connection(user):
+    for i in range(3):
+        email.password_reset(None, user, 'http://example.com/reset')
+    mail.Outbox(SETTINGS, smtp_class=FakeSMTP).drain()
+
+    assert FakeSMTP.connections == 1
+    assert len(FakeSMTP.sent) == 3
+    assert OutboundMail.objects(status='sent').count() == 3
+
+
+def test_outbox_gives_up_on_refused_recipients(user):
+    email.password_reset(None, user, 'http://example.com/reset')
+    OutboundMail.objects.update(set__recipients=['refused@example.com'])
+    FakeSMTP.refuse = ('refused@example.com',)
+    try:
+        mail.Outbox(SETTINGS, smtp_class=FakeSMTP).drain()
+    finally:
+        FakeSMTP.refuse = ()
+
+    failed = OutboundMail.objects.get()
+    assert failed.status == 'failed'
+    assert failed.attempts == 1
+
+
+def test_outbox_gives_up_on_invalid_messages(user):
+    OutboundMail(recipients=[user.email], subject='No sender', body='Body').save()
+    OutboundMail(sender='someone@example.com', recipients=[user.email],
+                 subject='Sender', body='Body').save()
+    mail.Outbox({}, smtp_class=FakeSMTP).drain()
+
+    invalid = OutboundMail.objects.get(subject='No sender')
+    assert invalid.status == 'failed'
+    assert invalid.attempts == 1
+    assert OutboundMail.objects.get(subject='Sender').status == 'sent'
+    assert len(FakeSMTP.sent) == 1
@@ -0,0 +1,63 @@
+from packassembler import metrics, instrumentation
+from packassembler.instrumentation import RequestStats
+from pyramid import testing
+import threading
+
+
+def test_threads_are_summed():
+    def work():
+        for i in range(100):
+            metrics.inc('test_total', route='home')
+
+    threads = [threading.Thread(target=work) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    counters, histograms = metrics.totals()
+    assert counters['test_total', (('route', 'home'),)] >= 400
+
+
+def test_render_histogram():
+    metrics.observe('packassembler_request_seconds', 0.02, route='home')
+    metrics.observe('packassembler_request_seconds', 3, route='home')
+    counters, histograms = metrics.totals()
+    key = 'packassembler_request_seconds', (('route', 'home'),)
+    text = metrics.render({}, {key: histograms[key]}, {})
+
+    assert '# TYPE packassembler_request_seconds histogram' in text
+    assert 'packassembler_request_seconds_bucket{route="home",le="0.01"} 0' in text
+    assert 'packassembler_request_seconds_bucket{route="home",le="0.025"} 1' in text
+    assert 'packassembler_request_seconds_bucket{route="home",le="+Inf"} 2' in text
+    assert 'packassembler_request_seconds_count{route="home"} 2' in text
+
+
+def test_request_finished():
+    stats = RequestStats()
+    stats.route = 'viewmod'
+    stats.status = 200
+    stats.queries = 3
+    metrics.request_finished(stats)
+    counters, histograms = metrics.totals()
+    assert counters['packassembler_db_queries_total', (('route', 'viewmod'),)] >= 3
+    assert counters['packassembler_requests_total', (('route', 'viewmod'), ('status', '200'))] >= 1
+
+
+def test_render_time_is_counted(templated_request):
+    key = 'packassembler_render_seconds_total', (('route', 'templated'),)
+    before = metrics.totals()[0][key]
+    instrumentation.observe(templated_request.registry, metrics.request_finished)
+    templated_request()
+    assert metrics.totals()[0][key] >= before + 0.01
+
+
+def test_observers_are_added_once_per_app():
+    config = testing.setUp()
+    try:
+        metrics.includeme(config)
+        metrics.includeme(config)
+        assert config.registry.request_observers == [metrics.request_finished]
+        assert config.registry.request_starters == [metrics.request_started]
+    finally:
+        testing.tearDown()
@@ -1,8 +1,10 @@
 import pytest
 
 from base import BaseTest, match_request, DummyRequest, document_to_data
-from packassembler.schema import Mod
+from packassembler.schema import Mod, PendingNotification, OutboundMail
+from packassembler import notifications
 from factories import ModFactory
+from datetime import timedelta
 from webob.multidict import MultiDict
 
 
@@ -99,6 +101,27 @@ class TestModViews(BaseTest):
         # Make sure it's gone
         assert Mod.objects(id=mod.id).first() is None
 
+    def test_delete_mod_keeps_shared_file(self, mod):
+        """ Ensure deleting a mod leaves its files to other mods' versions. """
+        from packassembler.schema import ModVersion
+        from packassembler import storage
+        from io import BytesIO
+        other = ModFactory()
+        versions = []
+        for owner in (mod, other):
+            mv = ModVersion(mod=owner, version='1.0.0', mc_version='1.6.4')
+            storage.store_mod_file(mv, BytesIO(b'shared jar contents'))
+            versions.append(mv.save())
+
+        self.authenticate(mod.owner)
+        self.make_one(match_request(id=mod.id)).deletemod()
+
+        assert not ModVersion.objects(id=versions[0].id)
+        kept = ModVersion.objects.get(id=versions[1].id)
+        assert kept.mod_file.read() == b'shared jar contents'
+        storage.release_mod_file(kept)
+        other.owner.delete()
+
     # Extra action tests
     def test_flag_mod_view(self, mod):
         """ Ensure the flag mod view changes the outdated boolean. """
@@ -122,6 +145,25 @@ class TestModViews(BaseTest):
         runflag(False)
         assert not mod.outdated
 
+    def test_flag_mod_notifications_are_digested(self, mod):
+        """ Ensure owners get one digest, without mods flagged back. """
+        other = ModFactory(owner=mod.owner)
+        flag = lambda m: self.make_one(match_request(id=m.id)).flagmod()
+
+        flag(mod)
+        flag(other)
+        assert PendingNotification.objects.count() == 2
+        flag(other)
+        assert PendingNotification.objects.count() == 1
+        flag(other)
+
+        notifications.send_digests(timedelta(0))
+        assert PendingNotification.objects.count() == 0
+        digest = OutboundMail.objects.get()
+        assert digest.subject == '2 Outdated Mods'
+        other.delete()
+        digest.delete()
+
     def test_disown_mod_view(self, mod):
         """ Ensure the disown view works. """
         # Get original owner for cleanup
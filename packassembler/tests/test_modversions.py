@@ -1,11 +1,13 @@
 import pytest
 import requests
 
-from base import BaseTest, match_request, document_to_data
-from packassembler.schema import ModVersion
+from base import BaseTest, DummyRequest, match_request, document_to_data
+from packassembler.schema import ModVersion, PendingNotification, Job, JarInfo
+from packassembler import jobs, security, notifications, storage
 from factories import ModVersionFactory, ModFactory
 from webob.multidict import MultiDict
 from unittest import mock
+from io import BytesIO
 
 URL = 'http://bit.ly/1uM5XgB'
 slow_skip = pytest.mark.skipif(False, reason="too slow")
@@ -24,14 +26,18 @@ def mod(request):
 
 @pytest.fixture
 def mv(request, mod, file_content):
-    mv = ModVersionFactory(mod=mod, mod_file=file_content)
+    mv = ModVersionFactory(mod=mod)
+    storage.store_mod_file(mv, BytesIO(file_content))
+    mv.save()
     mod.versions.append(mv)
     mod.save()
 
     def fin():
-        if mv.mod_file:
-            mv.mod_file.delete()
-        mv.delete()
+        # Edits may have replaced the file, deleting the version released it
+        current = ModVersion.objects(id=mv.id).first()
+        if current is not None:
+            current.delete()
+            storage.release_mod_file(current)
 
     request.addfinalizer(fin)
     return mv
@@ -72,6 +78,9 @@ def verify_direct(mv):
 
 def verify_upload(mv):
     assert mv.mod_file
+    assert len(mv.md5) == 32
+    assert len(mv.mod_file_sha1) == 40
+    assert mv.mod_file_size == mv.mod_file.length
     assert mv.mod_file_url is None
     assert mv.mod_file_url_md5 is None
 
@@ -87,6 +96,8 @@ class TestVersionViews(BaseTest):
         request = match_request(id=mod.id, params=MultiDict(mv_build))
         self.authenticate(mod.owner)
         self.make_one(request).addversion()
+        # Run any fetches the view queued
+        jobs.run_pending()
 
         # Get our new version
         new_mv = ModVersion.objects.get()
@@ -103,6 +114,7 @@ class TestVersionViews(BaseTest):
         # Run
         self.authenticate(mv.mod.owner)
         self.make_one(request).editversion()
+        jobs.run_pending()
         # Get the new Mod object
         new_mv = ModVersion.objects.get()
         # Check if information is correct
@@ -119,12 +131,48 @@ class TestVersionViews(BaseTest):
         new_mv = self.add_test_helper(mod, 'direct')
         verify_direct(new_mv)
 
+    def test_add_view_drops_outdated_notification(self, mod):
+        """ Ensure owners aren't told a mod is outdated once it is updated. """
+        mod.outdated = True
+        mod.save()
+        notifications.mod_outdated(mod, 'http://www.example.com/')
+        self.add_test_helper(mod, 'direct')
+        assert not mod.reload().outdated
+        assert PendingNotification.objects(mod=mod).count() == 0
+
     @slow_skip
     def test_add_view_with_file_upload(self, mod, mock_upload):
         """ Ensure the add version page works when using a file upload. """
         new_mv = self.add_test_helper(mod, 'upload', mock_upload)
         verify_upload(new_mv)
 
+    @slow_skip
+    def test_add_view_with_oversized_upload(self, mod, mock_upload):
+        """ Ensure uploads larger than the size limit are rejected. """
+        mv_build = generate_mv_build('upload', mock_upload)
+
+        request = match_request(id=mod.id, params=MultiDict(mv_build))
+        self.authenticate(mod.owner)
+        with mock.patch.object(storage, 'MAX_SIZE', 16):
+            response = self.make_one(request).addversion()
+
+        assert 'File is too large.' in response['f'].upload_type.errors
+        assert ModVersion.objects.first() is None
+
+    def test_add_view_with_existing_version(self, mod):
+        """ Ensure a version number can't be added to a mod twice. """
+        from packassembler.views.modversions import VERSION_EXISTS
+        existing = ModVersionFactory(mod=mod)
+        mv_build = generate_mv_build('direct')
+
+        request = match_request(id=mod.id, params=MultiDict(mv_build))
+        self.authenticate(mod.owner)
+        response = self.make_one(request).addversion()
+
+        assert VERSION_EXISTS in response['f'].version.errors
+        assert ModVersion.objects(mod=mod).count() == 1
+        existing.delete()
+
     @slow_skip
     def test_add_view_with_url_upload(self, mod):
         """ Ensure the add version page works when using a file upload. """
@@ -160,3 +208,249 @@ class TestVersionViews(BaseTest):
         assert not mod.versions
         # Check if the mod file has been deleted
         assert not GridFS(get_db(), collection='modfs').exists(mf_id)
+
+    def test_identical_files_are_stored_once(self, mod):
+        """ Ensure identical files share one blob until it is unused. """
+        from gridfs import GridFS
+        from mongoengine.connection import get_db
+
+        data = b'identical jar contents'
+        # One uploaded file, one fetched in chunks
+        sources = {'1.0.0': BytesIO(data), '1.0.1': [data[:9], data[9:]]}
+        versions = []
+        for version, source in sorted(sources.items()):
+            mv = ModVersion(mod=mod, version=version, mc_version='1.6.4')
+            storage.store_mod_file(mv, source)
+            versions.append(mv.save())
+
+        grid_id = versions[0].mod_file.grid_id
+        assert versions[1].mod_file.grid_id == grid_id
+
+        fs = GridFS(get_db(), collection='modfs')
+        for mv in versions:
+            # The blob is only removed with its last reference
+            assert fs.exists(grid_id)
+            storage.release_mod_file(mv)
+            mv.delete()
+        assert not fs.exists(grid_id)
+
+    def test_delete_version_keeps_shared_file(self, mod):
+        """ Ensure deleting a version leaves the blob to others sharing it. """
+        data = b'shared jar contents'
+        versions = []
+        for version in ('1.0.0', '1.0.1'):
+            mv = ModVersion(mod=mod, version=version, mc_version='1.6.4')
+            storage.store_mod_file(mv, BytesIO(data))
+            versions.append(mv.save())
+
+        self.authenticate(mod.owner)
+        self.make_one(match_request(id=versions[0].id)).deleteversion()
+
+        kept = ModVersion.objects.get(id=versions[1].id)
+        assert kept.mod_file.read() == data
+        storage.release_mod_file(kept)
+        kept.delete()
+
+    def test_store_blob_released_by_racing_writer(self):
+        """ Ensure a blob released by the writer that stored it first is written again. """
+        from pymongo.errors import DuplicateKeyError
+        digest = storage.hash_stream([b'jar'])
+        with mock.patch.object(storage, 'acquire', return_value=None), \
+                mock.patch.object(storage, 'write_grid',
+                                  side_effect=[DuplicateKeyError('E11000'), 'grid id']) as write_grid:
+            assert storage.store_blob(BytesIO(b'jar'), digest) == 'grid id'
+        assert write_grid.call_count == 2
+
+        with mock.patch.object(storage, 'acquire', return_value=None), \
+                mock.patch.object(storage, 'write_grid', side_effect=DuplicateKeyError('E11000')):
+            with pytest.raises(DuplicateKeyError):
+                storage.store_blob(BytesIO(b'jar'), digest)
+
+    def test_jar_metadata_is_read(self, mod):
+        """ Ensure mcmod.info and the packages of a jar are indexed. """
+        from zipfile import ZipFile
+        import json
+
+        data = BytesIO()
+        with ZipFile(data, 'w') as jar:
+            jar.writestr('mcmod.info', json.dumps([
+                {'modid': 'examplemod', 'version': '1.2.3', 'mcversion': '1.6.4'}
+            ]))
+            jar.writestr('example/mod/ExampleMod.class', b'')
+            jar.writestr('example/mod/gui/ExampleGui.class', b'')
+        data.seek(0)
+
+        mv = ModVersion(mod=mod, version='1.2.3', mc_version='1.6.4')
+        storage.store_mod_file(mv, data)
+        mv.save()
+
+        assert mv.jar.mod_ids == ['examplemod']
+        assert mv.jar.versions == ['1.2.3']
+        assert mv.jar.packages == ['example.mod', 'example.mod.gui']
+        assert mv.jar.file_count == 3
+        assert ModVersion.objects(jar__mod_ids='examplemod').first() == mv
+
+        storage.release_mod_file(mv)
+        mv.delete()
+
+    @slow_skip
+    def test_bulk_ingest_with_token(self, mod):
+        token, _ = security.new_token(mod.owner, 'release script')
+        entries = [
+            {'mod': str(mod.id), 'version': '1.0', 'mc': '1.7.10', 'url': URL},
+            {'mod': str(mod.id), 'version': '1.0', 'mc': '1.7.10', 'url': URL},
+            {'mod': 'nothing', 'version': '1.1', 'mc': '1.7.10', 'url': URL}
+        ]
+        request = DummyRequest(json_body=entries, headers={
+            'Authorization': 'Token ' + token})
+        response = self.make_one(request).apiversions()
+        jobs.run_pending()
+
+        assert response.status_code == 202
+        results = response.json_body['versions']
+        assert 'job' in results[0]
+        assert 'error' in results[1]
+        assert 'error' in results[2]
+        verify_upload(ModVersion.objects.get(mod=mod))
+
+    def test_job_status_with_token(self, mod):
+        """ Ensure a job queued with a token can be followed with the same token. """
+        from packassembler.views.jobs import JobViews
+        token, _ = security.new_token(mod.owner, 'release script')
+        headers = {'Authorization': 'Token ' + token}
+        # Only the token authenticates
+        self.config.testing_securitypolicy(userid=None)
+        entries = [{'mod': str(mod.id), 'version': '1.0', 'mc': '1.7.10', 'url': URL}]
+        response = self.make_one(DummyRequest(json_body=entries, headers=headers)).apiversions()
+
+        job_id = response.json_body['versions'][0]['job']
+        assert Job.objects.get(id=job_id).owner == mod.owner
+        status = JobViews(DummyRequest(matchdict={'id': job_id}, headers=headers)).jobstatus()
+        assert status['status'] == 'queued'
+
+    def test_failed_fetch_is_recorded(self, mod):
+        """ Ensure the owner can see why a file could not be fetched. """
+        mv = ModVersion(mod=mod, version='1.0.0', mc_version='1.6.4', mod_file_url=URL).save()
+        jobs.enqueue('fetch_mod_file', owner=mod.owner, version=str(mv.id), url=URL, max_size=4)
+        with mock.patch('packassembler.storage.open_url') as open_url:
+            open_url.return_value.__enter__.return_value = ([b'too large'], None, URL)
+            jobs.run_pending()
+
+        mv.reload()
+        job = Job.objects.get(owner=mod.owner)
+        assert job.status == 'failed'
+        assert mv.fetch_error == job.error
+        assert not mv.mod_file
+        assert mv.mod_file_url == URL
+
+    def test_fetch_for_deleted_version(self, mod):
+        """ Ensure a version deleted during a fetch isn't brought back. """
+        from gridfs import GridFS
+        from mongoengine.connection import get_db
+        import hashlib
+        content = b'deleted during fetch'
+        mv = ModVersion(mod=mod, version='1.0.0', mc_version='1.6.4', mod_file_url=URL).save()
+        jobs.enqueue('fetch_mod_file', owner=mod.owner, version=str(mv.id), url=URL)
+
+        def fetched(url):
+            mv.delete()
+            return mock.MagicMock(**{'__enter__.return_value': ([content], None, URL)})
+        with mock.patch('packassembler.storage.open_url', side_effect=fetched):
+            jobs.run_pending()
+
+        assert Job.objects.get(owner=mod.owner).status == 'failed'
+        assert not ModVersion.objects(id=mv.id)
+        fs = GridFS(get_db(), collection='modfs')
+        assert not fs.exists(sha256=hashlib.sha256(content).hexdigest())
+
+    def test_fetch_for_changed_link(self, mod):
+        """ Ensure a fetch doesn't overwrite a link changed meanwhile. """
+        other = 'http://example.com/other.jar'
+        mv = ModVersion(mod=mod, version='1.0.0', mc_version='1.6.4', mod_file_url=URL).save()
+        jobs.enqueue('fetch_mod_file', owner=mod.owner, version=str(mv.id), url=URL)
+
+        def fetched(url):
+            ModVersion.objects(id=mv.id).update_one(set__mod_file_url=other)
+            return mock.MagicMock(**{'__enter__.return_value': ([b'stale jar'], None, URL)})
+        with mock.patch('packassembler.storage.open_url', side_effect=fetched):
+            jobs.run_pending()
+
+        mv.reload()
+        assert Job.objects.get(owner=mod.owner).status == 'failed'
+        assert mv.mod_file_url == other
+        assert not mv.mod_file
+        mv.delete()
+
+    def test_direct_link_is_hashed_by_worker(self, mod):
+        """ Ensure direct links are hashed in the background, not in the view. """
+        import hashlib
+        mv_build = generate_mv_build('direct')
+        self.authenticate(mod.owner)
+        with mock.patch('packassembler.storage.open_url') as open_url:
+            open_url.return_value.__enter__.return_value = ([b'jar'], None, URL)
+            self.make_one(match_request(id=mod.id, params=MultiDict(mv_build))).addversion()
+            assert not open_url.called
+            assert ModVersion.objects.get().mod_file_url_md5 is None
+            jobs.run_pending()
+
+        assert ModVersion.objects.get().mod_file_url_md5 == hashlib.md5(b'jar').hexdigest()
+
+    def test_failed_save_keeps_file(self, mv):
+        """ Ensure a version's file is only released once the version is saved. """
+        from gridfs import GridFS
+        from mongoengine.connection import get_db
+        fs = GridFS(get_db(), collection='modfs')
+        grid_id = mv.mod_file.grid_id
+
+        with pytest.raises(ValueError):
+            with storage.ModFileChange(mv) as change:
+                change.store(BytesIO(b'replacement'))
+                stored = mv.mod_file.grid_id
+                raise ValueError('save failed')
+
+        assert fs.exists(grid_id)
+        assert not fs.exists(stored)
+        assert ModVersion.objects.get(id=mv.id).mod_file.grid_id == grid_id
+
+    def test_failed_edit_keeps_version_number(self, mv):
+        """ Ensure a claimed version number is given back when an edit fails. """
+        data = generate_mv_build('direct', base=mv)
+        data['version'] = '9.3.0'
+        request = match_request(id=mv.id, params=MultiDict(data))
+        self.authenticate(mv.mod.owner)
+        with mock.patch('packassembler.views.modversions.populate', side_effect=RuntimeError):
+            with pytest.raises(RuntimeError):
+                self.make_one(request).editversion()
+
+        assert ModVersion.objects.get(id=mv.id).version == mv.version
+
+    def test_version_details_lists_related_mods(self, mod):
+        """ Ensure mods declaring the same mod ids or packages are listed. """
+        other = ModFactory()
+        mv = ModVersion(mod=mod, version='1.0.0', mc_version='1.6.4',
+                        jar=JarInfo(mod_ids=['examplemod'], packages=['example.mod'])).save()
+        ModVersion(mod=other, version='2.0.0', mc_version='1.6.4',
+                   jar=JarInfo(mod_ids=['examplemod'], packages=['other.mod'])).save()
+
+        response = self.make_one(match_request(id=mv.id)).versiondetails()
+        assert response['providers'] == [other]
+        assert response['conflicts'] == []
+        other.owner.delete()
+        other.delete()
+
+    def test_read_jar_ignores_corrupt_mcmod_info(self):
+        """ Ensure broken mcmod.info files don't keep a jar from being indexed. """
+        from packassembler.jars import read_jar
+        from zipfile import ZipFile
+        for content in (b'{not json', b'[{"modid": "examplemod"}]'):
+            data = BytesIO()
+            with ZipFile(data, 'w') as jar:
+                jar.writestr('mcmod.info', content)
+                jar.writestr('example/ExampleMod.class', b'')
+            # Changes the second without updating its checksum
+            raw = data.getvalue().replace(b'"modid"', b'"MODID"')
+
+            jar = read_jar(BytesIO(raw), len(raw))
+            assert jar.mod_ids == []
+            assert jar.packages == ['example']
+        assert read_jar(BytesIO(b'not a jar'), 9) is None
@@ -0,0 +1,58 @@
+import pytest
+
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from packassembler import outbound
+from unittest import mock
+from io import BytesIO
+
+
+class FakeAdapter(BaseAdapter):
+
+    """ Answers every request with a short body. """
+
+    def send(self, request, **kwargs):
+        response = Response()
+        response.status_code = 200
+        response.url = request.url
+        response.raw = BytesIO(b'data')
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def client():
+    client = outbound.Client(max_concurrency=1)
+    client.session.mount('http://', FakeAdapter())
+    return client
+
+
+def test_stats_by_host(client):
+    client.request('GET', 'http://example.com/a')
+    client.request('GET', 'http://example.com/b')
+    stats = client.stats()['example.com']
+    assert stats['requests'] == 2
+    assert stats['failures'] == 0
+
+
+@mock.patch.object(outbound, 'ACQUIRE_TIMEOUT', 0)
+def test_streams_hold_their_slot(client):
+    with client.request('GET', 'http://example.com/a', stream=True) as response:
+        with pytest.raises(outbound.Busy):
+            client.request('GET', 'http://example.com/b')
+        assert b''.join(response.iter_content(2)) == b'data'
+    # Closed, so the slot is free again
+    client.request('GET', 'http://example.com/b')
+    assert client.stats()['example.com']['failures'] == 0
+
+
+@mock.patch.object(outbound, 'ACQUIRE_TIMEOUT', 0)
+def test_unread_streams_free_their_slot(client):
+    with pytest.raises(ValueError):
+        with client.request('GET', 'http://example.com/a', stream=True):
+            raise ValueError
+    client.request('GET', 'http://example.com/b')
+    # Not read to the end
+    assert client.stats()['example.com']['failures'] == 1
@@ -0,0 +1,144 @@
+import pytest
+
+from base import BaseTest, DummyRequest, match_request
+from factories import PackBuildFactory, ModFactory, UserFactory
+from pyramid.authorization import ACLAuthorizationPolicy
+from packassembler.schema import ModVersion
+from packassembler import storage, security
+from contextlib import contextmanager
+from unittest import mock
+from zipfile import ZipFile
+from io import BytesIO
+import os
+
+JAR = b'not really a jar'
+# Build, pack, mod versions and mods
+BUILD_QUERIES = 4
+
+
+@pytest.fixture
+def build(request):
+    mod = ModFactory()
+    mv = ModVersion(mod=mod, version='1.0.0', mc_version='1.6.4')
+    storage.store_mod_file(mv, BytesIO(JAR))
+    mv.save()
+    build = PackBuildFactory(mod_versions=[mv])
+
+    def fin():
+        build.pack.owner.delete()
+        build.pack.delete()
+        storage.release_mod_file(mv)
+        mod.owner.delete()
+        mod.delete()
+
+    request.addfinalizer(fin)
+    return build
+
+
+@pytest.fixture
+def make_build(request):
+    """ Makes builds of the given number of mods, returning requests for them. """
+    builds, mods = [], []
+
+    def make(size):
+        versions = []
+        for i in range(size):
+            mods.append(ModFactory())
+            url = 'http://www.example.com/{0}.jar'.format(mods[-1].rid)
+            versions.append(ModVersion(mod=mods[-1], version='1.0.0', mc_version='1.6.4',
+                                       mod_file_url=url, mod_file_url_md5='0' * 32).save())
+        builds.append(PackBuildFactory(mod_versions=versions))
+        return match_request(id=builds[-1].id)
+
+    def fin():
+        for build in builds:
+            build.pack.owner.delete()
+            build.pack.delete()
+        for mod in mods:
+            mod.owner.delete()
+            mod.delete()
+
+    request.addfinalizer(fin)
+    return make
+
+
+class TestPackBuildViews(BaseTest):
+    def _get_test_class(self):
+        from packassembler.views.packbuilds import PackBuildViews
+        return PackBuildViews
+
+    def test_download_bundle(self, build):
+        """ Ensure the bundle contains every jar in the build. """
+        response = self.make_one(match_request(id=build.id)).downloadbundle()
+        bundle = ZipFile(BytesIO(b''.join(response.app_iter)))
+
+        mv = build.mod_versions[0]
+        name = '{0}-{1}.jar'.format(mv.mod.rid, mv.version)
+        assert bundle.namelist() == [name]
+        assert bundle.read(name) == JAR
+
+    def test_bundle_cache_is_bounded(self, build, tmpdir):
+        """ Ensure finished bundles evict the least recently used ones. """
+        from packassembler.bundle import Bundler, build_key
+        from packassembler.views.packbuilds import build_versions
+        bundler = Bundler({'bundle.cache_dir': str(tmpdir), 'bundle.build_cache_size': '1024'})
+        old = os.path.join(bundler.builds_dir, 'old.zip')
+        with open(old, 'wb') as f:
+            f.write(b'0' * 1024)
+        os.utime(old, (0, 0))
+
+        key = build_key(build)
+        b''.join(bundler.stream(build_versions(build), key))
+        assert bundler.cached(key)
+        assert not os.path.exists(old)
+
+    def test_bundle_url_size_is_capped(self, tmpdir):
+        """ Ensure external files past storage.max_size aren't bundled. """
+        from packassembler.bundle import UrlCache, url_chunks
+        url = 'http://example.com/a.jar'
+
+        @contextmanager
+        def open_url(url):
+            yield iter([b'0' * 1024] * 2), None, url
+
+        with mock.patch('packassembler.bundle.open_url', open_url):
+            with pytest.raises(storage.FileTooLarge):
+                b''.join(url_chunks(url, None, 1024))
+            with pytest.raises(storage.FileTooLarge):
+                b''.join(url_chunks(url, UrlCache(str(tmpdir), limit=1024)))
+        assert not os.listdir(str(tmpdir))
+
+    def test_download_build_queries(self, make_build):
+        """ Ensure builds are sent with the same few queries whatever their size. """
+        result = self.assert_queries(BUILD_QUERIES, make_build(5), 'downloadbuild')
+        assert len(result['mods']) == 5
+        self.assert_constant_queries(make_build, 'downloadbuild', 1, 20)
+
+    def test_mcu_xml_queries(self, make_build):
+        """ Ensure MCUpdater XML is made with the same few queries whatever the build size. """
+        self.assert_queries(BUILD_QUERIES, make_build(5), 'mcuxml')
+        self.assert_constant_queries(make_build, 'mcuxml', 1, 20)
+
+
+class TestClaims(BaseTest):
+    def _get_test_class(self):
+        from packassembler.views.packbuilds import PackBuildViews
+        return PackBuildViews
+
+    def test_claims_need_no_user_query(self, make_build):
+        """ Ensure views that don't use the user don't load it when claims authorize. """
+        policy = security.ClaimsAuthenticationPolicy('authtktpolicysek', hashalg='sha512')
+        self.config.set_authorization_policy(ACLAuthorizationPolicy())
+        self.config.set_authentication_policy(policy)
+        user = UserFactory()
+        anonymous = make_build(3)
+        headers = policy.remember(anonymous, user.username, tokens=security.claim_tokens(user))
+        ticket = headers[0][1].split(';')[0].split('=', 1)[1].strip('"')
+        logged_in = DummyRequest(matchdict=anonymous.matchdict, cookies={'auth_tkt': ticket})
+        # Revocations are only read every so often
+        security.revocations.refresh()
+
+        queries = self.call_view(logged_in, 'downloadbuild')[1]
+        assert logged_in.authenticated_userid == user.username
+        assert queries == self.call_view(anonymous, 'downloadbuild')[1]
+        user.delete()
@@ -2,7 +2,7 @@ import pytest
 
 from base import BaseTest, match_request, DummyRequest, document_to_data
 from packassembler.schema import Pack
-from factories import PackFactory
+from factories import PackFactory, ModFactory
 from webob.multidict import MultiDict
 
 
@@ -101,3 +101,19 @@ class TestPackViews(BaseTest):
         # Run again, should fail
         runner.clonepack()
         assert 'already' in request.session['error_flash'][0].lower()
+
+    def test_add_pack_mod_view(self, pack):
+        """ Ensure only existing mods are added to the pack. """
+        mod = ModFactory(owner=pack.owner)
+        # Generate request, with an invalid and an unknown id
+        mods = [str(mod.id), 'notanid', '0' * 24]
+        request = match_request(id=pack.id, params=MultiDict(('mods', m) for m in mods))
+        # Run
+        self.authenticate(pack.owner)
+        self.make_one(request).addpackmod()
+        # Check the mods
+        pack.reload()
+        assert pack.mods == [mod]
+        # Clean up
+        pack.update(set__mods=[])
+        mod.delete()
@@ -0,0 +1,34 @@
+from packassembler import profiling
+import cProfile
+
+
+def work():
+    return sum(range(1000))
+
+
+def test_summarize_top_functions():
+    profiles = []
+    for i in range(2):
+        profile = cProfile.Profile()
+        profile.runcall(work)
+        profiles.append({'route': 'viewpack', 'seconds': 0.1 * (i + 1),
+                         'functions': profiling.top_functions(profile)})
+
+    summary = profiling.summarize(profiles)['viewpack']
+    assert summary['requests'] == 2
+    assert abs(summary['seconds'] - 0.15) < 1e-9
+    names = [f['function'] for f in summary['functions']]
+    assert any(name.endswith('(work)') for name in names)
+    # Per request
+    work_stats = [f for f in summary['functions'] if f['function'].endswith('(work)')][0]
+    assert work_stats['calls'] == 1
+
+
+def test_sampling():
+    profiler = profiling.Profiler()
+    profiler.configure(True, 1.0, ['viewpack'])
+    assert profiler.enabled
+    assert profiler.wants('viewpack')
+    assert not profiler.wants('home')
+    profiler.configure(True, 0.0)
+    assert not profiler.enabled
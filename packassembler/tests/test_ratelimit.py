@@ -0,0 +1,109 @@
+import pytest
+
+from pymongo.errors import DuplicateKeyError
+from pyramid.response import Response
+from pyramid.request import Request
+from pyramid import testing
+from packassembler import ratelimit
+from unittest import mock
+
+
+def test_parse_limits():
+    limits = ratelimit.parse_limits('\n    login 10/60\n    signup 5/3600\n')
+    assert limits['login'] == (10 / 60.0, 10)
+    assert limits['signup'] == (5 / 3600.0, 5)
+
+
+def test_memory_store_bucket():
+    store = ratelimit.MemoryStore()
+    for _ in range(3):
+        assert store.take('login:ip:1.2.3.4', 1 / 60.0, 3)[0]
+    allowed, retry_after = store.take('login:ip:1.2.3.4', 1 / 60.0, 3)
+    assert not allowed
+    assert 0 < retry_after <= 60
+    # Other keys have their own bucket
+    assert store.take('login:ip:5.6.7.8', 1 / 60.0, 3)[0]
+
+
+def test_memory_store_forgets_old_keys():
+    store = ratelimit.MemoryStore(max_keys=2)
+    for key in ('a', 'b', 'c'):
+        store.take(key, 1, 1)
+    assert list(store.buckets) == ['b', 'c']
+
+
+def test_mongo_store_retries_concurrent_creation():
+    collection = mock.Mock()
+    collection.find_one_and_update.side_effect = [
+        DuplicateKeyError('E11000'), {'allowed': True, 'tokens': 2}]
+    with mock.patch.object(ratelimit.MongoStore, 'collection', collection):
+        assert ratelimit.MongoStore().take('login:ip:1.2.3.4', 1, 3) == (True, 0)
+    assert collection.find_one_and_update.call_count == 2
+
+
+def test_memory_store_check_takes_nothing():
+    store = ratelimit.MemoryStore()
+    for _ in range(3):
+        assert store.take('login:account:victim', 1 / 60.0, 1, cost=0)[0]
+    assert store.take('login:account:victim', 1 / 60.0, 1)[0]
+    assert not store.take('login:account:victim', 1 / 60.0, 1, cost=0)[0]
+
+
+def check_login(request):
+    if request.POST.get('password') != 'secret':
+        ratelimit.failed_attempt(request)
+    return Response('ok')
+
+
+@pytest.fixture
+def tween(request):
+    config = testing.setUp(settings={'ratelimit.routes': 'login 2/60'})
+    config.add_route('login', '/login')
+    config.commit()
+    request.addfinalizer(testing.tearDown)
+    tween = ratelimit.ratelimit_tween_factory(check_login, config.registry)
+    tween.registry = config.registry
+    return tween
+
+
+def login(tween, addr, method='POST', password='wrong', headers=None):
+    post = {'username': 'Victim', 'password': password}
+    request = Request.blank('/login', POST=post if method == 'POST' else None,
+                            remote_addr=addr, headers=headers)
+    request.method = method
+    request.registry = tween.registry
+    return tween(request)
+
+
+def test_tween_limits_posts_by_address(tween):
+    for _ in range(2):
+        assert login(tween, '1.2.3.4', password='secret').status_code == 200
+    response = login(tween, '1.2.3.4', password='secret')
+    assert response.status_code == 429
+    assert 0 < int(response.headers['Retry-After']) <= 60
+    # Only posts count, views of limited routes ignore anything else
+    assert login(tween, '1.2.3.4', 'GET').status_code == 200
+
+
+def test_tween_limits_failed_attempts_per_account(tween):
+    for addr in ('1.2.3.4', '5.6.7.8'):
+        assert login(tween, addr).status_code == 200
+    # The same username from yet another address
+    assert login(tween, '9.9.9.9', password='secret').status_code == 429
+    # Other accounts are still open from there
+    request = Request.blank('/login', POST={'username': 'other', 'password': 'secret'},
+                            remote_addr='9.9.9.9')
+    request.registry = tween.registry
+    assert tween(request).status_code == 200
+
+
+def test_tween_successful_attempts_dont_count_per_account(tween):
+    for addr in ('1.2.3.4', '5.6.7.8', '9.9.9.9'):
+        assert login(tween, addr, password='secret').status_code == 200
+
+
+def test_tween_limits_failed_attempts_per_token(tween):
+    headers = {'Authorization': 'Token wrong'}
+    for addr in ('1.2.3.4', '5.6.7.8'):
+        login(tween, addr, headers=headers)
+    assert login(tween, '9.9.9.9', headers=headers).status_code == 429
@@ -1,8 +1,10 @@
 import pytest
 
-from base import BaseTest, match_request
-from packassembler.schema import User
+from base import BaseTest, DummyRequest, match_request
+from packassembler.schema import User, Revocation
+from packassembler import security
 from factories import UserFactory
+from unittest import mock
 
 
 @pytest.fixture
@@ -29,7 +31,47 @@ class TestUserViews(BaseTest):
         self.user_request(user.id).deleteuser()
         assert len(User.objects) == 0
 
+    def test_edit_group_revokes_claims(self, user):
+        self.authenticate(user)
+        request = match_request(id=user.id, params={'group': 'contributor'})
+        self.make_one(request).edituser()
+        user.reload()
+        assert user.group == 'contributor'
+        assert user.auth_version == 1
+        assert Revocation.objects(username=user.username).first().version == 1
+        assert not security.revocations.is_current(user.username, 0)
+        assert security.revocations.is_current(user.username, 1)
+
+    def test_clean_users_revokes_claims(self, user):
+        """ Ensure tickets of users removed for inactivity are stale. """
+        from packassembler.views.admin import clean_users
+        clean_users()
+        assert User.objects(id=user.id).first() is None
+        assert Revocation.objects(username=user.username).first().version == -1
+        assert not security.revocations.is_current(user.username, 0)
+
     def test_profile(self, user):
         response = self.user_request(user.id).profile()
         assert response['title'] == user.username
         assert response['owner'] == user
+
+    def test_login_ignores_query_credentials(self):
+        """ Ensure only posted credentials are checked, posts are rate limited. """
+        self.config.testing_securitypolicy(userid=None)
+        params = {'username': 'someone', 'password': 'secret', 'submit': ''}
+        request = DummyRequest(params=params)
+        request.matched_route = mock.Mock()
+        request.matched_route.name = 'login'
+        with mock.patch('packassembler.views.user.check_pass') as check_pass:
+            response = self.make_one(request).login()
+        assert not check_pass.called
+        assert response['error'] == ''
+
+    def test_check_pass_rehashes(self, user):
+        """ Ensure hashes with fewer rounds are upgraded on login. """
+        user.password = security.Hasher(rounds=4).hash('secret')
+        user.save()
+        assert security.check_pass(user.username, 'secret')
+        user.reload()
+        assert security.hash_rounds(user.password) == security.hasher.rounds
+        assert security.check_pass(user.username, 'secret')
@@ -1,10 +1,21 @@
-from pyramid.httpexceptions import HTTPForbidden, HTTPNotFound
+from pyramid.httpexceptions import HTTPForbidden, HTTPNotFound, HTTPServiceUnavailable
 from packassembler.views.common import NoPermission
+from pyramid.interfaces import IRoutesMapper
+from .cache import ResponseCache, MAX_ENTRIES, TTL, page_tags
+from . import invalidation
+from pyramid.settings import aslist
+from pyramid.response import Response
+from .security import Overloaded
 from .schema import DoesNotExist
 
 
+# Request headers cached pages depend on
+VARY = ('Accept', 'X-Requested-With')
+
+
 def includeme(config):
     config.add_tween('packassembler.tweens.exception_tween_factory')
+    config.add_tween('packassembler.tweens.cache_tween_factory')
 
 
 def exception_tween_factory(handler, registry):
@@ -15,4 +26,64 @@ def exception_tween_factory(handler, registry):
             return HTTPNotFound()
         except NoPermission:
             return HTTPForbidden()
+        except Overloaded:
+            return HTTPServiceUnavailable(headers={'Retry-After': '1'})
     return exception_tween
+
+
+def cache_tween_factory(handler, registry):
+    """
+    Serves pages of the routes in cache.routes to anonymous visitors from
+    a ResponseCache, with ETags. Pages are dropped when what they show
+    changes, see invalidation.
+    """
+    settings = registry.settings
+    routes = set(aslist(settings.get('cache.routes', '')))
+    if not routes:
+        return handler
+    cache = getattr(registry, 'response_cache', None)
+    if cache is None:
+        cache = registry.response_cache = ResponseCache(
+            int(settings.get('cache.max_entries', MAX_ENTRIES)),
+            int(settings.get('cache.ttl', TTL)))
+        # Goes with the app, which other apps in this process outlive
+        invalidation.subscribe(cache.invalidate, weak=True)
+
+    def cache_tween(request):
+        if request.method != 'GET':
+            return handler(request)
+
+        info = registry.getUtility(IRoutesMapper)(request)
+        route = info['route']
+        name = route.name if route is not None else None
+        if name not in routes or not cacheable(request):
+            return handler(request)
+
+        # Views differ by Accept and X-Requested-With, as views.packs.viewpack
+        key = (name, request.path, tuple(sorted(request.GET.items())),
+               request.is_xhr, request.headers.get('Accept', ''))
+        entry = cache.get(key)
+        if entry is not None:
+            response = Response(status=entry.status, headerlist=list(entry.headerlist),
+                                app_iter=[entry.body], conditional_response=True)
+            response.headers['X-Cache'] = 'hit'
+            return response
+
+        generation = cache.generation
+        response = handler(request)
+        if response.status_int == 200:
+            response.md5_etag()
+            response.vary = tuple(response.vary or ()) + VARY
+            response.conditional_response = True
+            cache.set(key, response, page_tags(name, info['match']), generation)
+        return response
+    return cache_tween
+
+
+def cacheable(request):
+    """ Whether the page a request gets is the same for every visitor. """
+    if request.unauthenticated_userid is not None:
+        return False
+    # Flash messages are shown once, to one visitor
+    session = request.session
+    return not (session.peek_flash() or session.peek_flash('errors'))
@@ -1,5 +1,10 @@
 from .common import ViewBase
+from pyramid.response import Response
 from pyramid.view import view_config
+from ..profiling import profiler, set_profiler, summarize
+from ..security import revoke
+from ..form import ProfilerForm
+from .. import metrics
 from datetime import datetime, timedelta
 from ..schema import *
 
@@ -7,17 +12,38 @@ from ..schema import *
 class AdminViews(ViewBase):
     @view_config(route_name='maintenance', renderer='admin/maintenance.mak', permission='admin', request_method='GET')
     def maintenance(self):
-        return self.return_dict(title='Maintenance')
+        return self.return_dict(title='Maintenance', pf=self.profiler_form(), **self.stats())
 
     @view_config(route_name='maintenance', renderer='admin/maintenance.mak', permission='admin', request_method='POST')
     def maintenance_post(self):
-        if 'remove_old_users' in self.request.params:
+        pf = self.profiler_form()
+        if 'profiler_submit' in self.request.params:
+            pf = ProfilerForm(self.request.POST)
+            if pf.validate():
+                set_profiler(pf.enabled.data, pf.rate.data / 100, pf.routes.data.split())
+                self.request.flash('Profiler settings saved.')
+        elif 'remove_old_users' in self.request.params:
             clean_users()
             self.request.flash('Old users removed.')
         elif 'remove_old_versions' in self.request.params:
             clean_versions()
             self.request.flash('Old versions removed.')
-        return self.return_dict(title='Maintenance')
+        return self.return_dict(title='Maintenance', pf=pf, **self.stats())
+
+    @view_config(route_name='metrics', permission='admin')
+    def metrics(self):
+        return Response(metrics.collect(self.request.registry),
+                        content_type='text/plain; version=0.0.4', charset='utf-8',
+                        headers={'Cache-Control': 'no-store'})
+
+    def profiler_form(self):
+        profiler.refresh()
+        return ProfilerForm(enabled=profiler.enabled, rate=profiler.rate * 100,
+                            routes=' '.join(sorted(profiler.routes)))
+
+    def stats(self):
+        return {'cache': getattr(self.request.registry, 'response_cache', None),
+                'profiles': summarize(profiler.recent())}
 
 
 def clean_users():
@@ -28,6 +54,8 @@ def clean_users():
         # If the user is in the user group and has no mods, along with
         # not having logged in recently, delete 'em
         if not Mod.objects(owner=user) and user.group == 'user' and ltime:
+            # Tickets don't know the user is gone
+            revoke(user, deleted=True)
             user.delete()
 
 
@@ -1,8 +1,10 @@
 from pyramid.security import authenticated_userid, has_permission
 from pyramid.httpexceptions import HTTPFound
 from urllib.parse import urlencode
+from ..storage import open_url, hash_stream
 from ..security import Root
-from hashlib import md5
+from .. import outbound
+from bson import ObjectId
 from ..schema import *
 import requests
 import math
@@ -16,6 +18,7 @@ CAPTCHA_ERRORS = {
     'captcha-timeout': 'The solution was received after the CAPTCHA timed out.'
 }
 CAPTCHA_MESSAGE = 'Something went wrong when verifying the Captcha. '
+CAPTCHA_UNREACHABLE = 'The Captcha service could not be reached.'
 VERROR = 'Your Data is not Valid. Enable Javascript for More Information.'
 
 
@@ -24,8 +27,12 @@ class ViewBase(object):
     def __init__(self, request):
         self.request = request
         self.logged_in = request.authenticated_userid
-        connect('', host=request.registry.settings.get('mongodb', 'packassembler'))
-        self.current_user = User.objects(username=self.logged_in).first()
+
+    @property
+    def current_user(self):
+        # Loaded only by views that use it, with auth.claims the others
+        # don't query the user at all
+        return self.request.user if self.logged_in else None
 
     def return_dict(self, **kwargs):
         rdict = kwargs
@@ -38,16 +45,16 @@ class ViewBase(object):
     def has_perm(self, data):
         dtype = data.__class__.__name__
         if dtype == 'User':
-            user = data
+            owner = data.id
         elif dtype == 'ModVersion':
-            user = data.mod.owner
+            owner = ref_id(data.mod, 'owner')
         elif dtype == 'PackBuild':
-            user = data.pack.owner
+            owner = ref_id(data.pack, 'owner')
         else:
-            user = data.owner
+            owner = ref_id(data, 'owner')
 
-        return (user is not None and
-                self.logged_in == user.username or
+        return (owner is not None and self.current_user is not None and
+                owner == self.current_user.id or
                 self.specperm('moderator'))
 
     def specperm(self, permission):
@@ -78,6 +85,12 @@ class ViewBase(object):
             return Pack.objects(owner=self.current_user).only('id', 'name')
 
 
+def ref_id(doc, field):
+    """ Returns the id of a referenced document without dereferencing it. """
+    value = doc._data.get(field)
+    return getattr(value, 'id', value)
+
+
 def opt_dict(**kwargs):
     d = {}
     for name, value in kwargs.items():
@@ -88,6 +101,28 @@ def opt_dict(**kwargs):
     return d
 
 
+def get_objects(collection, ids, *fields):
+    """
+    Returns the documents with the given ids, in the same order, using a single
+    query. Invalid and unknown ids are skipped.
+    """
+    valid = [i for i in ids if ObjectId.is_valid(i)]
+    if not valid:
+        return []
+
+    docs = collection.objects(id__in=valid)
+    if fields:
+        docs = docs.only(*fields)
+    by_id = dict((str(doc.id), doc) for doc in docs)
+
+    found = []
+    for i in valid:
+        doc = by_id.pop(str(i), None)
+        if doc is not None:
+            found.append(doc)
+    return found
+
+
 class NoPermission(Exception):
     pass
 
@@ -99,7 +134,10 @@ def validate_captcha(request):
         'challenge': request.params.get('recaptcha_challenge_field', ''),
         'response': request.params.get('recaptcha_response_field', '')
     }
-    t = requests.post(CAPTCHA_URL, payload).text.split('\n')
+    try:
+        t = outbound.post(CAPTCHA_URL, payload).text.split('\n')
+    except requests.RequestException:
+        return False, CAPTCHA_MESSAGE + CAPTCHA_UNREACHABLE
     try:
         return t[0][0] == 't', CAPTCHA_MESSAGE + CAPTCHA_ERRORS[t[1]]
     except KeyError:
@@ -108,11 +146,9 @@ def validate_captcha(request):
 
 def url_md5(url):
     """ Returns MD5 of file at url. """
-    hasher = md5()
-    req = requests.get(url)
-    hasher.update(req.content)
-    # Also return the end url, in case of redirect
-    return hasher.hexdigest(), req.url
+    with open_url(url) as (chunks, length, end_url):
+        # Also return the end url, in case of redirect
+        return hash_stream(chunks).md5, end_url
 
 
 def slugify(text):
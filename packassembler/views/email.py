@@ -1,17 +1,17 @@
 # SMTP
-from pyramid_mailer import get_mailer
 from pyramid_mailer.message import Message
+from html import escape
+from .. import mail
 
 
 def smtpify(f):
 
     def smtpified(request, user, *args, **kwargs):
-        sender = get_mailer(request)
-
         to = "{0} <{1}>".format(user.username, user.email)
         message = f(Message(recipients=[to]), *args, **kwargs)
 
-        sender.send_immediately(message)
+        # Sent by the worker, see mail.Outbox
+        mail.enqueue(message)
 
     return smtpified
 
@@ -57,25 +57,31 @@ message.
 
 
 @smtpify
-def mod_outdated(message, mod_name, mod_url):
-    message.subject = "Outdated Mod - " + mod_name
+def mods_outdated(message, mods):
+    """ Digest of mods marked as outdated, mods are (name, url) pairs. """
+    if len(mods) == 1:
+        message.subject = "Outdated Mod - " + mods[0][0]
+    else:
+        message.subject = "{0} Outdated Mods".format(len(mods))
     message.html = """
-A mod you maintain, {0} has been marked as outdated. To update it, click on the
-link below:<br/>
-<a href="{1}">{1}</a>
-""".format(mod_name, mod_url)
+Mods you maintain have been marked as outdated. To update them, click on the
+links below:<br/>
+<ul>
+{0}
+</ul>
+""".format('\n'.join('<li>{0}: <a href="{1}">{1}</a></li>'.format(escape(name), url) for name, url in mods))
     message.body = """
-A mod you maintain, {0} has been marked as outdated. To update it, copy and
-paste the link below:
-{1}
-""".format(mod_name, mod_url)
+Mods you maintain have been marked as outdated. To update them, copy and paste
+the links below:
+{0}
+""".format('\n'.join('{0}: {1}'.format(name, url) for name, url in mods))
     return message
 
 
 @smtpify
 def user_email(message, sender, message_body):
     message.subject = sender.username + ' on Pack Assembler has sent you a message'
-    message.headers = {'Reply-To', sender.email}
+    message.extra_headers = {'Reply-To': sender.email}
     message.body = """
 You have been sent a message by {0} on Pack Assembler:
 {1}
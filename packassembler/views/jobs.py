@@ -0,0 +1,28 @@
+from pyramid.view import view_config
+from .common import ViewBase, NoPermission, ref_id
+from ..security import token_user
+from ..schema import Job
+
+
+class JobViews(ViewBase):
+
+    @view_config(route_name='jobstatus', renderer='json')
+    def jobstatus(self):
+        job = self.get_db_object(Job, perm=False)
+        if not self.has_perm(job):
+            # API clients follow the jobs they queued with their token
+            user = token_user(self.request)
+            if user is None or ref_id(job, 'owner') != user.id:
+                raise NoPermission
+        return job_dict(job)
+
+
+def job_dict(job):
+    return {
+        'id': str(job.id),
+        'kind': job.kind,
+        'status': job.status,
+        'error': job.error,
+        'created': job.created.isoformat() if job.created else None,
+        'finished': job.finished.isoformat() if job.finished else None
+    }
@@ -1,7 +1,7 @@
 from pyramid.httpexceptions import HTTPFound
-import packassembler.views.email as email
 from ..form import ModForm, BannerForm
 from pyramid.view import view_config
+from .. import storage, notifications
 from ..schema import *
 from .common import *
 
@@ -68,8 +68,7 @@ class ModViews(ViewBase):
         mod.outdated = not mod.outdated
         mod.save()
 
-        if mod.outdated:
-            self.send_out_of_date_notification(mod)
+        self.notify_outdated(mod)
 
         return HTTPFound(location=self.request.route_url('viewmod', id=mod.id))
 
@@ -81,8 +80,7 @@ class ModViews(ViewBase):
         mod.outdated = js_out['outdated']
         mod.save()
 
-        if mod.outdated:
-            self.send_out_of_date_notification(mod)
+        self.notify_outdated(mod)
 
         return js_out
 
@@ -208,9 +206,8 @@ class ModViews(ViewBase):
         no_version_deps = all([self.check_depends(i) for i in mod.versions])
 
         if self.check_depends(mod) and no_version_deps:
-            for version in mod.versions:
-                version.mod_file.delete()
-            mod.delete()
+            with storage.detached_mod_files(ModVersion.objects(mod=mod)):
+                mod.delete()
             self.request.flash(mod.name + ' deleted successfully.')
             return HTTPFound(self.request.route_url('modlist'))
         else:
@@ -230,6 +227,10 @@ class ModViews(ViewBase):
                                 with_mod=Pack.objects(mods=mod)
                                 )
 
-    def send_out_of_date_notification(self, mod):
-        url = self.request.route_url('viewmod', id=mod.id)
-        email.mod_outdated(self.request, mod.owner, mod.name, url)
+    def notify_outdated(self, mod):
+        # Owners get a digest of their outdated mods, see notifications
+        if mod.outdated:
+            url = self.request.route_url('viewmod', id=mod.id)
+            notifications.mod_outdated(mod, url)
+        else:
+            notifications.mod_updated(mod)
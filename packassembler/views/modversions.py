@@ -2,10 +2,16 @@ from ..form import ModVersionForm, EditModVersionForm, QuickModVersionForm
 from pyramid.response import Response, FileIter
 from pyramid.httpexceptions import HTTPFound
 from pyramid.view import view_config
-from ..security import check_pass
+from ..security import check_pass, token_user
+from ..ratelimit import failed_attempt
+from webob.multidict import MultiDict
+from .. import storage, jobs, jars, invalidation, metrics, notifications
 from ..schema import *
 from .common import *
-import requests
+
+VERSION_EXISTS = 'That version already exists.'
+# Most versions accepted by one bulk ingest request
+BULK_LIMIT = 100
 
 
 class VersionViews(ViewBase):
@@ -17,19 +23,35 @@ class VersionViews(ViewBase):
         post = self.request.params
         form = ModVersionForm(post)
 
-        if 'submit' in post and form.validate() and not version_exists(mod, form.version.data):
-            mv = ModVersion(mod=mod)
-            if populate(mv, form, post, True):
-                mv.save()
-
-                mod.versions.append(mv)
-                mod.outdated = False
-                mod.save()
-
-                self.request.flash('Version added successfully.')
-                return HTTPFound(location=self.request.route_url('viewmod', id=mod.id))
+        if 'submit' in post and form.validate():
+            if version_exists(mod, form.version.data):
+                form.version.errors.append(VERSION_EXISTS)
             else:
-                form.upload_type.errors.append('No file found')
+                mv = ModVersion(mod=mod)
+                try:
+                    with storage.ModFileChange(mv) as change:
+                        filled = populate(mv, form, post, True, change, self.max_size)
+                        if filled:
+                            mv.save()
+
+                    if filled:
+                        mod.versions.append(mv)
+                        mod.outdated = False
+                        mod.save()
+                        notifications.mod_updated(mod)
+
+                        if self.queue_upload(mv, form):
+                            self.request.flash('Version added, its file is being processed in the background.')
+                        else:
+                            self.request.flash('Version added successfully.')
+                        return HTTPFound(location=self.request.route_url('viewmod', id=mod.id))
+                    else:
+                        form.upload_type.errors.append('No file found')
+                except storage.FileTooLarge:
+                    form.upload_type.errors.append('File is too large.')
+                except NotUniqueError:
+                    # Added since the check above
+                    form.version.errors.append(VERSION_EXISTS)
 
         mv = (mod.versions[-1] if mod.versions else None)
         return self.return_dict(
@@ -37,33 +59,74 @@ class VersionViews(ViewBase):
             f=form, cancel=self.request.route_url('viewmod', id=mod.id)
         )
 
-    @view_config(route_name='quickadd')
+    @view_config(route_name='quickadd', request_method='POST')
     def quickadd(self):
-        post = self.request.params
+        post = self.request.POST
         mod = self.get_db_object(Mod, perm=False)
 
-        user = check_pass(post['username'], post['password'])
-        if not user or mod.owner != user:
+        # Prefer an API token, passwords are slow to check
+        user = token_user(self.request)
+        if user is None and 'username' in post:
+            user = check_pass(post['username'], post.get('password', ''))
+        if not user:
+            failed_attempt(self.request)
+        if not user or ref_id(mod, 'owner') != user.id:
             raise NoPermission
 
         form = QuickModVersionForm(post)
 
         if form.validate():
-            mv = ModVersion(mod=mod)
-            mv.mc_version = form.mc.data
-            mv.version = form.version.data
-            mv.mod_file = requests.get(form.url.data).content
-            mv.depends = mod.versions[-1].depends if mod.versions else []
-            mv.devel = True
-            mv.save()
-
-            mod.versions.append(mv)
-            mod.outdated = False
-            mod.save()
-            return Response("All good!")
+            try:
+                job = self.quick_add(mod, form, user)
+            except NotUniqueError:
+                return Response(VERSION_EXISTS, status=409)
+            return Response(status=202, json_body=self.job_body(job))
 
         return Response("Something went wrong...")
 
+    @view_config(route_name='apiversions', request_method='POST')
+    def apiversions(self):
+        """
+        Adds many development versions at once, for release automation. Takes
+        a JSON list of objects with mod, version, mc and url, and answers with
+        a job or an error for each.
+        """
+        user = token_user(self.request)
+        if user is None:
+            failed_attempt(self.request)
+            raise NoPermission
+
+        try:
+            entries = self.request.json_body
+        except ValueError:
+            entries = None
+        if not isinstance(entries, list) or not all(isinstance(e, dict) for e in entries):
+            return Response('Expected a JSON list of versions.', status=400)
+        if len(entries) > BULK_LIMIT:
+            return Response('At most {0} versions at once.'.format(BULK_LIMIT), status=413)
+
+        mods = {str(m.id): m for m in get_objects(Mod, [str(e.get('mod')) for e in entries])}
+        results = []
+        for entry in entries:
+            mod = mods.get(str(entry.get('mod')))
+            result = {'mod': entry.get('mod'), 'version': entry.get('version')}
+            form = QuickModVersionForm(MultiDict(
+                (k, str(v)) for k, v in entry.items() if v is not None))
+            if mod is None:
+                result['error'] = 'Mod not found.'
+            elif ref_id(mod, 'owner') != user.id:
+                result['error'] = 'You do not own this mod.'
+            elif not form.validate():
+                result['error'] = form.errors
+            else:
+                try:
+                    result.update(self.job_body(self.quick_add(mod, form, user)))
+                except NotUniqueError:
+                    result['error'] = VERSION_EXISTS
+            results.append(result)
+
+        return Response(status=202, json_body={'versions': results})
+
     @view_config(route_name='editversion', renderer='editmodversion.mak', permission='user')
     def editversion(self):
         mv = self.get_db_object(ModVersion)
@@ -71,12 +134,34 @@ class VersionViews(ViewBase):
         form = EditModVersionForm(post, mv)
 
         if 'submit' in post and form.validate():
-            if form.version.data == mv.version or not version_exists(mv.mod, form.version.data):
-                populate(mv, form, post, False)
-                mv.save()
-
-                self.request.flash('Changes to version saved.')
+            previous = mv.version
+            renamed = form.version.data != previous
+            try:
+                # Claim the new version number before touching the file
+                if renamed:
+                    ModVersion.objects(id=mv.id).update_one(set__version=form.version.data)
+
+                try:
+                    with storage.ModFileChange(mv) as change:
+                        populate(mv, form, post, False, change, self.max_size)
+                        mv.save()
+                except BaseException:
+                    # Give the number back, nothing else was saved
+                    if renamed:
+                        ModVersion.objects(id=mv.id).update_one(set__version=previous)
+                        # Pages may have been rendered with the claimed number
+                        invalidation.publish(*invalidation.document_tags(mv))
+                    raise
+
+                if self.queue_upload(mv, form):
+                    self.request.flash('Changes saved, the new file is being processed in the background.')
+                else:
+                    self.request.flash('Changes to version saved.')
                 return HTTPFound(location=self.request.route_url('viewmod', id=mv.mod.id))
+            except NotUniqueError:
+                form.version.errors.append(VERSION_EXISTS)
+            except storage.FileTooLarge:
+                form.upload_type.errors.append('File is too large.')
 
         return self.return_dict(
             title="Edit Mod Version", mods=Mod.objects, mv=mv,
@@ -90,7 +175,8 @@ class VersionViews(ViewBase):
 
         cdisp = 'attachment; filename="{0}-{1}.jar"'.format(mv.mod.name, mv.version)
         if mv.mod_file:
-            return Response(app_iter=FileIter(mv.mod_file), content_type='application/zip', content_disposition=cdisp)
+            chunks = metrics.count_bytes(FileIter(mv.mod_file), 'packassembler_gridfs_bytes_served_total')
+            return Response(app_iter=chunks, content_type='application/zip', content_disposition=cdisp)
         else:
             return HTTPFound(mv.mod_file_url)
 
@@ -100,9 +186,9 @@ class VersionViews(ViewBase):
         mv = self.get_db_object(ModVersion)
 
         if self.check_depends(mv):
-            if mv.mod_file:
-                mv.mod_file.delete()
-            mv.delete()
+            with storage.detached_mod_files(ModVersion.objects(id=mv.id)):
+                storage.clear_mod_file(mv)
+                mv.delete()
             self.request.flash('Version deleted successfully.')
             return HTTPFound(location=self.request.route_url('viewmod', id=mv.mod.id))
         else:
@@ -111,25 +197,66 @@ class VersionViews(ViewBase):
 
     @view_config(route_name='versiondetails', renderer='versiondetails.mak')
     def versiondetails(self):
-        return {'version': self.get_db_object(ModVersion, perm=False)}
+        mv = self.get_db_object(ModVersion, perm=False)
+        return {'version': mv,
+                'providers': jars.mods_providing(mv),
+                'conflicts': jars.conflicting_mods(mv)}
+
+    @property
+    def max_size(self):
+        return storage.max_size(self.request.registry.settings)
+
+    def queue_fetch(self, mv, url, owner):
+        """ Queues fetching url into mv, owner can follow the job. """
+        return jobs.enqueue('fetch_mod_file', owner=owner, version=str(mv.id),
+                            url=url, max_size=self.max_size)
+
+    def queue_upload(self, mv, form):
+        url = form.mod_file_url.data
+        if not url or form.upload_type.data == 'upload':
+            return None
+        elif form.upload_type.data == 'url_upload':
+            return self.queue_fetch(mv, url, self.current_user)
+        else:
+            # Direct links are hashed by the worker, downloads are slow
+            return jobs.enqueue('hash_mod_file_url', owner=self.current_user,
+                                version=str(mv.id), url=url)
+
+    def quick_add(self, mod, form, user):
+        """ Adds a development version and queues fetching its file for user. """
+        mv = ModVersion(mod=mod)
+        mv.mc_version = form.mc.data
+        mv.version = form.version.data
+        # Link to the file directly until the worker has stored it
+        mv.mod_file_url = form.url.data
+        mv.depends = mod.versions[-1].depends if mod.versions else []
+        mv.devel = True
+        mv.save()
+
+        mod.versions.append(mv)
+        mod.outdated = False
+        mod.save()
+        notifications.mod_updated(mod)
+
+        return self.queue_fetch(mv, form.url.data, user)
+
+    def job_body(self, job):
+        return {
+            'job': str(job.id),
+            'status': self.request.route_url('jobstatus', id=job.id)
+        }
 
 
 def get_depends(post):
-    req = []
-    for mid in post.getall('depends'):
-        try:
-            req.append(Mod.objects.get(id=mid))
-        except DoesNotExist:
-            pass
-
-    return req if req else None
+    return get_objects(Mod, post.getall('depends')) or None
 
 
 def version_exists(m, version):
-    return any(x.version == version for x in m.versions)
+    return ModVersion.objects(mod=m, version=version).only('id').first() is not None
 
 
-def populate(mv, form, post, file_required):
+def populate(mv, form, post, file_required, change, max_size=storage.MAX_SIZE):
+    """ Fills mv from form, storing or clearing its file through change. """
     mv.mc_version = form.mc_version.data
     mv.version = form.version.data
     mv.devel = form.devel.data
@@ -143,17 +270,23 @@ def populate(mv, form, post, file_required):
 
     if not file_required or file_filled:
         if file_filled:
-            if form.upload_type.data in ['upload', 'url_upload']:
-                if form.upload_type.data == 'upload':
-                    mv.mod_file = post[form.mod_file.name].file
-                else:
-                    mv.mod_file = requests.get(form.mod_file_url.data).content
+            mv.fetch_error = None
+            if form.upload_type.data == 'upload':
+                f, length = storage.open_upload(post[form.mod_file.name])
+                change.store(f, length, max_size)
                 mv.mod_file_url = None
                 mv.mod_file_url_md5 = None
+            elif form.upload_type.data == 'url_upload':
+                # The file is fetched by a worker once mv is saved, see
+                # VersionViews.queue_upload; link to it directly until then
+                if not mv.mod_file:
+                    mv.mod_file_url = form.mod_file_url.data
+                    mv.mod_file_url_md5 = None
             else:
-                mv.mod_file_url_md5, mv.mod_file_url = url_md5(form.mod_file_url.data)
-                if mv.mod_file:
-                    mv.mod_file.delete()
+                # The worker records the MD5, see VersionViews.queue_upload
+                mv.mod_file_url = form.mod_file_url.data
+                mv.mod_file_url_md5 = None
+                change.clear()
         return True
     else:
         return False
@@ -1,10 +1,12 @@
-from .common import ViewBase, url_md5
+from pyramid.response import Response, FileResponse
+from .common import ViewBase, url_md5, ref_id
 from pyramid.httpexceptions import HTTPFound
-from pyramid.response import Response
 from lxml.builder import ElementMaker
 from pyramid.view import view_config
 from ..form import PackBuildForm
 from lxml.etree import tostring
+from ..bundle import get_bundler, build_key
+from .. import metrics
 from itertools import chain
 from ..schema import *
 
@@ -76,6 +78,22 @@ class PackBuildViews(ViewBase):
     def downloadbuild(self):
         return generate_build(self.get_db_object(PackBuild, perm=False))
 
+    @view_config(route_name='downloadbundle')
+    def downloadbundle(self):
+        pb = self.get_db_object(PackBuild, perm=False)
+        bundler = get_bundler(self.request.registry)
+        cdisp = 'attachment; filename="{0}-{1}.zip"'.format(pb.pack.rid, pb.revision)
+
+        key = build_key(pb)
+        path = bundler.cached(key)
+        metrics.inc('packassembler_bundle_cache_total', result='hit' if path else 'miss')
+        if path:
+            response = FileResponse(path, request=self.request, content_type='application/zip')
+            response.content_disposition = cdisp
+            return response
+        else:
+            return Response(app_iter=bundler.stream(build_versions(pb), key), content_type='application/zip', content_disposition=cdisp)
+
     @view_config(route_name='buildbyrev', renderer='json')
     def buildbyrev(self):
         rev = int(self.request.matchdict['rev'])
@@ -118,19 +136,30 @@ def generate_build(pb):
         'build': str(pb.id),
         'revision': pb.revision
     }
-    for mv in pb.mod_versions:
+    for mv, mod in build_versions(pb):
         jdict['mods'].append({
-            'id': str(mv.mod.id),        # Mod ID
-            'name': mv.mod.name,         # Full Mod Name
-            'target': mv.mod.target,     # Mod Target
-            'version': str(mv.id),       # Download URL
+            'id': str(mod.id),          # Mod ID
+            'name': mod.name,           # Full Mod Name
+            'target': mod.target,       # Mod Target
+            'version': str(mv.id),      # Download URL
             'filename': '{0}-{1}.jar'.format(
-                mv.mod.rid, mv.version)  # What the file should be named once it's downloaded
+                mod.rid, mv.version)    # What the file should be named once it's downloaded
         })
 
     return jdict
 
 
+def build_versions(pb):
+    """
+    Pairs the mod versions of a build with their mods, using one query for
+    each instead of one per mod.
+    """
+    versions = pb.mod_versions
+    mod_ids = set(ref_id(mv, 'mod') for mv in versions)
+    mods = dict((mod.id, mod) for mod in Mod.objects(id__in=mod_ids).only('id', 'name', 'rid', 'target'))
+    return [(mv, mods[ref_id(mv, 'mod')]) for mv in versions if ref_id(mv, 'mod') in mods]
+
+
 # Build creation
 def get_mods(pack):
     return sorted(pack.mods + list(chain.from_iterable(map(get_mods, pack.bases))))
@@ -214,8 +243,8 @@ def generate_mcu_xml(request, pb, server=None):
     )
 
     # Add the mods
-    for mv in pb.mod_versions:
-        xml[0].append(mod_xml(E, request, mv))
+    for mv, mod in build_versions(pb):
+        xml[0].append(mod_xml(E, request, mv, mod))
 
     # Get the config url, if there is none in either server or pack, leave it
     # blank
@@ -243,14 +272,14 @@ def generate_mcu_xml(request, pb, server=None):
     return tostring(xml)
 
 
-def mod_xml(E, request, mv):
+def mod_xml(E, request, mv, mod):
     return E.Module(
         E.URL(request.route_url('downloadversion', id=mv.id)),
         E.Required('true'),
         E.ModType('Regular'),
         E.MD5(mv.md5),
         {
-            'id': mv.mod.rid,
-            'name': '{0} ({1})'.format(mv.mod.name, mv.version),
+            'id': mod.rid,
+            'name': '{0} ({1})'.format(mod.name, mv.version),
         }
     )
@@ -2,6 +2,7 @@ from pyramid.httpexceptions import HTTPFound
 from pyramid.response import Response
 from pyramid.view import view_config
 from ..form import PackForm
+from .. import invalidation
 from ..schema import *
 from .common import *
 
@@ -121,8 +122,11 @@ class PackViews(ViewBase):
         post = self.request.params
 
         if self.pack_perm():
+            mods = get_objects(Mod, post.getall('mods'), 'id')
             Pack.objects(id=self.request.matchdict['id']).update_one(
-                add_to_set__mods=post.getall('mods'))
+                add_to_set__mods=mods)
+            # Atomic updates don't send signals
+            self.pack_changed(*(m.id for m in mods))
 
             self.request.flash('Mod(s) added successfully.')
             return HTTPFound(self.request.route_url('viewpack', id=self.request.matchdict['id']))
@@ -134,6 +138,7 @@ class PackViews(ViewBase):
         if self.pack_perm():
             Pack.objects(id=self.request.matchdict['id']).update_one(
                 pull_all__mods=self.request.params.getall('mods'))
+            self.pack_changed(*self.request.params.getall('mods'))
 
             self.request.flash('Mod(s) removed successfully.')
             return HTTPFound(self.request.route_url('viewpack', id=self.request.matchdict['id']))
@@ -145,8 +150,10 @@ class PackViews(ViewBase):
         post = self.request.params
 
         if self.pack_perm():
+            ids = [x for x in post.getall('bases') if x != self.request.matchdict['id']]
             Pack.objects(id=self.request.matchdict['id']).update_one(
-                add_to_set__bases=[x for x in post.getall('bases') if x != self.request.matchdict['id']])
+                add_to_set__bases=get_objects(Pack, ids, 'id'))
+            self.pack_changed()
             return HTTPFound(self.request.route_url('viewpack', id=self.request.matchdict['id']))
         else:
             return HTTPForbidden()
@@ -156,9 +163,15 @@ class PackViews(ViewBase):
         if self.pack_perm():
             Pack.objects(id=self.request.matchdict['id']).update_one(
                 pull_all__bases=self.request.params.getall('bases'))
+            self.pack_changed()
             return HTTPFound(self.request.route_url('viewpack', id=self.request.matchdict['id']))
         else:
             return HTTPForbidden()
 
+    def pack_changed(self, *mod_ids):
+        # The pack list shows mod counts
+        invalidation.publish('pack:' + self.request.matchdict['id'], 'packs',
+                             *('mod:{0}'.format(i) for i in mod_ids))
+
     def pack_perm(self):
         return self.has_perm(Pack.objects(id=self.request.matchdict['id']).only('owner').first())
@@ -1,10 +1,13 @@
-from ..form import UserForm, LoginForm, SendResetForm, ResetForm, EditUserPasswordForm, EditUserAvatarForm, EditUserEmailForm, EmailUserForm
-from .common import ViewBase, validate_captcha
+from ..form import UserForm, LoginForm, SendResetForm, ResetForm, EditUserPasswordForm, EditUserAvatarForm, EditUserEmailForm, EmailUserForm, ApiTokenForm
+from .common import ViewBase, validate_captcha, ref_id
 from pyramid.view import view_config, forbidden_view_config
 from pyramid.httpexceptions import HTTPFound, HTTPForbidden
-from ..security import check_pass, password_hash
+from ..security import check_pass, password_hash, claim_tokens, revoke, new_token
 from pyramid.security import remember, forget
+from ..ratelimit import failed_attempt
+from webob.multidict import MultiDict
 import packassembler.views.email as email
+from .. import storage
 from pyramid.response import Response
 from random import getrandbits
 from datetime import datetime
@@ -30,7 +33,7 @@ class UserViews(ViewBase):
     @view_config(route_name='signup', renderer='signup.mak')
     def signup(self):
         error = ''
-        post = self.request.params
+        post = self.request.POST
         form = UserForm(post)
 
         # Make sure no one is logged in
@@ -56,6 +59,7 @@ class UserViews(ViewBase):
                     error = 'Username or Email Already in Use.'
             else:
                 error = captcha_error
+            failed_attempt(self.request)
 
         return self.return_dict(title='Signup', error=error, f=form)
 
@@ -77,7 +81,13 @@ class UserViews(ViewBase):
     @forbidden_view_config(renderer='login.mak')
     def login(self):
         error = ''
-        post = self.request.params
+        # Credentials are only checked when posted to the rate limited login
+        # route, not to every forbidden page
+        route = self.request.matched_route
+        if self.request.method == 'POST' and route and route.name == 'login':
+            post = self.request.POST
+        else:
+            post = MultiDict()
         form = LoginForm(post)
 
         # Get referrer
@@ -101,8 +111,10 @@ class UserViews(ViewBase):
                 user.last_login = datetime.now()
                 user.save()
                 return HTTPFound(location=came_from,
-                    headers=remember(self.request, user.username))
+                    headers=remember(self.request, user.username,
+                                     tokens=claim_tokens(user)))
             error = 'Invalid username or password.'
+            failed_attempt(self.request)
 
         return self.return_dict(title='Login', error=error, f=form)
 
@@ -116,7 +128,7 @@ class UserViews(ViewBase):
 
     @view_config(route_name='sendreset', renderer='genericform.mak')
     def sendreset(self):
-        post = self.request.params
+        post = self.request.POST
         form = SendResetForm(post)
 
         if 'submit' in post and form.validate():
@@ -201,22 +213,52 @@ class UserViews(ViewBase):
             return rval
 
         elif 'group' in post and self.specperm('admin'):
-            user.group = post['group']
-            user.save()
+            user = User.objects(id=user.id).modify(
+                new=True, set__group=post['group'], inc__auth_version=1)
+            revoke(user)
             return rval
 
         return self.return_dict(
             title="Edit Account", pf=password_form,
-            ef=email_form, af=avatar_form,
-            cancel=self.request.route_url('profile', id=user.id)
+            ef=email_form, af=avatar_form, tf=ApiTokenForm(),
+            tokens=ApiToken.objects(owner=user).order_by('created'),
+            owner=user, cancel=self.request.route_url('profile', id=user.id)
         )
 
+    @view_config(route_name='addtoken', renderer='newtoken.mak', permission='user')
+    def addtoken(self):
+        user = self.get_db_object(User)
+        form = ApiTokenForm(self.request.params)
+
+        if form.validate():
+            token, api_token = new_token(user, form.name.data)
+            return self.return_dict(
+                title='New API Token', token=token, api_token=api_token,
+                back=self.request.route_url('edituser', id=user.id))
+
+        self.request.flash_error('Tokens need a name.')
+        return HTTPFound(self.request.route_url('edituser', id=user.id))
+
+    @view_config(route_name='deletetoken', permission='user')
+    def deletetoken(self):
+        api_token = self.get_db_object(ApiToken)
+        owner = ref_id(api_token, 'owner')
+
+        api_token.delete()
+
+        self.request.flash('Token deleted.')
+        return HTTPFound(self.request.route_url('edituser', id=owner))
+
     @view_config(route_name='deleteuser', permission='user')
     def deleteuser(self):
         # Get user
         user = self.get_db_object(User)
 
-        user.delete()
+        # Their mods and versions go with them
+        mods = list(Mod.objects(owner=user).scalar('id'))
+        with storage.detached_mod_files(ModVersion.objects(mod__in=mods)):
+            user.delete()
+        revoke(user, deleted=True)
 
         self.request.flash('User deleted successfully.')
         headers = forget(self.request) if self.logged_in == user.username else None